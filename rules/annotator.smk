@@ -1,38 +1,101 @@
-rule annotator_smorf_types:
+rule annotator_reference_index:
     input:
-        smorf_gtf=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/{{sample}}.smorfs_shortstop.raw.gtf",
         ensembl_gtf=config["ensembl_gtf"]
     output:
-        intersect=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/lineintersect.gtf",
-        non_intersect=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/linenonintersect.gtf",
-        annotations=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/Annotations.txt"
-    threads: config.get("threads_annotator", 1)
+        done=f"{ANNOTATOR_INDEX_DIR}/reference_index.done"
+    threads: 1
     resources:
-        mem_mb=16000,
-        runtime=120
+        mem_mb=int(config.get("mem_annotator_mb", 6000)),
+        runtime=60
     conda:
         "../envs/BedTools.yaml"
     shell:
         r"""
         set -euo pipefail
-        mkdir -p "{RESULTS_SHORTSTOP_DIR}/{wildcards.sample}/shortstop"
+        mkdir -p "{ANNOTATOR_INDEX_DIR}"
 
-        python "scripts/Annotator/Annotator.py" smorf_types \
-          --smorf_gtf "{input.smorf_gtf}" \
+        python "scripts/Annotator/Annotator.py" index_reference \
           --ensembl_gtf "{input.ensembl_gtf}" \
-          --outdir "{RESULTS_SHORTSTOP_DIR}/{wildcards.sample}/shortstop" \
-          --intersect_output "{output.intersect}" \
-          --non_intersect_output "{output.non_intersect}" \
-          --output_file "{output.annotations}" \
-          --threads {threads}
+          --index_dir "{ANNOTATOR_INDEX_DIR}"
+
+        touch "{output.done}"
         """
 
+if config.get("annotator_batch", False):
+    # One job annotates the whole cohort (one worker process per thread) instead of one job per sample
+    rule annotator_smorf_types_batch:
+        input:
+            smorf_gtfs=expand(f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/{{sample}}.smorfs_shortstop.raw.gtf", sample=SAMPLES),
+            ensembl_gtf=config["ensembl_gtf"],
+            index_done=f"{ANNOTATOR_INDEX_DIR}/reference_index.done"
+        output:
+            annotations=expand(f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/Annotations.txt", sample=SAMPLES)
+        threads: config.get("threads_annotator_batch", 8)
+        resources:
+            mem_mb=int(config.get("mem_annotator_mb", 6000)),
+            runtime=120
+        conda:
+            "../envs/BedTools.yaml"
+        shell:
+            r"""
+            set -euo pipefail
+
+            python "scripts/Annotator/Annotator.py" smorf_types_batch \
+              --smorf_gtfs {input.smorf_gtfs} \
+              --ensembl_gtf "{input.ensembl_gtf}" \
+              --index_dir "{ANNOTATOR_INDEX_DIR}" \
+              --outdir "{RESULTS_SHORTSTOP_DIR}/annotator_batch" \
+              --output_name "Annotations.txt" \
+              --threads {threads}
+            """
+
+else:
+    rule annotator_smorf_types:
+        input:
+            smorf_gtf=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/{{sample}}.smorfs_shortstop.raw.gtf",
+            ensembl_gtf=config["ensembl_gtf"],
+            # only the native engine reads the shared reference index
+            index_done=[] if ANNOTATOR_ENGINE == "bedtools" else f"{ANNOTATOR_INDEX_DIR}/reference_index.done"
+        output:
+            annotations=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/Annotations.txt",
+            # the bedtools engine writes its two intersect passes next to the annotations
+            **({
+                "intersect": f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/lineintersect.gtf",
+                "non_intersect": f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/linenonintersect.gtf",
+            } if ANNOTATOR_ENGINE == "bedtools" else {})
+        threads: config.get("threads_annotator", 1)
+        resources:
+            mem_mb=int(config.get("mem_annotator_mb", 6000)),
+            runtime=120
+        params:
+            engine=ANNOTATOR_ENGINE,
+            index_args="" if ANNOTATOR_ENGINE == "bedtools" else f'--index_dir "{ANNOTATOR_INDEX_DIR}"'
+        conda:
+            "../envs/BedTools.yaml"
+        shell:
+            r"""
+            set -euo pipefail
+            mkdir -p "{RESULTS_SHORTSTOP_DIR}/{wildcards.sample}/shortstop"
+
+            python "scripts/Annotator/Annotator.py" smorf_types \
+              --smorf_gtf "{input.smorf_gtf}" \
+              --ensembl_gtf "{input.ensembl_gtf}" \
+              --engine "{params.engine}" \
+              {params.index_args} \
+              --outdir "{RESULTS_SHORTSTOP_DIR}/{wildcards.sample}/shortstop" \
+              --intersect_output "{RESULTS_SHORTSTOP_DIR}/{wildcards.sample}/shortstop/lineintersect.gtf" \
+              --non_intersect_output "{RESULTS_SHORTSTOP_DIR}/{wildcards.sample}/shortstop/linenonintersect.gtf" \
+              --output_file "{output.annotations}" \
+              --threads {threads}
+            """
+
 rule annotate_smorfs_gtf:
     input:
         smorf_gtf=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/{{sample}}.smorfs_shortstop.raw.gtf",
         annotations=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/Annotations.txt"
     output:
-        annotated_gtf=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/{{sample}}.smorfs_shortstop.gtf"
+        annotated_gtf=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/{{sample}}.smorfs_shortstop.gtf",
+        smorf_types=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/{{sample}}.smorfs_shortstop.smorf_types.tsv"
     threads: 1
     resources:
         mem_mb=4000,
@@ -45,5 +108,6 @@ rule annotate_smorfs_gtf:
         python "scripts/add_smorf_type_to_gtf.py" \
           --gtf "{input.smorf_gtf}" \
           --annotations "{input.annotations}" \
-          --out "{output.annotated_gtf}"
+          --out "{output.annotated_gtf}" \
+          --sidecar "{output.smorf_types}"
         """
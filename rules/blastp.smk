@@ -28,53 +28,94 @@ rule make_human_proteome_blastdb:
 rule blastp_human_homology_locus_summary:
     input:
         db_done=f"{OUTDIR}/blastdb/human_proteome.db.done",
-        loci_csv=f"{COHORT_PREFIX}.all_loci.with_tpms.csv",
+        proteome_fa=HUMAN_PROTEOME_FA,
+        loci_csv=f"{COHORT_PREFIX}.all_loci.with_tpms{TABLE_EXT}",
         script=config["blastp_append_script"]
     output:
         out_csv=f"{COHORT_PREFIX}.all_loci.with_tpms.blastp_human.csv"
     threads: 8
     resources:
-        mem_mb=24000,
+        mem_mb=8000,
         runtime=240
     params:
         db_prefix=HUMAN_DB_PREFIX,
-        evalue=BLAST_EVALUE
+        evalue=BLAST_EVALUE,
+        cache=BLASTP_CACHE,
+        shards=config.get("blastp_shards", 1),
+        exact="1" if BLASTP_EXACT_MATCH else "",
+        index_dir=PROTEOME_INDEX_DIR
     conda:
         "../envs/BlastP.yaml"
     shell:
         r"""
         set -euo pipefail
+
+        CACHE_ARGS=""
+        if [ -n "{params.cache}" ]; then
+          CACHE_ARGS="--cache {params.cache}"
+        fi
+
+        EXACT_ARGS=""
+        if [ -n "{params.exact}" ]; then
+          EXACT_ARGS="--proteome_fa {input.proteome_fa} --proteome_index_dir {params.index_dir}"
+        fi
+
         python "{input.script}" \
           --in_csv "{input.loci_csv}" \
           --out_csv "{output.out_csv}" \
           --db "{params.db_prefix}" \
           --evalue {params.evalue} \
-          --threads {threads}
+          --threads {threads} \
+          --shards {params.shards} \
+          $CACHE_ARGS \
+          $EXACT_ARGS
         """
 
 rule blastp_human_homology_shared_summary:
     input:
         db_done=f"{OUTDIR}/blastdb/human_proteome.db.done",
-        shared_csv=f"{COHORT_PREFIX}.shared_ge{MIN_PATIENTS}.with_tpms.csv",
+        proteome_fa=HUMAN_PROTEOME_FA,
+        shared_csv=f"{COHORT_PREFIX}.shared_ge{MIN_PATIENTS}.with_tpms{TABLE_EXT}",
+        # shared_ge{N} is a subset of all_loci: running after it, every peptide is a cache hit
+        # (without the cache there is nothing to reuse, so both rules run in parallel)
+        all_loci_blastp=f"{COHORT_PREFIX}.all_loci.with_tpms.blastp_human.csv" if BLASTP_CACHE else [],
         script=config["blastp_append_script"]
     output:
         out_csv=f"{COHORT_PREFIX}.shared_ge{MIN_PATIENTS}.with_tpms.blastp_human.csv"
     threads: 8
     resources:
-        mem_mb=24000,
+        mem_mb=8000,
         runtime=240
     params:
         db_prefix=HUMAN_DB_PREFIX,
-        evalue=BLAST_EVALUE
+        evalue=BLAST_EVALUE,
+        cache=BLASTP_CACHE,
+        shards=config.get("blastp_shards", 1),
+        exact="1" if BLASTP_EXACT_MATCH else "",
+        index_dir=PROTEOME_INDEX_DIR
     conda:
         "../envs/BlastP.yaml"
     shell:
         r"""
         set -euo pipefail
+
+        CACHE_ARGS=""
+        if [ -n "{params.cache}" ]; then
+          CACHE_ARGS="--cache {params.cache}"
+        fi
+
+        EXACT_ARGS=""
+        if [ -n "{params.exact}" ]; then
+          EXACT_ARGS="--proteome_fa {input.proteome_fa} --proteome_index_dir {params.index_dir}"
+        fi
+
         python "{input.script}" \
           --in_csv "{input.shared_csv}" \
           --out_csv "{output.out_csv}" \
           --db "{params.db_prefix}" \
           --evalue {params.evalue} \
-          --threads {threads}
+          --threads {threads} \
+          --shards {params.shards} \
+          $CACHE_ARGS \
+          $EXACT_ARGS
         """
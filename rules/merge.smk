@@ -3,7 +3,7 @@ rule merge_shortstop_output:
         predict_done=f"{RESULTS_SHORTSTOP_DIR}/{{sample}}/shortstop/predict.done",
         script=lambda wc: config["merge_script"]
     output:
-        merged=f"{MERGED_DIR}/{{sample}}.merged.csv"
+        merged=f"{MERGED_DIR}/{{sample}}.merged{TABLE_EXT}"
     threads: 1
     resources:
         mem_mb=8000,
@@ -11,7 +11,8 @@ rule merge_shortstop_output:
     params:
         root=RESULTS_SHORTSTOP_DIR,
         outdir=MERGED_DIR,
-        min_prob=config.get("min_prob", None)
+        min_prob=config.get("min_prob", None),
+        table_format=TABLE_FORMAT
     conda:
         "../envs/smORFs.yaml"
     shell:
@@ -28,6 +29,7 @@ rule merge_shortstop_output:
           --root "{params.root}" \
           --outdir "{params.outdir}" \
           --samples "{wildcards.sample}" \
+          --format {params.table_format} \
           $MINPROB_ARGS
 
         test -s "{output.merged}"
@@ -35,11 +37,11 @@ rule merge_shortstop_output:
 
 rule aggregate_smorfs_by_locus:
     input:
-        merged_csvs=expand(f"{MERGED_DIR}/{{sample}}.merged.csv", sample=SAMPLES),
+        merged_tables=expand(f"{MERGED_DIR}/{{sample}}.merged{TABLE_EXT}", sample=SAMPLES),
         script=lambda wc: config["aggregate_script"]
     output:
-        all_loci=f"{COHORT_PREFIX}.all_loci.csv",
-        shared=f"{COHORT_PREFIX}.shared_ge{MIN_PATIENTS}.csv"
+        all_loci=f"{COHORT_PREFIX}.all_loci{TABLE_EXT}",
+        shared=f"{COHORT_PREFIX}.shared_ge{MIN_PATIENTS}{TABLE_EXT}"
     threads: 1
     resources:
         mem_mb=12000,
@@ -47,7 +49,9 @@ rule aggregate_smorfs_by_locus:
     params:
         merged_dir=MERGED_DIR,
         out_prefix=COHORT_PREFIX,
-        min_patients=MIN_PATIENTS
+        min_patients=MIN_PATIENTS,
+        store=config.get("locus_store", ""),
+        table_format=TABLE_FORMAT
     conda:
         "../envs/smORFs.yaml"
     shell:
@@ -55,10 +59,17 @@ rule aggregate_smorfs_by_locus:
         set -euo pipefail
         mkdir -p "$(dirname "{params.out_prefix}")"
 
+        STORE_ARGS=""
+        if [ -n "{params.store}" ]; then
+          STORE_ARGS="--store {params.store}"
+        fi
+
         python "{input.script}" \
           --merged_dir "{params.merged_dir}" \
           --out_prefix "{params.out_prefix}" \
-          --min_patients {params.min_patients}
+          --min_patients {params.min_patients} \
+          --format {params.table_format} \
+          $STORE_ARGS
 
         test -s "{output.all_loci}"
         test -s "{output.shared}"
@@ -1,12 +1,13 @@
 rule make_smorf_rsem_inputs:
     input:
-        loci_csv=f"{COHORT_PREFIX}.all_loci.csv",
+        loci_csv=f"{COHORT_PREFIX}.all_loci{TABLE_EXT}",
         script=lambda wc: config["make_smorf_rsem_ref_script"]
     output:
         fasta=f"{RSEM_REF_DIR}/smorfs.cds.fa",
-        tx2gene=f"{RSEM_REF_DIR}/smorfs.tx2gene.tsv"
+        tx2gene=f"{RSEM_REF_DIR}/smorfs.tx2gene.tsv",
+        locus_map=f"{RSEM_REF_DIR}/smorfs.locus2tx.tsv"
     resources:
-        mem_mb=32000,
+        mem_mb=4000,
         runtime=240
     conda:
         "../envs/smORFs.yaml"
@@ -18,18 +19,21 @@ rule make_smorf_rsem_inputs:
         python "{input.script}" \
           --loci_csv "{input.loci_csv}" \
           --fasta "{output.fasta}" \
-          --tx2gene "{output.tx2gene}"
+          --tx2gene "{output.tx2gene}" \
+          --locus_map "{output.locus_map}"
 
         test -s "{output.fasta}"
         test -s "{output.tx2gene}"
         """
 
-rule rsem_prepare_smorf_reference:
+checkpoint rsem_prepare_smorf_reference:
     input:
         fasta=f"{RSEM_REF_DIR}/smorfs.cds.fa",
-        tx2gene=f"{RSEM_REF_DIR}/smorfs.tx2gene.tsv"
+        tx2gene=f"{RSEM_REF_DIR}/smorfs.tx2gene.tsv",
+        script="scripts/prepare_rsem_reference.py"
     output:
-        done=f"{RSEM_REF_DIR}/rsem_ref.done"
+        # Digest of the sequence set; the reference itself is {RSEM_REF_CACHE}/<digest>/smorfs.*
+        digest=f"{RSEM_REF_DIR}/rsem_ref.digest"
     resources:
         mem_mb=32000,
         runtime=240
@@ -38,21 +42,54 @@ rule rsem_prepare_smorf_reference:
     shell:
         r"""
         set -euo pipefail
-        mkdir -p "{RSEM_REF_DIR}"
-
-        rsem-prepare-reference \
-          --transcript-to-gene-map "{input.tx2gene}" \
-          --bowtie2 \
-          "{input.fasta}" "{RSEM_REF_PREFIX}"
+        mkdir -p "{RSEM_REF_DIR}" "{RSEM_REF_CACHE}"
 
-        touch "{output.done}"
+        python "{input.script}" \
+          --fasta "{input.fasta}" \
+          --tx2gene "{input.tx2gene}" \
+          --cache_dir "{RSEM_REF_CACHE}" \
+          --digest_out "{output.digest}"
         """
 
-rule rsem_align_smorf_bowtie2:
+rule prefilter_smorf_reads:
     input:
         r1=fastq_r1,
         r2=fastq_r2,
-        ref_done=f"{RSEM_REF_DIR}/rsem_ref.done"
+        ref_done=rsem_ref_done,
+        script="scripts/prefilter_smorf_reads.py"
+    output:
+        r1=temp(f"{RSEM_DIR}/{{sample}}/{{sample}}.prefilter_R1.fq"),
+        r2=temp(f"{RSEM_DIR}/{{sample}}/{{sample}}.prefilter_R2.fq"),
+        stats=f"{RSEM_DIR}/{{sample}}/{{sample}}.prefilter.json"
+    threads: config.get("threads_rsem_prefilter", 8)
+    resources:
+        mem_mb=8000,
+        runtime=240
+    params:
+        # the FASTA of the cached reference: unchanged sequences keep it (and the BAMs) up to date
+        fasta=lambda wc: rsem_ref_prefix(wc) + ".cds.fa",
+        k=config.get("rsem_prefilter_k", 19)
+    conda:
+        "../envs/RSEM.yaml"
+    shell:
+        r"""
+        set -euo pipefail
+        mkdir -p "{RSEM_DIR}/{wildcards.sample}"
+
+        python "{input.script}" \
+          --fasta "{params.fasta}" \
+          --r1 "{input.r1}" --r2 "{input.r2}" \
+          --out_r1 "{output.r1}" --out_r2 "{output.r2}" \
+          --stats "{output.stats}" \
+          -k {params.k} \
+          --threads {threads}
+        """
+
+rule rsem_align_smorf_bowtie2:
+    input:
+        r1=rsem_align_r1,
+        r2=rsem_align_r2,
+        ref_done=rsem_ref_done
     output:
         bam=f"{RSEM_DIR}/{{sample}}/{{sample}}.bowtie2.bam",
         log=f"{RSEM_DIR}/{{sample}}/{{sample}}.bowtie2.log"
@@ -61,7 +98,7 @@ rule rsem_align_smorf_bowtie2:
         mem_mb=32000,
         runtime=600
     params:
-        ref=RSEM_REF_PREFIX
+        ref=rsem_ref_prefix
     conda:
         "../envs/RSEM.yaml"
     shell:
@@ -86,61 +123,147 @@ rule rsem_align_smorf_bowtie2:
         test -s "{output.bam}"
         """
 
-rule rsem_quant_smorf:
-    input:
-        bam=f"{RSEM_DIR}/{{sample}}/{{sample}}.bowtie2.bam",
-        ref_done=f"{RSEM_REF_DIR}/rsem_ref.done"
-    output:
-        isoforms=f"{RSEM_DIR}/{{sample}}/{{sample}}.isoforms.results",
-        genes=f"{RSEM_DIR}/{{sample}}/{{sample}}.genes.results"
-    threads: config.get("threads_rsem_em", 8)
-    resources:
-        mem_mb=32000,
-        runtime=600
-    params:
-        ref=RSEM_REF_PREFIX,
-        stranded=config.get("rsem_strandedness", "none")
-    conda:
-        "../envs/RSEM.yaml"
-    shell:
-        r"""
-        set -euo pipefail
-        mkdir -p "{RSEM_DIR}/{wildcards.sample}"
+if QUANT_BACKEND == "kmer":
+    # Pseudo-alignment of the raw FASTQs: no bowtie2 index, BAM or RSEM run
+    rule kmer_quant_smorf:
+        input:
+            r1=fastq_r1,
+            r2=fastq_r2,
+            fasta=f"{RSEM_REF_DIR}/smorfs.cds.fa",
+            tx2gene=f"{RSEM_REF_DIR}/smorfs.tx2gene.tsv",
+            script="scripts/kmer_quant_smorfs.py"
+        output:
+            isoforms=f"{RSEM_DIR}/{{sample}}/{{sample}}.isoforms.results"
+        threads: config.get("threads_kmer_quant", 8)
+        resources:
+            mem_mb=8000,
+            runtime=240
+        params:
+            k=config.get("kmer_quant_k", 25),
+            frag_mean=config.get("kmer_quant_frag_mean", 200),
+            frag_sd=config.get("kmer_quant_frag_sd", 80)
+        conda:
+            "../envs/smORFs.yaml"
+        shell:
+            r"""
+            set -euo pipefail
+            mkdir -p "{RSEM_DIR}/{wildcards.sample}"
 
-        rsem-calculate-expression \
-          --paired-end \
-          --alignments \
-          -p {threads} \
-          --strandedness "{params.stranded}" \
-          "{input.bam}" \
-          "{params.ref}" \
-          "{RSEM_DIR}/{wildcards.sample}/{wildcards.sample}"
-
-        test -s "{output.isoforms}"
-        test -s "{output.genes}"
-        """
+            python "{input.script}" \
+              --fasta "{input.fasta}" \
+              --tx2gene "{input.tx2gene}" \
+              --r1 "{input.r1}" --r2 "{input.r2}" \
+              --out "{output.isoforms}" \
+              -k {params.k} \
+              --frag_mean {params.frag_mean} --frag_sd {params.frag_sd} \
+              --threads {threads}
+            """
+
+elif QUANT_BACKEND == "bam":
+    # Fragments on each locus's CDS span in the STAR BAMs: no FASTQ realignment, one job for all samples
+    rule bam_quant_smorf:
+        input:
+            loci_csv=f"{COHORT_PREFIX}.all_loci{TABLE_EXT}",
+            bams=expand(f"{OUTDIR}/star/{{sample}}.aligned.bam", sample=SAMPLES),
+            bais=expand(f"{OUTDIR}/star/{{sample}}.aligned.bam.bai", sample=SAMPLES),
+            script="scripts/bam_quant_smorfs.py"
+        output:
+            isoforms=expand(f"{RSEM_DIR}/{{sample}}/{{sample}}.isoforms.results", sample=SAMPLES)
+        threads: config.get("threads_bam_quant", 8)
+        resources:
+            mem_mb=8000,
+            runtime=240
+        params:
+            bams=" ".join(f"{s}={star_bam(s)}" for s in SAMPLES),
+            stranded=config.get("rsem_strandedness", "none"),
+            min_mapq=config.get("bam_quant_min_mapq", 0)
+        conda:
+            "../envs/smORFs.yaml"
+        shell:
+            r"""
+            set -euo pipefail
+            mkdir -p "{RSEM_DIR}"
+
+            python "{input.script}" \
+              --loci_csv "{input.loci_csv}" \
+              --bams {params.bams} \
+              --out_dir "{RSEM_DIR}" \
+              --strandedness "{params.stranded}" \
+              --min_mapq {params.min_mapq} \
+              --jobs {threads}
+            """
+
+else:
+    rule rsem_quant_smorf:
+        input:
+            bam=f"{RSEM_DIR}/{{sample}}/{{sample}}.bowtie2.bam",
+            ref_done=rsem_ref_done
+        output:
+            isoforms=f"{RSEM_DIR}/{{sample}}/{{sample}}.isoforms.results",
+            genes=f"{RSEM_DIR}/{{sample}}/{{sample}}.genes.results"
+        threads: config.get("threads_rsem_em", 8)
+        resources:
+            mem_mb=32000,
+            runtime=600
+        params:
+            ref=rsem_ref_prefix,
+            stranded=config.get("rsem_strandedness", "none")
+        conda:
+            "../envs/RSEM.yaml"
+        shell:
+            r"""
+            set -euo pipefail
+            mkdir -p "{RSEM_DIR}/{wildcards.sample}"
+
+            rsem-calculate-expression \
+              --paired-end \
+              --alignments \
+              -p {threads} \
+              --strandedness "{params.stranded}" \
+              "{input.bam}" \
+              "{params.ref}" \
+              "{RSEM_DIR}/{wildcards.sample}/{wildcards.sample}"
+
+            test -s "{output.isoforms}"
+            test -s "{output.genes}"
+            """
 
 rule add_rsem_tpms_to_locus_summary:
     input:
-        all_loci=f"{COHORT_PREFIX}.all_loci.csv",
-        shared=f"{COHORT_PREFIX}.shared_ge{MIN_PATIENTS}.csv",
+        all_loci=f"{COHORT_PREFIX}.all_loci{TABLE_EXT}",
+        shared=f"{COHORT_PREFIX}.shared_ge{MIN_PATIENTS}{TABLE_EXT}",
         rsem_isoforms=expand(f"{RSEM_DIR}/{{sample}}/{{sample}}.isoforms.results", sample=SAMPLES),
+        # the BAM backend quantifies loci directly; the others quantify collapsed CDS transcripts
+        locus_map=[] if QUANT_BACKEND == "bam" else f"{RSEM_REF_DIR}/smorfs.locus2tx.tsv",
         script=lambda wc: config["add_rsem_tpms_script"]
     output:
-        all_loci_tpm=f"{COHORT_PREFIX}.all_loci.with_tpms.csv",
-        shared_tpm=f"{COHORT_PREFIX}.shared_ge{MIN_PATIENTS}.with_tpms.csv"
-    threads: 1
+        all_loci_tpm=f"{COHORT_PREFIX}.all_loci.with_tpms{TABLE_EXT}",
+        shared_tpm=f"{COHORT_PREFIX}.shared_ge{MIN_PATIENTS}.with_tpms{TABLE_EXT}",
+        # locus x sample TPM matrix, only with tpm_matrix: true
+        **({"matrix": TPM_MATRIX} if TPM_MATRIX else {})
+    threads: config.get("threads_add_tpms", 4)
     resources:
         mem_mb=16000
+    params:
+        matrix_args=f'--matrix_out "{TPM_MATRIX}"' if TPM_MATRIX else "",
+        collapsed_tpm=config.get("rsem_collapsed_tpm", "copy")
     conda:
         "../envs/smORFs.yaml"
     shell:
         r"""
         set -euo pipefail
+
+        LOCUS_MAP_ARGS=""
+        if [ -n "{input.locus_map}" ]; then
+          LOCUS_MAP_ARGS="--locus_map {input.locus_map} --collapsed_tpm {params.collapsed_tpm}"
+        fi
+
         python "{input.script}" \
           --all_loci_csv "{input.all_loci}" \
           --shared_csv "{input.shared}" \
           --rsem_dir "{RSEM_DIR}" \
           --out_all_loci_csv "{output.all_loci_tpm}" \
-          --out_shared_csv "{output.shared_tpm}"
+          --out_shared_csv "{output.shared_tpm}" \
+          --jobs {threads} \
+          {params.matrix_args} $LOCUS_MAP_ARGS
         """
@@ -23,9 +23,9 @@ rule filter_smorfs:
           --min_len {config[min_aa]} \
           --max_len {config[max_aa]} \
           --out_fasta "{output.smorfs_fa}" \
-          --out_ids "{output.ids}"
-
-        grep -F -f "{output.ids}" "{input.gff3}" > "{output.smorfs_gff3}"
+          --out_ids "{output.ids}" \
+          --gff3 "{input.gff3}" \
+          --out_gff3 "{output.smorfs_gff3}"
 
         test -s "{output.smorfs_fa}"
         test -s "{output.ids}"
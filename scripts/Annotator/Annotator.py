@@ -3,6 +3,10 @@
 import os
 import sys
 import argparse
+
+# Shared helpers (gtf_stream) live in the parent scripts/ directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from src.pipeline import Pipeline
 
 
@@ -20,7 +24,7 @@ class Annotator:
         self.mode_parser.add_argument(
             "mode",
             metavar="Mode",
-            help="Mode to run the pipeline for.\nList of Modes: smorf_types"
+            help="Mode to run the pipeline for.\nList of Modes: smorf_types, smorf_types_batch, index_reference"
         )
 
         # Parse the first set of arguments to get the mode
@@ -28,7 +32,7 @@ class Annotator:
         self.mode = self.args.mode
 
         # Check for supported modes
-        supported_modes = ["smorf_types"]
+        supported_modes = ["smorf_types", "smorf_types_batch", "index_reference"]
         if self.mode not in supported_modes:
             self.main_parser.error(f"Unsupported mode '{self.mode}'. Supported modes: {', '.join(supported_modes)}")
 
@@ -53,25 +57,53 @@ class Annotator:
         # Ensure output directory exists
         os.makedirs(args.outdir, exist_ok=True)
 
+        # The index cache follows --outdir unless given explicitly
+        if self.mode in ('smorf_types_batch', 'index_reference') and args.index_dir is None:
+            args.index_dir = os.path.join(args.outdir, "reference_index")
+
         return args
 
     def __configure_mode(self):
         if self.mode == 'smorf_types':
             self.__set_annotator_mode()
+        elif self.mode == 'smorf_types_batch':
+            self.__set_batch_mode()
+        elif self.mode == 'index_reference':
+            self.__set_index_mode()
 
     def __set_annotator_mode(self):
         self.modeArguments = self.parser.add_argument_group("Training mode options")
         self.modeArguments.add_argument("--smorf_gtf", help="Provide the smORF GTF file", required=True)
         self.modeArguments.add_argument("--ensembl_gtf", help="Provide the ENSEMBL GTF file", required=True)
+        self.modeArguments.add_argument("--engine", help="Overlap engine: 'native' (in-process interval index) or 'bedtools'", choices=["native", "bedtools"], default="native")
+        self.modeArguments.add_argument("--index_dir", help="Reference index cache directory (native engine). The index is reused while the ENSEMBL GTF checksum is unchanged", default=None)
         self.modeArguments.add_argument("--intersect_output", help="Provide the intersect output file", default=f"{self.general_args.get_default('outdir')}/intersect.gtf")
         self.modeArguments.add_argument("--non_intersect_output", help="Provide the non-intersect output file", default=f"{self.general_args.get_default('outdir')}/nonintersect.gtf")
         self.modeArguments.add_argument("--output_file", help="Provide the output file", default=f"{self.general_args.get_default('outdir')}/smORF_annotation.txt")
 
+    def __set_batch_mode(self):
+        self.modeArguments = self.parser.add_argument_group("Batch mode options")
+        self.modeArguments.add_argument("--smorf_gtfs", help="smORF GTF files and/or directories to search for them", nargs="+", required=True)
+        self.modeArguments.add_argument("--pattern", help="File name pattern of the smORF GTFs inside directories", default="*.smorfs_shortstop.raw.gtf")
+        self.modeArguments.add_argument("--ensembl_gtf", help="Provide the ENSEMBL GTF file", required=True)
+        self.modeArguments.add_argument("--index_dir", help="Reference index cache directory (default: <outdir>/reference_index)", default=None)
+        self.modeArguments.add_argument("--output_name", help="Annotation file written next to each smORF GTF", default="Annotations.txt")
+
+    def __set_index_mode(self):
+        self.modeArguments = self.parser.add_argument_group("Index mode options")
+        self.modeArguments.add_argument("--ensembl_gtf", help="Provide the ENSEMBL GTF file", required=True)
+        self.modeArguments.add_argument("--index_dir", help="Reference index cache directory (default: <outdir>/reference_index)", default=None)
 
     def execute(self):
         if self.mode == 'smorf_types':
             pipeline = Pipeline(args=self.args)
             pipeline.annotate()
+        elif self.mode == 'smorf_types_batch':
+            pipeline = Pipeline(args=self.args)
+            pipeline.annotate_batch()
+        elif self.mode == 'index_reference':
+            pipeline = Pipeline(args=self.args)
+            pipeline.index_reference()
 
 if __name__ == '__main__':
     print("""
@@ -1,2 +1,3 @@
 from .bedtools_smorf_intersect import BedtoolsRunner
-from .smorf_annotator import smORFAnnotator
\ No newline at end of file
+from .smorf_annotator import smORFAnnotator
+from .reference_index import ReferenceIndex
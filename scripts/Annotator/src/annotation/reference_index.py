@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import mmap
+import hashlib
+from array import array
+from bisect import bisect_left
+from gtf_stream import iter_records
+from .smorf_annotator import gene_profile
+
+# === bedtools binning scheme (BinTree) ===
+# Offsets are copied verbatim from bedtools, including the historical "32678".
+# Only the order of the levels matters here: bedtools reports the hits of a
+# query level by level (smallest bins first), bin by bin, and in file order
+# inside each bin. Reproducing that order keeps the conflict resolution of
+# smORFAnnotator identical to the bedtools engine.
+BIN_OFFSETS = (32678 + 4096 + 512 + 64 + 8 + 1, 4096 + 512 + 64 + 8 + 1, 512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0)
+BIN_FIRST_SHIFT = 14
+BIN_NEXT_SHIFT = 3
+
+# === On-disk index layout ===
+# MAGIC | header length (uint64, little endian) | JSON header | 8-byte aligned sections
+INDEX_MAGIC = b'SMORFIDX'
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.annidx'
+CHROM_ARRAYS = ('bins', 'bin_offsets', 'starts', 'ends', 'profiles')
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """
+    Content checksum of a file; keys the on-disk reference index.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _padded(nbytes):
+    return (nbytes + 7) & ~7
+
+
+def get_bin(start, end):
+    """
+    Returns the bedtools bin of a 0-based, half-open interval.
+    """
+    end -= 1
+    start >>= BIN_FIRST_SHIFT
+    end >>= BIN_FIRST_SHIFT
+    for offset in BIN_OFFSETS:
+        if start == end:
+            return offset + start
+        start >>= BIN_NEXT_SHIFT
+        end >>= BIN_NEXT_SHIFT
+    return 0
+
+
+class ChromIndex:
+    """
+    Records of one chromosome, grouped by bin and kept in file order inside each bin.
+    bins/bin_offsets are parallel: records of bins[i] live in [bin_offsets[i], bin_offsets[i + 1]).
+    """
+    def __init__(self, bins, bin_offsets, starts, ends, strands, profiles):
+        self.bins = bins
+        self.bin_offsets = bin_offsets
+        self.starts = starts
+        self.ends = ends
+        self.strands = strands
+        self.profiles = profiles
+
+    def hits(self, start, end, strand):
+        """
+        Yields the profile ids of same-strand records overlapping [start, end),
+        in the order `bedtools intersect -s` reports them.
+        """
+        bins, bin_offsets = self.bins, self.bin_offsets
+        starts, ends, strands, profiles = self.starts, self.ends, self.strands, self.profiles
+        n_bins = len(bins)
+        start_bin = start >> BIN_FIRST_SHIFT
+        end_bin = (end - 1) >> BIN_FIRST_SHIFT
+        for offset in BIN_OFFSETS:
+            lo_bin = start_bin + offset
+            hi_bin = end_bin + offset
+            i = bisect_left(bins, lo_bin)
+            while i < n_bins and bins[i] <= hi_bin:
+                for j in range(bin_offsets[i], bin_offsets[i + 1]):
+                    if strands[j] == strand and starts[j] < end and ends[j] > start:
+                        yield profiles[j]
+                i += 1
+            start_bin >>= BIN_NEXT_SHIFT
+            end_bin >>= BIN_NEXT_SHIFT
+
+
+class ProfileTable:
+    """
+    Profiles stored as four string ids each, resolved against an interned string table.
+    Behaves like the list of profile tuples of an index built in memory.
+    """
+    def __init__(self, strings, ids):
+        self.strings = strings
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids) // 4
+
+    def __getitem__(self, profile_id):
+        strings, ids = self.strings, self.ids
+        k = 4 * profile_id
+        return (strings[ids[k]], strings[ids[k + 1]], strings[ids[k + 2]], strings[ids[k + 3]])
+
+
+class ReferenceIndex:
+    """
+    Strand-aware interval index of a reference GTF (Ensembl/GENCODE).
+
+    Every record is reduced to its coordinates, strand and a profile id; profiles
+    are the distinct (feature_type, gene_name, gene_biotype, transcript_biotype)
+    tuples found in the GTF, so the annotation of a hit only has to be decided
+    once per profile instead of once per overlapping line.
+    """
+    def __init__(self, chroms, profiles, buffer=None, path=None):
+        self.chroms = chroms
+        self.profiles = profiles
+        # Keeps the memory map alive while the arrays point into it
+        self.buffer = buffer
+        # On-disk copy of the index, if any
+        self.path = path
+
+    @classmethod
+    def cached(cls, gtf_path, index_dir):
+        """
+        Returns the index of gtf_path from index_dir, compiling and storing it first if
+        there is no index for the current content of the GTF.
+        """
+        checksum = file_checksum(gtf_path)
+        index_path = os.path.join(index_dir, f"{checksum}{INDEX_SUFFIX}")
+
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(index_path)
+                print(f"Reference index '{index_path}' loaded.")
+                return index
+            except ValueError as e:
+                print(f"Ignoring reference index '{index_path}': {e}")
+
+        print(f"Indexing reference annotation '{gtf_path}'...")
+        index = cls.from_gtf(gtf_path)
+        os.makedirs(index_dir, exist_ok=True)
+        index.save(index_path, checksum=checksum, source=gtf_path)
+        print(f"Reference index '{index_path}' created successfully.")
+        return index
+
+    @classmethod
+    def load(cls, index_path):
+        """
+        Memory-maps an index written by save(). Arrays are views on the file, so
+        loading is independent of the size of the reference and the pages are
+        shared between every process using the same index.
+        """
+        with open(index_path, 'rb') as fh:
+            buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+
+        if bytes(view[:8]) != INDEX_MAGIC:
+            raise ValueError("not a reference index file")
+        header_len = int.from_bytes(view[8:16], 'little')
+        header = json.loads(bytes(view[16:16 + header_len]).decode('utf-8'))
+        if header['version'] != INDEX_VERSION:
+            raise ValueError(f"index version {header['version']} (expected {INDEX_VERSION})")
+        if header['byteorder'] != sys.byteorder or header['itemsize'] != array('I').itemsize:
+            raise ValueError("index was written on an incompatible platform")
+        base = 16 + _padded(header_len)
+
+        def section(offset, nbytes, fmt='I'):
+            return view[base + offset:base + offset + nbytes].cast(fmt)
+
+        offset, nbytes = header['strings']
+        strings = bytes(section(offset, nbytes, 'B')).decode('utf-8').split('\n')
+        offset, nbytes = header['profiles']
+        profiles = ProfileTable(strings, section(offset, nbytes))
+
+        chroms = {}
+        for name, sections in header['chroms'].items():
+            arrays = {key: section(*sections[key]) for key in CHROM_ARRAYS}
+            chroms[name] = ChromIndex(
+                arrays['bins'],
+                arrays['bin_offsets'],
+                arrays['starts'],
+                arrays['ends'],
+                section(*sections['strands'], 'B'),
+                arrays['profiles'],
+            )
+
+        return cls(chroms, profiles, buffer=buffer, path=index_path)
+
+    def save(self, index_path, checksum, source=None):
+        """
+        Writes the index in the binary layout read by load(). The file is written next
+        to its final path and renamed, so concurrent jobs never see a partial index.
+        """
+        # Interned string table shared by all profile fields
+        strings = []
+        string_ids = {}
+        profile_ids = array('I')
+        for i in range(len(self.profiles)):
+            for value in self.profiles[i]:
+                string_id = string_ids.get(value)
+                if string_id is None:
+                    string_id = string_ids[value] = len(strings)
+                    strings.append(value)
+                profile_ids.append(string_id)
+
+        blobs = []
+        position = 0
+
+        def add(blob):
+            nonlocal position
+            blob = bytes(blob)
+            entry = [position, len(blob)]
+            blobs.append(blob + b'\0' * (_padded(len(blob)) - len(blob)))
+            position += _padded(len(blob))
+            return entry
+
+        header = {
+            'version': INDEX_VERSION,
+            'checksum': checksum,
+            'source': source,
+            'byteorder': sys.byteorder,
+            'itemsize': profile_ids.itemsize,
+            'strings': add('\n'.join(strings).encode('utf-8')),
+            'profiles': add(profile_ids),
+            'chroms': {},
+        }
+        for name, chrom in self.chroms.items():
+            sections = {key: add(getattr(chrom, key)) for key in CHROM_ARRAYS}
+            sections['strands'] = add(chrom.strands)
+            header['chroms'][name] = sections
+
+        header_bytes = json.dumps(header).encode('utf-8')
+        tmp_path = f"{index_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as out:
+            out.write(INDEX_MAGIC)
+            out.write(len(header_bytes).to_bytes(8, 'little'))
+            out.write(header_bytes + b'\0' * (_padded(len(header_bytes)) - len(header_bytes)))
+            for blob in blobs:
+                out.write(blob)
+        os.replace(tmp_path, index_path)
+        self.path = index_path
+
+    @classmethod
+    def from_gtf(cls, gtf_path):
+        profile_ids = {}
+        profiles = []
+        raw = {}
+
+        for rec in iter_records(gtf_path):
+            strand = rec.strand
+            if strand != '+' and strand != '-':
+                # bedtools -s never reports hits on unknown strands
+                continue
+            start = rec.start - 1
+            end = rec.end
+            if end <= start:
+                continue
+
+            profile = gene_profile(rec.feature, rec.attributes)
+            profile_id = profile_ids.get(profile)
+            if profile_id is None:
+                profile_id = profile_ids[profile] = len(profiles)
+                profiles.append(profile)
+
+            chrom = raw.get(rec.seqid)
+            if chrom is None:
+                chrom = raw[rec.seqid] = (array('I'), array('I'), array('I'), bytearray(), array('I'))
+            chrom[0].append(get_bin(start, end))
+            chrom[1].append(start)
+            chrom[2].append(end)
+            chrom[3].append(ord(strand))
+            chrom[4].append(profile_id)
+
+        chroms = {}
+        for name, (rec_bins, starts, ends, strands, rec_profiles) in raw.items():
+            # Stable sort keeps file order inside each bin
+            order = sorted(range(len(rec_bins)), key=rec_bins.__getitem__)
+            bins, bin_offsets = array('I'), array('I')
+            for i, rec in enumerate(order):
+                if not bins or bins[-1] != rec_bins[rec]:
+                    bins.append(rec_bins[rec])
+                    bin_offsets.append(i)
+            bin_offsets.append(len(order))
+            chroms[name] = ChromIndex(
+                bins,
+                bin_offsets,
+                array('I', (starts[i] for i in order)),
+                array('I', (ends[i] for i in order)),
+                bytes(strands[i] for i in order),
+                array('I', (rec_profiles[i] for i in order)),
+            )
+
+        return cls(chroms, profiles)
+
+    def hits(self, chrom, start, end, strand):
+        """
+        Profile ids of the records overlapping a 0-based, half-open interval on the same strand.
+        """
+        chrom_index = self.chroms.get(chrom)
+        if chrom_index is None or end <= start or strand not in ('+', '-'):
+            return
+        yield from chrom_index.hits(start, end, ord(strand))
@@ -1,37 +1,114 @@
-import re
 import argparse
+from functools import lru_cache
+from gtf_stream import gtf_attr, open_text
 from ..pipeline import PipelineStructure
 from collections import defaultdict
 
-# === Precompiled Regex for GTF/GFF attributes ===
-ATTR_RE = re.compile(r'(\S+) "([^"]+)"')
-
-def parse_attributes(attr_str):
-    return dict(ATTR_RE.findall(attr_str))
+PRIORITY_ORDER = ['psORF', 'uoORF', 'doORF', 'oORF', 'dORF', 'uORF', 'UTR_ORF', 'lncRNA', 'riORF', 'aORF', 'eORF']
+
+PSEUDO_BIOTYPES = {
+    'processed_pseudogene', 'unprocessed_pseudogene', 'translated_unprocessed_pseudogene',
+    'translated_processed_pseudogene', 'transcribed_processed_pseudogene',
+    'transcribed_unprocessed_pseudogene', 'unitary_pseudogene', 'polymorphic_pseudogene'
+}
+
+NONCODING_BIOTYPES = {'lncRNA', 'lincRNA', 'antisense', 'sense_intronic', 'sense_overlapping'}
+
+def gene_id_of(attr_str):
+    return gtf_attr(attr_str, 'gene_id') or 'Unknown'
+
+def gene_profile(feature_type, attr_str):
+    """
+    Reduces a reference GTF record to the fields the annotation logic uses:
+    (feature_type, gene_name, gene_biotype, transcript_biotype).
+    """
+    gene_name = gtf_attr(attr_str, 'gene_name') or 'Unnamed'
+    # Ensembl GTFs typically use *_biotype; GENCODE often uses *_type.
+    gene_biotype = gtf_attr(attr_str, 'gene_biotype') or gtf_attr(attr_str, 'gene_type') or 'Unnamed'
+    transcript_biotype = gtf_attr(attr_str, 'transcript_biotype') or gtf_attr(attr_str, 'transcript_type') or 'Unknown'
+    return (feature_type, gene_name, gene_biotype, transcript_biotype)
+
+def get_priority(annot):
+    return PRIORITY_ORDER.index(annot) if annot in PRIORITY_ORDER else float('inf')
+
+@lru_cache(maxsize=None)
+def classify_feature(feature_type, gene_biotype, transcript_biotype):
+    """
+    Returns the smORF type implied by a single overlapping reference feature.
+    """
+    if feature_type == 'three_prime_utr':
+        return 'dORF'
+    elif feature_type == 'five_prime_utr':
+        return 'uORF'
+    elif feature_type == 'UTR':
+        return 'UTR_ORF'
+    elif feature_type == 'CDS':
+        return 'oORF'
+    elif feature_type == 'retrotransposed':
+        return 'psORF'
+    elif transcript_biotype in PSEUDO_BIOTYPES:
+        return 'psORF'
+    elif any(x in transcript_biotype for x in [
+        'non_stop_decay', 'nonsense_mediated_decay',
+        'ambiguous_orf', 'protein_coding_CDS_not_defined']):
+        return 'aORF'
+    elif 'retained_intron' in transcript_biotype:
+        return 'riORF'
+    elif gene_biotype in NONCODING_BIOTYPES:
+        return 'lncRNA'
+    elif feature_type == 'exon':
+        return 'eORF'
+    else:
+        return 'UA'
 
 class smORFAnnotator(PipelineStructure):
     def __init__(self, args):
         super().__init__(args)
+        self.smorf_gtf = args.smorf_gtf
         self.intersect_file = args.intersect_output
         self.non_intersect_file = args.non_intersect_output
         self.output_file = args.output_file
 
     def process_gtf_files(self):
-        priority_order = ['psORF', 'uoORF', 'doORF', 'oORF', 'dORF', 'uORF', 'UTR_ORF', 'lncRNA', 'riORF', 'aORF', 'eORF']
-
-        def get_priority(annot):
-            return priority_order.index(annot) if annot in priority_order else float('inf')
-
-        gene_data = defaultdict(lambda: ('UA', 'Unknown'))
-
-        PSEUDO_BIOTYPES = {
-            'processed_pseudogene', 'unprocessed_pseudogene', 'translated_unprocessed_pseudogene',
-            'translated_processed_pseudogene', 'transcribed_processed_pseudogene',
-            'transcribed_unprocessed_pseudogene', 'unitary_pseudogene', 'polymorphic_pseudogene'
-        }
-
-        NONCODING_BIOTYPES = {'lncRNA', 'lincRNA', 'antisense', 'sense_intronic', 'sense_overlapping'}
-
+        """
+        Annotates smORFs from the bedtools intersect/non-intersect outputs.
+        """
+        self.__annotate(self.__read_intersect(), self.__read_non_intersect())
+
+    def process_index(self, index):
+        """
+        Annotates smORFs by querying an in-memory ReferenceIndex of the reference GTF.
+        Same output as process_gtf_files(), without the bedtools passes.
+        """
+        hits = []
+        misses = []
+        profiles = index.profiles
+
+        with open_text(self.smorf_gtf) as file:
+            for line in file:
+                if not line.startswith('chr'):
+                    continue
+                parts = line.strip().split('\t')
+                if len(parts) < 9:
+                    continue
+                start = int(parts[3]) - 1
+                end = int(parts[4])
+                overlaps = index.hits(parts[0], start, end, parts[6])
+
+                if parts[2] == 'CDS':
+                    gene_id = gene_id_of(parts[8])
+                    found = False
+                    for profile_id in overlaps:
+                        hits.append((gene_id, profiles[profile_id]))
+                        found = True
+                    if not found:
+                        misses.append(gene_id)
+                elif next(overlaps, None) is None:
+                    misses.append(gene_id_of(parts[8]))
+
+        self.__annotate(hits, misses)
+
+    def __read_intersect(self):
         with open(self.intersect_file, 'r') as file:
             for line in file:
                 if not line.startswith('chr'):
@@ -40,80 +117,61 @@ class smORFAnnotator(PipelineStructure):
                 if parts[2] != 'CDS':
                     continue
 
-                attrs = parse_attributes(parts[8])
                 gene_info = parts[17] if len(parts) > 17 else parts[8]
-                gene_attrs = parse_attributes(gene_info)
-
-                gene_id = attrs.get('gene_id', 'Unknown')
-                gene_name = gene_attrs.get('gene_name', 'Unnamed')
-                # Ensembl GTFs typically use *_biotype; GENCODE often uses *_type.
-                gene_biotype = gene_attrs.get('gene_biotype') or gene_attrs.get('gene_type') or 'Unnamed'
-                transcript_biotype = gene_attrs.get('transcript_biotype') or gene_attrs.get('transcript_type') or 'Unknown'
                 feature_type = parts[11] if len(parts) > 11 else 'exon'
 
-                # === Annotation Logic ===
-                if feature_type == 'three_prime_utr':
-                    annotation = 'dORF'
-                elif feature_type == 'five_prime_utr':
-                    annotation = 'uORF'
-                elif feature_type == 'UTR':
-                    annotation = 'UTR_ORF'
-                elif feature_type == 'CDS':
-                    annotation = 'oORF'
-                elif feature_type == 'retrotransposed':
-                    annotation = 'psORF'
-                elif transcript_biotype in PSEUDO_BIOTYPES:
-                    annotation = 'psORF'
-                elif any(x in transcript_biotype for x in [
-                    'non_stop_decay', 'nonsense_mediated_decay',
-                    'ambiguous_orf', 'protein_coding_CDS_not_defined']):
-                    annotation = 'aORF'
-                elif 'retained_intron' in transcript_biotype:
-                    annotation = 'riORF'
-                elif gene_biotype in NONCODING_BIOTYPES:
-                    annotation = 'lncRNA'
-                elif feature_type == 'exon':
-                    annotation = 'eORF'
-                else:
-                    annotation = 'UA'
-
-                # === Conflict Resolution ===
-                existing_annotation, _ = gene_data[gene_id]
-                
-                if gene_id not in gene_data:
-                    gene_data[gene_id] = (annotation, gene_name)
-                else:
-                    existing_annotation, _ = gene_data[gene_id]
-
-                    # Handle combined upstream + overlapping
-                    if {existing_annotation, annotation} == {'uORF', 'oORF'}:
-                        gene_data[gene_id] = ('uoORF', gene_name)
-
-                    # Handle combined downstream + overlapping
-                    elif {existing_annotation, annotation} == {'dORF', 'oORF'}:
-                        gene_data[gene_id] = ('doORF', gene_name)
-
-                    # Handle upstream + downstream (rare)
-                    elif {existing_annotation, annotation} == {'uORF', 'dORF'}:
-                        gene_data[gene_id] = ('udORF', gene_name)
-
-                    # Keep whichever has higher priority (lower index)
-                    elif get_priority(annotation) < get_priority(existing_annotation):
-                        gene_data[gene_id] = (annotation, gene_name)
-                
-                if get_priority(annotation) < get_priority(existing_annotation):
-                    gene_data[gene_id] = (annotation, gene_name)
+                yield gene_id_of(parts[8]), gene_profile(feature_type, gene_info)
 
-        # === Add Intergenic Genes ===
+    def __read_non_intersect(self):
         with open(self.non_intersect_file, 'r') as file:
             for line in file:
                 if not line.startswith('chr'):
                     continue
                 parts = line.strip().split('\t')
-                attrs = parse_attributes(parts[8])
-                gene_id = attrs.get('gene_id', 'Unknown')
-                if gene_id not in gene_data:
-                    gene_data[gene_id] = ('Intergenic', 'Intergenic')
+                yield gene_id_of(parts[8])
+
+    def __annotate(self, hits, misses):
+        """
+        hits: (gene_id, profile) per smORF CDS / reference feature overlap, in bedtools order.
+        misses: gene_id of every smORF line without a same-strand overlap.
+        """
+        gene_data = defaultdict(lambda: ('UA', 'Unknown'))
+
+        for gene_id, (feature_type, gene_name, gene_biotype, transcript_biotype) in hits:
+            # === Annotation Logic ===
+            annotation = classify_feature(feature_type, gene_biotype, transcript_biotype)
+
+            # === Conflict Resolution ===
+            existing_annotation, _ = gene_data[gene_id]
+
+            if gene_id not in gene_data:
+                gene_data[gene_id] = (annotation, gene_name)
+            else:
+                existing_annotation, _ = gene_data[gene_id]
+
+                # Handle combined upstream + overlapping
+                if {existing_annotation, annotation} == {'uORF', 'oORF'}:
+                    gene_data[gene_id] = ('uoORF', gene_name)
+
+                # Handle combined downstream + overlapping
+                elif {existing_annotation, annotation} == {'dORF', 'oORF'}:
+                    gene_data[gene_id] = ('doORF', gene_name)
+
+                # Handle upstream + downstream (rare)
+                elif {existing_annotation, annotation} == {'uORF', 'dORF'}:
+                    gene_data[gene_id] = ('udORF', gene_name)
+
+                # Keep whichever has higher priority (lower index)
+                elif get_priority(annotation) < get_priority(existing_annotation):
+                    gene_data[gene_id] = (annotation, gene_name)
+
+            if get_priority(annotation) < get_priority(existing_annotation):
+                gene_data[gene_id] = (annotation, gene_name)
+
+        # === Add Intergenic Genes ===
+        for gene_id in misses:
+            if gene_id not in gene_data:
+                gene_data[gene_id] = ('Intergenic', 'Intergenic')
 
         # === Write to Output File ===
         with open(self.output_file, 'w') as out:
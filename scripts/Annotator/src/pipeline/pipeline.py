@@ -1,6 +1,22 @@
 import os
+import glob
+import time
 import shutil
-from ..annotation import BedtoolsRunner, smORFAnnotator
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ..annotation import BedtoolsRunner, smORFAnnotator, ReferenceIndex
+
+# Reference index of a batch worker process, loaded once by __init_worker
+_worker_index = None
+
+def _init_worker(index_path):
+    global _worker_index
+    _worker_index = ReferenceIndex.load(index_path)
+
+def _annotate_sample(sample_args):
+    start = time.time()
+    smORFAnnotator(args=sample_args).process_index(_worker_index)
+    return sample_args.smorf_gtf, sample_args.output_file, time.time() - start
 
 class Pipeline:
     def __init__(self, args):
@@ -9,12 +25,80 @@ class Pipeline:
     
     def annotate(self):
         print("▶️ You have successfully initiated smORF annotation...")
-        run = BedtoolsRunner(args=self.args)
-        run.run_intersect()
-        run.run_non_intersect()
-
         annotate = smORFAnnotator(args=self.args)
-        annotate.process_gtf_files()
+
+        if self.args.engine == 'bedtools':
+            run = BedtoolsRunner(args=self.args)
+            run.run_intersect()
+            run.run_non_intersect()
+            annotate.process_gtf_files()
+        elif self.args.index_dir:
+            index = ReferenceIndex.cached(self.args.ensembl_gtf, self.args.index_dir)
+            annotate.process_index(index)
+        else:
+            print(f"Indexing reference annotation '{self.args.ensembl_gtf}'...")
+            index = ReferenceIndex.from_gtf(self.args.ensembl_gtf)
+            annotate.process_index(index)
+
+    def annotate_batch(self):
+        print("▶️ You have successfully initiated batch smORF annotation...")
+        smorf_gtfs = self.__collect_smorf_gtfs()
+        if not smorf_gtfs:
+            raise SystemExit(f"No smORF GTFs found in: {', '.join(self.args.smorf_gtfs)}")
+        print(f"Annotating {len(smorf_gtfs)} smORF GTFs with {self.args.threads} worker(s).")
+
+        # Compile (or reuse) the on-disk index once; every worker memory-maps the same file
+        index = ReferenceIndex.cached(self.args.ensembl_gtf, self.args.index_dir)
+
+        tasks = []
+        for smorf_gtf in smorf_gtfs:
+            sample_args = argparse.Namespace(**vars(self.args))
+            sample_args.smorf_gtf = smorf_gtf
+            sample_args.output_file = os.path.join(os.path.dirname(smorf_gtf), self.args.output_name)
+            sample_args.intersect_output = None
+            sample_args.non_intersect_output = None
+            tasks.append(sample_args)
+
+        failed = []
+        if self.args.threads <= 1:
+            _init_worker(index.path)
+            for sample_args in tasks:
+                try:
+                    smorf_gtf, output_file, elapsed = _annotate_sample(sample_args)
+                    print(f"[OK] {smorf_gtf} -> {output_file} ({elapsed:.1f}s)")
+                except Exception as e:
+                    failed.append(sample_args.smorf_gtf)
+                    print(f"[FAIL] {sample_args.smorf_gtf}: {e}")
+        else:
+            with ProcessPoolExecutor(max_workers=self.args.threads, initializer=_init_worker, initargs=(index.path,)) as pool:
+                futures = {pool.submit(_annotate_sample, sample_args): sample_args for sample_args in tasks}
+                for future in as_completed(futures):
+                    try:
+                        smorf_gtf, output_file, elapsed = future.result()
+                        print(f"[OK] {smorf_gtf} -> {output_file} ({elapsed:.1f}s)")
+                    except Exception as e:
+                        failed.append(futures[future].smorf_gtf)
+                        print(f"[FAIL] {futures[future].smorf_gtf}: {e}")
+
+        print(f"Done. Successful: {len(tasks) - len(failed)}/{len(tasks)}")
+        if failed:
+            raise SystemExit(f"Annotation failed for {len(failed)} smORF GTF(s).")
+
+    def __collect_smorf_gtfs(self):
+        """
+        Expands directories given in --smorf_gtfs into the smORF GTFs they contain.
+        """
+        smorf_gtfs = []
+        for path in self.args.smorf_gtfs:
+            if os.path.isdir(path):
+                smorf_gtfs.extend(sorted(glob.glob(os.path.join(path, '**', self.args.pattern), recursive=True)))
+            else:
+                smorf_gtfs.append(path)
+        return smorf_gtfs
+
+    def index_reference(self):
+        print("▶️ You have successfully initiated reference indexing...")
+        ReferenceIndex.cached(self.args.ensembl_gtf, self.args.index_dir)
 
     # def __cleanup_output_directory(self, outdir):
     #     """Removes all directories and files in the specified output directory and recreates the directory."""
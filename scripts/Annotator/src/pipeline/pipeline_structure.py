@@ -26,6 +26,13 @@ class PipelineStructure:
             self.ensembl_gtf = self.args.ensembl_gtf
             self.intersect_output = self.args.intersect_output
             self.non_intersect_output = self.args.non_intersect_output
+        elif self.args.mode == 'smorf_types_batch':
+            self.smorf_gtfs = self.args.smorf_gtfs
+            self.ensembl_gtf = self.args.ensembl_gtf
+            self.index_dir = self.args.index_dir
+        elif self.args.mode == 'index_reference':
+            self.ensembl_gtf = self.args.ensembl_gtf
+            self.index_dir = self.args.index_dir
 
     def __define_output_files(self):
         """
@@ -35,5 +42,7 @@ class PipelineStructure:
         if self.args.mode == 'smorf_types':
             self.intersect_output = self.args.intersect_output
             self.non_intersect_output = self.args.non_intersect_output
+        elif self.args.mode in ('smorf_types_batch', 'index_reference'):
+            self.index_dir = self.args.index_dir
         else:
             sys.exit(f"Mode '{self.args.mode}' not recognized. Please choose a valid mode.")
\ No newline at end of file
@@ -1,46 +1,123 @@
 #!/usr/bin/env python3
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 from pathlib import Path
+import numpy as np
 import pandas as pd
+from table_io import LOCUS_SCHEMA, read_table, write_table
 
 def load_isoform_tpms(path: Path) -> pd.Series:
-    df = pd.read_csv(path, sep="\t")
+    header = pd.read_csv(path, sep="\t", nrows=0).columns
     # RSEM isoforms.results normally has transcript_id + TPM
-    id_col = "transcript_id" if "transcript_id" in df.columns else df.columns[0]
-    if "TPM" not in df.columns:
+    id_col = "transcript_id" if "transcript_id" in header else header[0]
+    if "TPM" not in header:
         raise SystemExit(f"No TPM column found in {path}")
-    return df.set_index(id_col)["TPM"].astype(float)
+    df = pd.read_csv(path, sep="\t", usecols=[id_col, "TPM"], dtype={id_col: str})
+    tpms = df.set_index(id_col)["TPM"].astype(float)
+    return tpms[~tpms.index.duplicated()]
 
-def add_tpms(summary_csv: Path, rsem_dir: Path, out_csv: Path) -> None:
-    summ = pd.read_csv(summary_csv)
-    if "locus" not in summ.columns or "patients" not in summ.columns:
-        raise SystemExit(f"{summary_csv} must contain columns: locus, patients")
-
-    # Load all per-sample TPM vectors once
-    tpm_by_sample = {}
+def load_rsem_tpms(rsem_dir: Path, jobs: int = 1) -> dict:
+    """
+    sample -> TPM Series (indexed by transcript_id) for every <sample>/<sample>.isoforms.results
+    under rsem_dir. Files are read once, in `jobs` parallel processes.
+    """
+    paths = {}
     for sample_dir in sorted(rsem_dir.glob("*")):
         if not sample_dir.is_dir():
             continue
         sample = sample_dir.name
         iso = sample_dir / f"{sample}.isoforms.results"
         if iso.exists():
-            tpm_by_sample[sample] = load_isoform_tpms(iso)
-
-    def row_tpms(row) -> str:
-        locus = str(row["locus"])
-        pats = str(row["patients"]) if pd.notna(row["patients"]) else ""
-        pat_list = [p for p in pats.split(",") if p]
-        vals = []
-        for p in pat_list:
-            s = tpm_by_sample.get(p)
-            v = 0.0
-            if s is not None and locus in s.index:
-                v = float(s.loc[locus])
-            vals.append(f"{v:.6f}")
-        return ",".join(vals)
-
-    summ["tpms"] = summ.apply(row_tpms, axis=1)
-    summ.to_csv(out_csv, index=False)
+            paths[sample] = iso
+
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            return dict(zip(paths, pool.map(load_isoform_tpms, paths.values())))
+    return {sample: load_isoform_tpms(path) for sample, path in paths.items()}
+
+def expand_to_loci(tpm_by_sample: dict, locus_map_path: Path, mode: str = "copy") -> dict:
+    """
+    Re-keys per-transcript TPMs by locus, for references where loci with identical CDS share one
+    transcript (locus map of make_smorf_rsem_ref_from_locus_summary.py --locus_map).
+      copy:  every locus gets the TPM of its shared transcript (the expression of the sequence;
+             summing over loci counts it once per locus).
+      split: the TPM is divided equally among the loci sharing the transcript (what RSEM itself
+             gives identical transcripts of an uncollapsed reference; sums are preserved).
+    """
+    locus_map = pd.read_csv(locus_map_path, sep="\t", dtype=str)
+    tx_ids = pd.Index(locus_map["transcript_id"])
+    scale = np.ones(len(locus_map))
+    if mode == "split":
+        scale = 1.0 / locus_map.groupby("transcript_id")["locus"].transform("size").to_numpy()
+    loci = pd.Index(locus_map["locus"])
+
+    expanded = {}
+    for sample, tpms in tpm_by_sample.items():
+        idx = tpms.index.get_indexer(tx_ids)
+        found = idx >= 0
+        values = tpms.to_numpy()[idx[found]] * scale[found]
+        by_locus = pd.Series(values, index=loci[found])
+        expanded[sample] = by_locus[~by_locus.index.duplicated()]
+    return expanded
+
+def patient_tpms(loci: pd.Series, patients: pd.Series, tpm_by_sample: dict) -> pd.Series:
+    """
+    For each row, the TPM of its locus in each of its patients (comma-separated, in the
+    order of `patients`; 0 if the sample or the locus has no RSEM result), as "%.6f" values
+    joined by commas.
+    """
+    loci = loci.map(str).to_numpy(dtype=object)
+    pat_lists = patients.map(lambda p: str(p) if pd.notna(p) else "").str.split(",")
+    n_per_row = pat_lists.map(len).to_numpy()
+    names = np.array(list(chain.from_iterable(pat_lists)), dtype=object)
+    rows = np.repeat(np.arange(len(loci)), n_per_row)
+
+    # Drop empty names (empty patients strings, stray commas)
+    keep = names != ""
+    names, rows = names[keep], rows[keep]
+    pair_loci = loci[rows]
+
+    # One vectorized lookup per sample over the (locus, patient) pairs of that sample
+    values = np.zeros(len(names))
+    sample_codes, samples = pd.factorize(names)
+    order = np.argsort(sample_codes, kind="stable")
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(sample_codes, minlength=len(samples)))))
+    for code, sample in enumerate(samples):
+        tpms = tpm_by_sample.get(sample)
+        if tpms is None:
+            continue
+        sel = order[bounds[code]:bounds[code + 1]]
+        idx = tpms.index.get_indexer(pair_loci[sel])
+        found = idx >= 0
+        values[sel[found]] = tpms.to_numpy()[idx[found]]
+
+    formatted = [f"{v:.6f}" for v in values.tolist()]
+    row_bounds = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(loci))))).tolist()
+    return pd.Series(
+        [",".join(formatted[row_bounds[i]:row_bounds[i + 1]]) for i in range(len(loci))],
+        index=patients.index, dtype=object,
+    )
+
+def add_tpms(summary_csv: Path, tpm_by_sample: dict, out_csv: Path) -> pd.DataFrame:
+    summ = read_table(summary_csv)
+    if "locus" not in summ.columns or "patients" not in summ.columns:
+        raise SystemExit(f"{summary_csv} must contain columns: locus, patients")
+
+    summ["tpms"] = patient_tpms(summ["locus"], summ["patients"], tpm_by_sample)
+    write_table(summ, out_csv, schema=LOCUS_SCHEMA)
+    return summ
+
+def write_tpm_matrix(loci: pd.Series, tpm_by_sample: dict, out_path: Path) -> None:
+    """
+    Dense locus x sample TPM table (locus column + one column per sample, 0 where RSEM
+    has no value). Rows follow `loci`. Needs 8 bytes per locus and sample in memory.
+    """
+    loci = pd.Index(loci.map(str))
+    matrix = {"locus": loci}
+    for sample, tpms in tpm_by_sample.items():
+        matrix[sample] = tpms.reindex(loci, fill_value=0.0).to_numpy()
+    write_table(pd.DataFrame(matrix), out_path, schema={"locus": "string"})
 
 def main():
     ap = argparse.ArgumentParser()
@@ -49,11 +126,30 @@ def main():
     ap.add_argument("--rsem_dir", required=True)
     ap.add_argument("--out_all_loci_csv", required=True)
     ap.add_argument("--out_shared_csv", required=True)
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Processes used to read the RSEM isoforms.results files (default: 1)")
+    ap.add_argument("--matrix_out", default=None,
+                    help="Optional: also write the locus x sample TPM matrix of all_loci here (.csv or .parquet)")
+    ap.add_argument("--locus_map", default=None,
+                    help="Optional: locus -> transcript_id table of a reference with identical CDS collapsed "
+                         "(make_smorf_rsem_ref_from_locus_summary.py --locus_map). Default: transcripts are loci.")
+    ap.add_argument("--collapsed_tpm", choices=["copy", "split"], default="copy",
+                    help="With --locus_map, TPM of each locus sharing a transcript: the transcript's TPM (copy) "
+                         "or an equal share of it (split) (default: copy)")
     args = ap.parse_args()
 
-    rsem_dir = Path(args.rsem_dir)
-    add_tpms(Path(args.all_loci_csv), rsem_dir, Path(args.out_all_loci_csv))
-    add_tpms(Path(args.shared_csv),   rsem_dir, Path(args.out_shared_csv))
+    # Load all per-sample TPM vectors once, for both summaries
+    tpm_by_sample = load_rsem_tpms(Path(args.rsem_dir), args.jobs)
+    print(f"Loaded RSEM TPMs for {len(tpm_by_sample)} samples")
+    if args.locus_map:
+        tpm_by_sample = expand_to_loci(tpm_by_sample, Path(args.locus_map), args.collapsed_tpm)
+
+    all_loci = add_tpms(Path(args.all_loci_csv), tpm_by_sample, Path(args.out_all_loci_csv))
+    add_tpms(Path(args.shared_csv), tpm_by_sample, Path(args.out_shared_csv))
+
+    if args.matrix_out:
+        write_tpm_matrix(all_loci["locus"], tpm_by_sample, Path(args.matrix_out))
+        print(f"[OK] Wrote: {args.matrix_out}")
 
 if __name__ == "__main__":
     main()
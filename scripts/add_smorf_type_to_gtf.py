@@ -1,18 +1,10 @@
 #!/usr/bin/env python3
 import argparse
+import os
+from pathlib import Path
+from gtf_stream import gtf_attr, open_text
 
-
-def parse_gtf_attrs(attr_str: str) -> dict:
-    attrs = {}
-    for part in attr_str.strip().split(";"):
-        part = part.strip()
-        if not part:
-            continue
-        if " " not in part:
-            continue
-        key, val = part.split(" ", 1)
-        attrs[key] = val.strip().strip('"')
-    return attrs
+SIDECAR_HEADER = "gene_id\tsmorf_type\n"
 
 
 def load_annotations(path: str) -> dict:
@@ -31,16 +23,48 @@ def load_annotations(path: str) -> dict:
     return ann
 
 
+def sidecar_path(gtf_path) -> Path:
+    """<name>.gtf -> <name>.smorf_types.tsv, the ORF -> smORF type index written next to the GTF."""
+    gtf_path = Path(gtf_path)
+    stem = gtf_path.name[:-len(".gtf")] if gtf_path.name.endswith(".gtf") else gtf_path.name
+    return gtf_path.with_name(f"{stem}.smorf_types.tsv")
+
+
+def write_sidecar(path, types: dict) -> None:
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as out:
+        out.write(SIDECAR_HEADER)
+        for gene_id, smorf_type in types.items():
+            out.write(f"{gene_id}\t{smorf_type}\n")
+    os.replace(tmp_path, path)
+
+
+def read_sidecar(path) -> dict:
+    """gene_id -> smorf_type from a sidecar written by write_sidecar."""
+    types = {}
+    with open(path, "r") as fh:
+        if fh.readline() != SIDECAR_HEADER:
+            raise ValueError(f"Not a smORF type index: {path}")
+        for line in fh:
+            gene_id, _, smorf_type = line.rstrip("\n").partition("\t")
+            types[gene_id] = smorf_type
+    return types
+
+
 def main():
     ap = argparse.ArgumentParser(description="Append smORF type as 10th column in a GTF.")
     ap.add_argument("--gtf", required=True, help="Input GTF file")
     ap.add_argument("--annotations", required=True, help="Annotator output file (gene_id\\tannotation\\t...)")
     ap.add_argument("--out", required=True, help="Output annotated GTF")
+    ap.add_argument("--sidecar", default=None,
+                    help="gene_id -> smorf_type TSV of the annotated GTF, read by merge_shortstop_output.py "
+                         "instead of the GTF (default: <out without .gtf>.smorf_types.tsv)")
     args = ap.parse_args()
 
     ann = load_annotations(args.annotations)
+    types = {}  # smorf_type of each gene_id of the GTF, as merge_shortstop_output.py would read it back
 
-    with open(args.gtf, "r") as infile, open(args.out, "w") as out:
+    with open_text(args.gtf) as infile, open(args.out, "w") as out:
         for line in infile:
             if not line.strip():
                 continue
@@ -51,9 +75,10 @@ def main():
             if len(parts) < 9:
                 out.write(line)
                 continue
-            attrs = parse_gtf_attrs(parts[8])
-            gene_id = attrs.get("gene_id")
+            gene_id = gtf_attr(parts[8], "gene_id")
             smorf_type = ann.get(gene_id, "NA")
+            if gene_id:
+                types.setdefault(gene_id, smorf_type)
 
             attr_str = parts[8].strip()
             if attr_str and not attr_str.endswith(";"):
@@ -62,6 +87,9 @@ def main():
             parts[8] = attr_str.strip()
             out.write("\t".join(parts) + "\n")
 
+    # After the GTF, so the index is never older than the GTF it describes
+    write_sidecar(args.sidecar or sidecar_path(args.out), types)
+
 
 if __name__ == "__main__":
     main()
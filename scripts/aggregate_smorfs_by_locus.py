@@ -3,139 +3,212 @@
 # python aggregate_smorfs_by_locus.py \
 #   --merged_dir /storage/scratch01/users/sbarber/Visceral/merged_per_sample \
 #   --out_prefix /storage/scratch01/users/sbarber/Visceral/smorf_locus_summary
+# Add --store /storage/scratch01/users/sbarber/Visceral/smorf_loci.sqlite to only process
+# the samples that changed since the previous run.
 
 import argparse
 from pathlib import Path
+import numpy as np
 import pandas as pd
+from table_io import FORMATS, LOCUS_SCHEMA, read_table, write_table
 
 
 LOCUS_COLS = ["cds_chr", "cds_starts", "cds_ends", "cds_strand"]
+EXTRA_COLS = ["orf_id", "sam_probability", "classification", "aa_seq", "length", "type", "cds_seq", "smorf_type"]
 
 
-def first_nonnull(series: pd.Series):
-    """Return the first non-null value (as string) or NA if none."""
-    s = series.dropna()
-    if len(s) == 0:
-        return pd.NA
-    return s.iloc[0]
+# The per-locus aggregations work on integer codes (locus, sample and smorf_type are
+# factorized once for the whole cohort) instead of calling a Python function per group:
+# (locus, value) pairs are counted with numpy and only the final ",".join of each
+# locus runs in Python, over plain lists.
 
-def unique_nonnull(series: pd.Series):
-    s = [str(x) for x in series.dropna() if str(x) != ""]
-    if not s:
-        return pd.NA
-    return ",".join(sorted(set(s)))
+def join_groups(group_codes: np.ndarray, names: list, n_groups: int) -> np.ndarray:
+    """
+    Comma-join `names` (sorted by group, already in output order) per group.
+    Groups without values get NA.
+    """
+    counts = np.bincount(group_codes, minlength=n_groups)
+    bounds = np.concatenate(([0], np.cumsum(counts))).tolist()
+    out = np.full(n_groups, pd.NA, dtype=object)
+    for i in np.flatnonzero(counts).tolist():
+        out[i] = ",".join(names[bounds[i]:bounds[i + 1]])
+    return out
 
-def most_common_nonnull(series: pd.Series):
-    s = [str(x) for x in series.dropna() if str(x) != ""]
-    if not s:
-        return pd.NA
-    counts = {}
-    for val in s:
-        counts[val] = counts.get(val, 0) + 1
-    max_count = max(counts.values())
-    top = sorted([k for k, v in counts.items() if v == max_count])
-    return ",".join(top)
 
+def code_pairs(group_codes: np.ndarray, value_codes: np.ndarray, n_values: int, weights=None):
+    """
+    Distinct (group, value) code pairs, sorted by group then value, and their row
+    counts (or the sum of `weights` over their rows).
+    """
+    keys = group_codes.astype(np.int64) * n_values + value_codes
+    if weights is None:
+        pairs, counts = np.unique(keys, return_counts=True)
+    else:
+        pairs, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=weights, minlength=len(pairs)).astype(np.int64)
+    return pairs // n_values, pairs % n_values, counts
 
-def main():
-    ap = argparse.ArgumentParser(
-        description="Aggregate per-sample merged ShortStop tables by genomic locus and find smORFs shared across patients."
+
+def nonnull_str_codes(series: pd.Series):
+    """
+    Rows holding a non-null, non-empty value (compared as str) and the codes of those
+    values. Codes follow the sorted order of the distinct strings.
+    """
+    mask = series.notna().to_numpy()
+    values = series[mask].astype(str)
+    nonempty = (values != "").to_numpy()
+    rows = np.flatnonzero(mask)[nonempty]
+    codes, uniques = pd.factorize(values[nonempty], sort=True)
+    return rows, codes, list(uniques)
+
+
+def unique_nonnull(group_codes: np.ndarray, series: pd.Series, n_groups: int) -> np.ndarray:
+    """Sorted distinct non-empty values of each group, comma-joined (NA if none)."""
+    rows, codes, uniques = nonnull_str_codes(series)
+    groups, values, _ = code_pairs(group_codes[rows], codes, len(uniques))
+    return join_groups(groups, [uniques[v] for v in values.tolist()], n_groups)
+
+
+def most_common_nonnull(group_codes: np.ndarray, series: pd.Series, n_groups: int) -> np.ndarray:
+    """Most frequent non-empty value of each group; ties are sorted and comma-joined (NA if none)."""
+    rows, codes, uniques = nonnull_str_codes(series)
+    return join_most_common(*code_pairs(group_codes[rows], codes, len(uniques)), uniques, n_groups)
+
+
+def join_most_common(groups: np.ndarray, values: np.ndarray, counts: np.ndarray, uniques: list, n_groups: int) -> np.ndarray:
+    """Comma-joined most frequent value(s) per group, from the output of code_pairs()."""
+    if len(groups) == 0:
+        return np.full(n_groups, pd.NA, dtype=object)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    group_max = np.maximum.reduceat(counts, starts)
+    top = counts == np.repeat(group_max, np.diff(np.r_[starts, len(groups)]))
+    return join_groups(groups[top], [uniques[v] for v in values[top].tolist()], n_groups)
+
+
+def sample_of(path: Path) -> str:
+    """Sample name of a <sample>.merged.csv / <sample>.merged.parquet table."""
+    return path.name[:-len(".merged" + path.suffix)]
+
+
+def read_merged_table(path: Path) -> pd.DataFrame:
+    """
+    Reads one per-sample merged table (CSV or Parquet): locus key, locus columns and
+    the optional fields present in the file. Other columns are not read.
+    """
+    df = read_table(path, columns=LOCUS_COLS + EXTRA_COLS)
+
+    missing = [c for c in LOCUS_COLS if c not in df.columns]
+    if missing:
+        raise ValueError(f"{path}: missing required locus columns: {missing}")
+
+    # ensure numeric starts/ends if possible
+    df["cds_starts"] = pd.to_numeric(df["cds_starts"], errors="coerce")
+    df["cds_ends"]   = pd.to_numeric(df["cds_ends"], errors="coerce")
+
+    # locus key
+    df["locus"] = (
+        df["cds_chr"].astype(str) + ":" +
+        df["cds_starts"].astype("Int64").astype(str) + "-" +
+        df["cds_ends"].astype("Int64").astype(str) + ":" +
+        df["cds_strand"].astype(str)
     )
-    ap.add_argument("--merged_dir", required=True,
-                    help="Directory containing per-sample merged CSVs (e.g., merged_per_sample/)")
-    ap.add_argument("--out_prefix", required=True,
-                    help="Prefix for output files (e.g., smorf_locus_summary)")
-    ap.add_argument("--min_patients", type=int, default=2,
-                    help="Keep loci observed in at least this many patients (default: 2)")
-    args = ap.parse_args()
 
-    merged_dir = Path(args.merged_dir)
-    files = sorted(merged_dir.glob("*.merged.csv"))
-    if not files:
-        raise SystemExit(f"No *.merged.csv files found in: {merged_dir}")
+    # keep key columns + some useful fields if present
+    keep_cols = ["locus"] + LOCUS_COLS + [c for c in EXTRA_COLS if c in df.columns]
+    return df[keep_cols].copy()
+
+
+def load_merged_tables(files) -> pd.DataFrame:
+    """
+    Concatenates the per-sample merged tables.
+    `sample` is categorical over the sorted sample names.
+    """
+    samples = sorted(sample_of(f) for f in files)
+    sample_codes = {sample: i for i, sample in enumerate(samples)}
 
     rows = []
     for f in files:
-        sample = f.name.replace(".merged.csv", "")
-        df = pd.read_csv(f)
-
-        missing = [c for c in LOCUS_COLS if c not in df.columns]
-        if missing:
-            raise ValueError(f"{f}: missing required locus columns: {missing}")
-
-        # ensure numeric starts/ends if possible
-        df["cds_starts"] = pd.to_numeric(df["cds_starts"], errors="coerce")
-        df["cds_ends"]   = pd.to_numeric(df["cds_ends"], errors="coerce")
-
-        # locus key
-        df["locus"] = (
-            df["cds_chr"].astype(str) + ":" +
-            df["cds_starts"].astype("Int64").astype(str) + "-" +
-            df["cds_ends"].astype("Int64").astype(str) + ":" +
-            df["cds_strand"].astype(str)
+        sub = read_merged_table(f)
+        sub["sample"] = pd.Categorical.from_codes(
+            np.full(len(sub), sample_codes[sample_of(f)], dtype=np.int32),
+            categories=samples,
         )
+        rows.append(sub)
 
-        # keep key columns + some useful fields if present
-        keep_cols = ["locus"] + LOCUS_COLS
-        for extra in ["orf_id", "sam_probability", "classification", "aa_seq", "length", "type", "cds_seq", "smorf_type"]:
-            if extra in df.columns:
-                keep_cols.append(extra)
+    return pd.concat(rows, ignore_index=True)
 
-        sub = df[keep_cols].copy()
-        sub["sample"] = sample
-        rows.append(sub)
 
-    all_df = pd.concat(rows, ignore_index=True)
-
-    # Build aggregation spec (conditionally include optional columns)
-    agg_spec = dict(
-        cds_chr=("cds_chr", "first"),
-        cds_starts=("cds_starts", "first"),
-        cds_ends=("cds_ends", "first"),
-        cds_strand=("cds_strand", "first"),
-        n_patients=("sample", "nunique"),
-        patients=("sample", lambda x: ",".join(sorted(set(x)))),
-        n_rows=("sample", "size"),
-    )
+def aggregate_loci(all_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per locus, in sorted locus order (the order of groupby("locus")):
+    locus, cds_chr, cds_starts, cds_ends, cds_strand, n_patients, patients, n_rows,
+    max_prob, cds_seq[, aa_seq][, smorf_type, smorf_types]
+    """
+    locus_codes, loci = pd.factorize(all_df["locus"], sort=True)
+    if (locus_codes < 0).any():
+        # groupby drops rows with a null locus key
+        keep = locus_codes >= 0
+        all_df = all_df[keep].reset_index(drop=True)
+        locus_codes = locus_codes[keep]
+    n_loci = len(loci)
+    by_locus = all_df.groupby(locus_codes, sort=True)
+
+    # "first" already skips nulls, so it also gives the first non-null cds_seq/aa_seq
+    first_cols = LOCUS_COLS + [c for c in ["cds_seq", "aa_seq"] if c in all_df.columns]
+    firsts = by_locus[first_cols].first().reset_index(drop=True)
+
+    # Sample categories are sorted, so sorting by code sorts patients by name
+    sample = all_df["sample"].astype("category")
+    sample_names = list(sample.cat.categories)
+    patient_locus, patient_sample, _ = code_pairs(locus_codes, sample.cat.codes.to_numpy(), len(sample_names))
+    n_rows = np.bincount(locus_codes, minlength=n_loci)
+
+    agg = pd.DataFrame({"locus": loci})
+    for col in LOCUS_COLS:
+        agg[col] = firsts[col]
+    agg["n_patients"] = np.bincount(patient_locus, minlength=n_loci)
+    agg["patients"] = join_groups(patient_locus, [sample_names[s] for s in patient_sample.tolist()], n_loci)
+    agg["n_rows"] = n_rows
 
     if "sam_probability" in all_df.columns:
-        agg_spec["max_prob"] = ("sam_probability", "max")
+        agg["max_prob"] = by_locus["sam_probability"].max().reset_index(drop=True)
     else:
-        agg_spec["max_prob"] = ("sample", "size")
+        agg["max_prob"] = n_rows
 
     if "cds_seq" in all_df.columns:
-        agg_spec["cds_seq"] = ("cds_seq", first_nonnull)
+        agg["cds_seq"] = firsts["cds_seq"]
     else:
-        agg_spec["cds_seq"] = ("sample", "size")
+        agg["cds_seq"] = n_rows
 
     # Add aa_seq to the locus-level output (first non-null across rows)
     if "aa_seq" in all_df.columns:
-        agg_spec["aa_seq"] = ("aa_seq", first_nonnull)
+        agg["aa_seq"] = firsts["aa_seq"]
 
     if "smorf_type" in all_df.columns:
-        agg_spec["smorf_type"] = ("smorf_type", most_common_nonnull)
-        agg_spec["smorf_types"] = ("smorf_type", unique_nonnull)
+        agg["smorf_type"] = most_common_nonnull(locus_codes, all_df["smorf_type"], n_loci)
+        agg["smorf_types"] = unique_nonnull(locus_codes, all_df["smorf_type"], n_loci)
+
+    return agg
 
-    # Aggregate across samples per locus
-    agg = (
-        all_df.groupby("locus", as_index=False)
-        .agg(**agg_spec)
-    )
+
+def write_summaries(agg: pd.DataFrame, out_prefix: str, min_patients: int, fmt: str = "csv"):
+    """Writes <out_prefix>.all_loci.<fmt> and <out_prefix>.shared_ge<min_patients>.<fmt>."""
+    ext = FORMATS[fmt]
 
     # Output full summary
-    full_out = Path(f"{args.out_prefix}.all_loci.csv")
-    agg.sort_values(
+    full_out = Path(f"{out_prefix}.all_loci{ext}")
+    write_table(agg.sort_values(
         ["n_patients", "cds_chr", "cds_starts", "cds_ends"],
         ascending=[False, True, True, True]
-    ).to_csv(full_out, index=False)
+    ), full_out, schema=LOCUS_SCHEMA)
 
     # Output loci shared across >= min_patients
-    shared = agg[agg["n_patients"] >= args.min_patients].copy()
-    shared_out = Path(f"{args.out_prefix}.shared_ge{args.min_patients}.csv")
-    shared.sort_values(
+    shared = agg[agg["n_patients"] >= min_patients].copy()
+    shared_out = Path(f"{out_prefix}.shared_ge{min_patients}{ext}")
+    write_table(shared.sort_values(
         ["n_patients", "cds_chr", "cds_starts", "cds_starts", "cds_ends"],
         ascending=[False, True, True, True, True]
-    ).to_csv(shared_out, index=False)
+    ), shared_out, schema=LOCUS_SCHEMA)
 
     print(f"Total loci: {len(agg)}")
 
@@ -148,5 +221,44 @@ def main():
     print(f"[OK] Wrote: {shared_out}")
 
 
+def main():
+    ap = argparse.ArgumentParser(
+        description="Aggregate per-sample merged ShortStop tables by genomic locus and find smORFs shared across patients."
+    )
+    ap.add_argument("--merged_dir", required=True,
+                    help="Directory containing per-sample merged CSVs (e.g., merged_per_sample/)")
+    ap.add_argument("--out_prefix", required=True,
+                    help="Prefix for output files (e.g., smorf_locus_summary)")
+    ap.add_argument("--min_patients", type=int, default=2,
+                    help="Keep loci observed in at least this many patients (default: 2)")
+    ap.add_argument("--store", default=None,
+                    help="Optional: persistent SQLite locus store. Only samples added, changed or removed "
+                         "since the last run are (re)processed; the CSVs are exported from the store")
+    ap.add_argument("--format", choices=sorted(FORMATS), default="csv",
+                    help="Format of the merged tables read and of the summaries written (default: csv)")
+    args = ap.parse_args()
+
+    merged_dir = Path(args.merged_dir)
+    pattern = f"*.merged{FORMATS[args.format]}"
+    files = sorted(merged_dir.glob(pattern))
+    if not files:
+        raise SystemExit(f"No {pattern} files found in: {merged_dir}")
+
+    if args.store:
+        from locus_store import LocusStore
+        store = LocusStore(args.store)
+        added, removed = store.sync(files)
+        print(f"Locus store {args.store}: {len(added)} sample(s) added/updated, {len(removed)} removed")
+        agg = store.summary()
+        store.close()
+    else:
+        all_df = load_merged_tables(files)
+
+        # Aggregate across samples per locus
+        agg = aggregate_loci(all_df)
+
+    write_summaries(agg, args.out_prefix, args.min_patients, args.format)
+
+
 if __name__ == "__main__":
     main()
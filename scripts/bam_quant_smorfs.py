@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# smORF locus quantification straight from the STAR BAMs (coordinate-sorted and indexed),
+# instead of realigning the FASTQs to the smORF reference with bowtie2 + RSEM.
+# I run it with this command, but change the paths as needed:
+# python bam_quant_smorfs.py \
+#   --loci_csv results/cohort.all_loci.csv \
+#   --bams S1=results/star/S1.aligned.bam S2=results/star/S2.aligned.bam \
+#   --out_dir results/results_rsem_smorf --jobs 8
+#
+# For every locus of the cohort table, the fragments with an aligned block overlapping its CDS
+# span (cds_chr:cds_starts-cds_ends, 1-based inclusive) are counted with indexed region queries;
+# a fragment counts once per locus even when both mates overlap it. The locus table has no exon
+# structure, so for a spliced CDS the span includes its introns (and intronic/retained-intron
+# reads); TPMs are normalized by the same span length. Each sample is written to
+# <out_dir>/<sample>/<sample>.isoforms.results with RSEM's columns, keyed by locus. Fragments
+# overlapping several loci count for each of them (no EM).
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from kmer_quant_smorfs import isoforms_table
+from table_io import read_table
+
+
+def _pysam():
+    try:
+        import pysam
+    except ImportError:
+        raise SystemExit("BAM quantification needs pysam (conda install -c bioconda pysam)")
+    return pysam
+
+
+def load_loci(loci_csv) -> pd.DataFrame:
+    """locus, cds_chr, start (0-based), end (exclusive), cds_strand and span length of every locus."""
+    df = read_table(loci_csv, columns=["locus", "cds_chr", "cds_starts", "cds_ends", "cds_strand"])
+    missing = {"locus", "cds_chr", "cds_starts", "cds_ends", "cds_strand"} - set(df.columns)
+    if missing:
+        raise SystemExit(f"Missing required columns in {loci_csv}: {sorted(missing)}")
+    df = df.dropna(subset=["locus", "cds_chr", "cds_starts", "cds_ends"])
+    loci = pd.DataFrame({
+        "locus": df["locus"].map(str).to_numpy(),
+        "cds_chr": df["cds_chr"].map(str).to_numpy(),
+        "start": df["cds_starts"].astype("int64").to_numpy() - 1,
+        "end": df["cds_ends"].astype("int64").to_numpy(),
+        "cds_strand": df["cds_strand"].fillna(".").map(str).to_numpy(),
+    })
+    # Normalized by the span the fragments are counted over (not the spliced CDS length)
+    loci["length"] = loci["end"] - loci["start"]
+    return loci.drop_duplicates("locus").reset_index(drop=True)
+
+
+def contig_name(chrom: str, references: set):
+    """chrom as named in the BAM header (tolerates a missing/extra 'chr' prefix), or None."""
+    if chrom in references:
+        return chrom
+    alt = chrom[3:] if chrom.startswith("chr") else f"chr{chrom}"
+    return alt if alt in references else None
+
+
+def fragment_strand(read, strandedness: str) -> str:
+    """Strand of the fragment's transcript implied by a read (RSEM --strandedness semantics)."""
+    forward = not read.is_reverse
+    if read.is_paired and read.is_read2:
+        forward = not forward
+    if strandedness == "reverse":
+        forward = not forward
+    return "+" if forward else "-"
+
+
+def count_fragments(bam_path, loci: pd.DataFrame, strandedness: str = "none", min_mapq: int = 0) -> np.ndarray:
+    """Fragments overlapping each locus (primary, mapped, non-duplicate, MAPQ >= min_mapq alignments)."""
+    pysam = _pysam()
+    counts = np.zeros(len(loci), dtype=np.int64)
+    with pysam.AlignmentFile(str(bam_path), "rb") as bam:
+        references = set(bam.references)
+        rows = zip(loci["cds_chr"].tolist(), loci["start"].tolist(), loci["end"].tolist(), loci["cds_strand"].tolist())
+        for i, (chrom, start, end, strand) in enumerate(rows):
+            contig = contig_name(chrom, references)
+            if contig is None:
+                continue
+            fragments = set()
+            for read in bam.fetch(contig, start, end):
+                if (read.is_unmapped or read.is_secondary or read.is_supplementary or read.is_qcfail
+                        or read.is_duplicate or read.mapping_quality < min_mapq):
+                    continue
+                if read.is_paired and not read.is_proper_pair:
+                    continue
+                if strandedness != "none" and strand in "+-" and fragment_strand(read, strandedness) != strand:
+                    continue
+                # An aligned block must overlap the CDS (not just a splice gap spanning it)
+                if any(b_start < end and b_end > start for b_start, b_end in read.get_blocks()):
+                    fragments.add(read.query_name)
+            counts[i] = len(fragments)
+    return counts
+
+
+def quantify_sample(job) -> str:
+    sample, bam_path, loci, out_dir, strandedness, min_mapq = job
+    counts = count_fragments(bam_path, loci, strandedness, min_mapq).astype(float)
+    lengths = loci["length"].to_numpy(dtype=float)
+    ids = loci["locus"].tolist()
+    sample_dir = Path(out_dir) / sample
+    sample_dir.mkdir(parents=True, exist_ok=True)
+    out = sample_dir / f"{sample}.isoforms.results"
+    isoforms_table(ids, lengths, lengths, counts, {}).to_csv(out, sep="\t", index=False)
+    return f"[OK] {sample}: {int(counts.sum())} fragments on {int((counts > 0).sum())}/{len(ids)} loci -> {out}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Count fragments on smORF loci in STAR BAMs and write RSEM-style TPM tables.")
+    ap.add_argument("--loci_csv", required=True, help="Cohort locus summary (.csv or .parquet) with the cds_* columns")
+    ap.add_argument("--bams", nargs="+", required=True, help="sample=path/to/sample.aligned.bam (indexed)")
+    ap.add_argument("--out_dir", required=True, help="Writes <out_dir>/<sample>/<sample>.isoforms.results")
+    ap.add_argument("--strandedness", choices=["none", "forward", "reverse"], default="none",
+                    help="Library strandedness, as rsem-calculate-expression --strandedness (default: none)")
+    ap.add_argument("--min_mapq", type=int, default=0,
+                    help="Minimum MAPQ (STAR: 255 unique, 3 for two loci, 1 for 3-4, 0 for more) (default: 0)")
+    ap.add_argument("--jobs", type=int, default=1, help="Samples counted concurrently (default: 1)")
+    args = ap.parse_args()
+
+    bams = {}
+    for spec in args.bams:
+        sample, sep, path = spec.partition("=")
+        if not sep:
+            raise SystemExit(f"--bams entries must be sample=path, got '{spec}'")
+        bams[sample] = path
+
+    loci = load_loci(args.loci_csv)
+    print(f"Loaded {len(loci)} loci; counting {len(bams)} BAMs")
+    jobs = [(sample, path, loci, args.out_dir, args.strandedness, args.min_mapq) for sample, path in bams.items()]
+    if args.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(jobs))) as pool:
+            for message in pool.map(quantify_sample, jobs):
+                print(message)
+    else:
+        for job in jobs:
+            print(quantify_sample(job))
+
+
+if __name__ == "__main__":
+    main()
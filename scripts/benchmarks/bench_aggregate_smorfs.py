@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# Benchmark: vectorized aggregate_smorfs_by_locus.aggregate_loci vs the previous groupby/lambda
+# aggregation, on synthetic cohorts of per-sample merged tables.
+# I run it with this command:
+# python scripts/benchmarks/bench_aggregate_smorfs.py --samples 50 500 2000 --rows_per_sample 3000
+# Both implementations must produce byte-identical all_loci/shared CSVs; the benchmark fails otherwise.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregate_smorfs_by_locus import aggregate_loci, load_merged_tables  # noqa: E402
+
+CHROMS = [f"chr{c}" for c in list(range(1, 23)) + ["X", "Y"]]
+SMORF_TYPES = ["uORF", "dORF", "oORF", "uoORF", "lncRNA", "Intergenic", "psORF", "NA"]
+NT = "ACGT"
+AA = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def make_locus_pool(n_loci, rng):
+    pool = []
+    for i in range(n_loci):
+        start = rng.randrange(10_000, 200_000_000)
+        n_aa = rng.randrange(10, 150)
+        pool.append((
+            rng.choice(CHROMS), start, start + 3 * n_aa + 2, rng.choice("+-"),
+            "".join(rng.choices(NT, k=3 * n_aa + 3)), "M" + "".join(rng.choices(AA, k=n_aa - 1)),
+        ))
+    return pool
+
+
+def write_cohort(out_dir, n_samples, rows_per_sample, n_loci, seed=7):
+    """
+    One <sample>.merged.csv per sample with the columns written by merge_shortstop_output.py.
+    Locus popularity is skewed, so some loci are shared by most samples and most by few.
+    """
+    rng = random.Random(seed)
+    pool = make_locus_pool(n_loci, rng)
+    weights = [1 / (i + 1) ** 0.8 for i in range(n_loci)]
+    for s in range(n_samples):
+        picks = rng.choices(range(n_loci), weights=weights, k=rows_per_sample)
+        rows = []
+        for j, k in enumerate(picks):
+            chrom, start, end, strand, cds, aa = pool[k]
+            rows.append({
+                "orf_id": f"cds.STRG.{k}.{j}.p1",
+                "sam_probability": round(rng.random(), 6),
+                "classification": rng.choice(["sam_secreted", "sam_intracellular"]),
+                "aa_seq": aa if rng.random() > 0.05 else None,
+                "length": len(aa),
+                "type": "complete",
+                "cds_chr": chrom,
+                "cds_starts": start,
+                "cds_ends": end,
+                "cds_strand": strand,
+                "cds_seq": cds if rng.random() > 0.05 else None,
+                "smorf_type": rng.choice(SMORF_TYPES),
+            })
+        pd.DataFrame(rows).to_csv(out_dir / f"P{s:05d}.merged.csv", index=False)
+
+
+# === Previous implementation (kept verbatim for comparison) ===
+
+def first_nonnull(series: pd.Series):
+    s = series.dropna()
+    if len(s) == 0:
+        return pd.NA
+    return s.iloc[0]
+
+def legacy_unique_nonnull(series: pd.Series):
+    s = [str(x) for x in series.dropna() if str(x) != ""]
+    if not s:
+        return pd.NA
+    return ",".join(sorted(set(s)))
+
+def legacy_most_common_nonnull(series: pd.Series):
+    s = [str(x) for x in series.dropna() if str(x) != ""]
+    if not s:
+        return pd.NA
+    counts = {}
+    for val in s:
+        counts[val] = counts.get(val, 0) + 1
+    max_count = max(counts.values())
+    top = sorted([k for k, v in counts.items() if v == max_count])
+    return ",".join(top)
+
+def legacy_aggregate(all_df):
+    agg_spec = dict(
+        cds_chr=("cds_chr", "first"),
+        cds_starts=("cds_starts", "first"),
+        cds_ends=("cds_ends", "first"),
+        cds_strand=("cds_strand", "first"),
+        n_patients=("sample", "nunique"),
+        patients=("sample", lambda x: ",".join(sorted(set(x)))),
+        n_rows=("sample", "size"),
+    )
+    if "sam_probability" in all_df.columns:
+        agg_spec["max_prob"] = ("sam_probability", "max")
+    else:
+        agg_spec["max_prob"] = ("sample", "size")
+    if "cds_seq" in all_df.columns:
+        agg_spec["cds_seq"] = ("cds_seq", first_nonnull)
+    else:
+        agg_spec["cds_seq"] = ("sample", "size")
+    if "aa_seq" in all_df.columns:
+        agg_spec["aa_seq"] = ("aa_seq", first_nonnull)
+    if "smorf_type" in all_df.columns:
+        agg_spec["smorf_type"] = ("smorf_type", legacy_most_common_nonnull)
+        agg_spec["smorf_types"] = ("smorf_type", legacy_unique_nonnull)
+    return all_df.groupby("locus", as_index=False).agg(**agg_spec)
+
+
+def outputs(agg, min_patients=2):
+    """The two CSVs written by aggregate_smorfs_by_locus.py, as strings."""
+    full = agg.sort_values(
+        ["n_patients", "cds_chr", "cds_starts", "cds_ends"],
+        ascending=[False, True, True, True]
+    ).to_csv(index=False)
+    shared = agg[agg["n_patients"] >= min_patients].copy().sort_values(
+        ["n_patients", "cds_chr", "cds_starts", "cds_starts", "cds_ends"],
+        ascending=[False, True, True, True, True]
+    ).to_csv(index=False)
+    return full, shared
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark smORF locus aggregation on synthetic cohorts.")
+    ap.add_argument("--samples", type=int, nargs="+", default=[50, 500, 2000], help="Cohort sizes to benchmark")
+    ap.add_argument("--rows_per_sample", type=int, default=3000, help="smORF rows per merged table")
+    ap.add_argument("--loci", type=int, default=200_000, help="Size of the pool of distinct loci")
+    ap.add_argument("--skip_legacy", action="store_true", help="Only time the vectorized aggregation")
+    args = ap.parse_args()
+
+    print(f"{'samples':>8} {'rows':>10} {'loci':>9} {'load s':>8} {'legacy s':>9} {'vector s':>9} {'speedup':>8}  identical")
+    for n_samples in args.samples:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            write_cohort(tmp, n_samples, args.rows_per_sample, args.loci)
+            files = sorted(tmp.glob("*.merged.csv"))
+            all_df, t_load = timed(load_merged_tables, files)
+
+        agg, t_new = timed(aggregate_loci, all_df)
+        if args.skip_legacy:
+            print(f"{n_samples:8} {len(all_df):10} {len(agg):9} {t_load:8.2f} {'-':>9} {t_new:9.2f} {'-':>8}  -")
+            continue
+
+        legacy_df = all_df.assign(sample=all_df["sample"].astype(str))
+        legacy, t_old = timed(legacy_aggregate, legacy_df)
+        identical = outputs(agg) == outputs(legacy)
+        print(f"{n_samples:8} {len(all_df):10} {len(agg):9} {t_load:8.2f} {t_old:9.2f} {t_new:9.2f} "
+              f"{t_old / t_new:7.1f}x  {identical}")
+        if not identical:
+            raise SystemExit(f"Outputs differ for the {n_samples}-sample cohort")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Benchmark: filter_smorf_pep.scan_fasta vs the previous Bio.SeqIO loop on a TransDecoder-like .pep.
+# I run it with this command (or pass --pep to use a real TransDecoder .pep):
+# python scripts/benchmarks/bench_filter_smorf_pep.py --records 3000000
+# The Bio.SeqIO baseline is skipped when biopython is not installed.
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from filter_smorf_pep import scan_fasta  # noqa: E402
+
+AA = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def write_synthetic_pep(path, n_records, seed=11):
+    """TransDecoder-style headers, 60-column sequence lines, lengths skewed towards short ORFs."""
+    rng = random.Random(seed)
+    with open(path, "w") as out:
+        for i in range(n_records):
+            length = min(int(rng.expovariate(1 / 180)) + 20, 3000)
+            seq = "M" + "".join(rng.choices(AA, k=length - 2)) + "*"
+            out.write(f">STRG.{i}.1.p1 GENE.STRG.{i}.1~~STRG.{i}.1.p1  ORF type:complete len:{length} (+),score=12.3 "
+                      f"STRG.{i}.1:1-{3 * length}(+)\n")
+            for j in range(0, len(seq), 60):
+                out.write(seq[j:j + 60] + "\n")
+
+
+def legacy_biopython(path, min_len, max_len):
+    from Bio import SeqIO
+    kept = []
+    for record in SeqIO.parse(path, "fasta"):
+        length = len(record.seq)
+        if min_len <= length <= max_len:
+            kept.append(record.id)
+            f"{record.seq}"
+    return len(kept)
+
+
+def streaming(path, min_len, max_len):
+    n = 0
+    for record_id, seq in scan_fasta(path, min_len, max_len):
+        n += 1
+    return n
+
+
+def import_seconds(module):
+    """Wall time of a fresh interpreter importing `module` (minus a bare interpreter start)."""
+    def run(code):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        return time.perf_counter() - t0
+    return run(f"import {module}") - run("pass")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark smORF peptide filtering (records/second).")
+    ap.add_argument("--pep", default=None, help="TransDecoder .pep to scan. Default: generate a synthetic one.")
+    ap.add_argument("--records", type=int, default=3_000_000, help="Records of the synthetic .pep")
+    ap.add_argument("--min_len", type=int, default=10)
+    ap.add_argument("--max_len", type=int, default=150)
+    args = ap.parse_args()
+
+    tmp = None
+    pep = args.pep
+    if pep is None:
+        tmp = tempfile.NamedTemporaryFile(suffix=".pep", delete=False)
+        tmp.close()
+        pep = tmp.name
+        print(f"Writing synthetic .pep with {args.records} records to {pep}...")
+        write_synthetic_pep(pep, args.records)
+
+    try:
+        n_records = sum(1 for line in open(pep) if line.startswith(">"))
+        benches = [("scan_fasta (no Biopython)", streaming)]
+        try:
+            import Bio  # noqa: F401
+            benches.insert(0, ("Bio.SeqIO.parse (previous)", legacy_biopython))
+            print(f"Bio.SeqIO import time: {import_seconds('Bio.SeqIO'):.2f}s")
+        except ImportError:
+            print("biopython not installed: skipping the Bio.SeqIO baseline")
+
+        print(f"{'implementation':30} {'kept':>10} {'seconds':>9} {'records/s':>12}")
+        for name, fn in benches:
+            t0 = time.perf_counter()
+            kept = fn(pep, args.min_len, args.max_len)
+            elapsed = time.perf_counter() - t0
+            print(f"{name:30} {kept:10} {elapsed:9.2f} {n_records / elapsed:12,.0f}")
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
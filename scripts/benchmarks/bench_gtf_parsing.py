@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Micro-benchmark: shared gtf_stream reader vs the per-script GTF parsers it replaced.
+# I run it with this command (a GENCODE primary assembly GTF has ~3.4M lines):
+# python scripts/benchmarks/bench_gtf_parsing.py --gtf gencode.v38.primary_assembly.annotation.gtf.gz
+# Without --gtf, a synthetic GENCODE-like file with --lines lines is generated first.
+
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gtf_stream import iter_records, open_text  # noqa: E402
+
+
+# === Previous implementations, kept verbatim for comparison ===
+def legacy_parse_gtf_attrs(attr_str: str) -> dict:
+    # add_smorf_type_to_gtf.py / merge_shortstop_output.py
+    attrs = {}
+    for part in attr_str.strip().split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        if " " not in part:
+            continue
+        key, val = part.split(" ", 1)
+        attrs[key] = val.strip().strip('"')
+    return attrs
+
+
+ATTR_RE = re.compile(r'(\S+) "([^"]+)"')
+
+
+def legacy_parse_attributes(attr_str):
+    # Annotator smorf_annotator.py
+    return dict(ATTR_RE.findall(attr_str))
+
+
+def legacy_dict_gene_ids(path):
+    n = 0
+    with open_text(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 9:
+                continue
+            legacy_parse_gtf_attrs(parts[8]).get("gene_id")
+            n += 1
+    return n
+
+
+def legacy_regex_gene_ids(path):
+    n = 0
+    with open_text(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            parts = line.strip().split("\t")
+            if len(parts) < 9:
+                continue
+            legacy_parse_attributes(parts[8]).get("gene_id", "Unknown")
+            n += 1
+    return n
+
+
+def legacy_exon_transcript_ids(path):
+    # smorfs_transcript_to_genome_gtf.py parse_transcript_exons
+    n = 0
+    with open_text(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 9:
+                continue
+            chrom, source, feature, start, end, score, strand, frame, attrs = cols
+            if feature != "exon":
+                continue
+            transcript_id = None
+            for field in attrs.split(";"):
+                field = field.strip()
+                if field.startswith("transcript_id"):
+                    parts = field.split()
+                    if len(parts) > 1:
+                        transcript_id = parts[1].strip('"')
+                    break
+            int(start), int(end)
+            n += 1
+    return n
+
+
+# === Shared reader ===
+def stream_gene_ids(path):
+    n = 0
+    for rec in iter_records(path, keys=("gene_id",)):
+        n += 1
+    return n
+
+
+def stream_exon_transcript_ids(path):
+    n = 0
+    for rec in iter_records(path, features={"exon"}, keys=("transcript_id",)):
+        n += 1
+    return n
+
+
+def write_synthetic_gtf(path, n_lines, seed=7):
+    """GENCODE-like records: gene > transcripts > exon/CDS/UTR/codon lines with full attribute columns."""
+    rng = random.Random(seed)
+    features = ["exon", "exon", "exon", "CDS", "CDS", "UTR", "start_codon", "stop_codon"]
+    written = 0
+    gene = 0
+    with open(path, "w") as out:
+        out.write("##description: synthetic GENCODE-like annotation\n")
+        while written < n_lines:
+            gene += 1
+            chrom = f"chr{rng.randint(1, 22)}"
+            strand = rng.choice("+-")
+            g_start = rng.randint(1, 200_000_000)
+            gene_attrs = (f'gene_id "ENSG{gene:011d}.1"; gene_type "protein_coding"; '
+                          f'gene_name "GENE{gene}"; level 2; hgnc_id "HGNC:{gene}";')
+            out.write(f"{chrom}\tHAVANA\tgene\t{g_start}\t{g_start + 50000}\t.\t{strand}\t.\t{gene_attrs}\n")
+            written += 1
+            for t in range(rng.randint(1, 4)):
+                tx_attrs = (f'gene_id "ENSG{gene:011d}.1"; transcript_id "ENST{gene:08d}{t:03d}.1"; '
+                            f'gene_type "protein_coding"; gene_name "GENE{gene}"; transcript_type "protein_coding"; '
+                            f'transcript_name "GENE{gene}-20{t}"; level 2; protein_id "ENSP{gene:08d}{t:03d}.1"; '
+                            f'transcript_support_level "1"; tag "basic"; tag "CCDS";')
+                out.write(f"{chrom}\tHAVANA\ttranscript\t{g_start}\t{g_start + 50000}\t.\t{strand}\t.\t{tx_attrs}\n")
+                written += 1
+                pos = g_start
+                for e in range(rng.randint(4, 12)):
+                    feature = rng.choice(features)
+                    length = rng.randint(50, 400)
+                    out.write(f"{chrom}\tHAVANA\t{feature}\t{pos}\t{pos + length}\t.\t{strand}\t.\t"
+                              f'{tx_attrs} exon_number {e + 1}; exon_id "ENSE{gene:08d}{e:03d}.1";\n')
+                    written += 1
+                    pos += length + rng.randint(100, 3000)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark GTF attribute parsing (lines/second).")
+    ap.add_argument("--gtf", default=None, help="GTF to parse (plain or .gz). Default: generate a synthetic one.")
+    ap.add_argument("--lines", type=int, default=3_400_000,
+                    help="Lines of the synthetic GTF (default: GENCODE primary assembly size)")
+    ap.add_argument("--repeats", type=int, default=1, help="Runs per implementation (best is reported)")
+    args = ap.parse_args()
+
+    tmp = None
+    gtf = args.gtf
+    if gtf is None:
+        tmp = tempfile.NamedTemporaryFile(suffix=".gtf", delete=False)
+        tmp.close()
+        gtf = tmp.name
+        print(f"Writing synthetic GTF with {args.lines} lines to {gtf}...")
+        write_synthetic_gtf(gtf, args.lines)
+
+    benches = [
+        ("legacy dict parse_gtf_attrs, gene_id (all lines)", legacy_dict_gene_ids),
+        ("legacy regex parse_attributes, gene_id (all lines)", legacy_regex_gene_ids),
+        ("gtf_stream iter_records, gene_id (all lines)", stream_gene_ids),
+        ("legacy inline loop, exon transcript_id", legacy_exon_transcript_ids),
+        ("gtf_stream iter_records, exon transcript_id", stream_exon_transcript_ids),
+    ]
+
+    try:
+        n_lines = sum(1 for line in open_text(gtf) if not line.startswith("#"))
+        print(f"{'implementation':55} {'seconds':>9} {'lines/s':>12}")
+        for name, fn in benches:
+            best = float("inf")
+            for _ in range(args.repeats):
+                t0 = time.perf_counter()
+                fn(gtf)
+                best = min(best, time.perf_counter() - t0)
+            print(f"{name:55} {best:9.2f} {n_lines / best:12,.0f}")
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
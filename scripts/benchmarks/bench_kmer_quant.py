@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Benchmark: kmer_quant_smorfs.py vs the bowtie2 + RSEM path on simulated read pairs with
+# known abundances (runtime and TPM concordance with the truth and with RSEM).
+# I run it with this command:
+# python scripts/benchmarks/bench_kmer_quant.py --transcripts 2000 --pairs 2000000 --threads 8
+# The RSEM path is skipped when rsem-prepare-reference/bowtie2/rsem-calculate-expression/samtools
+# are not on PATH (run it inside the RSEM conda env to include it).
+
+import argparse
+import gzip
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SCRIPTS = Path(__file__).resolve().parent.parent
+NT = np.array(list("ACGT"))
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+
+def simulate(workdir: Path, n_tx, n_pairs, read_len, frag_mean, frag_sd, error_rate, seed=5):
+    """
+    Reference FASTA (with families of transcripts sharing segments, as overlapping/duplicated
+    smORF loci do), gzipped paired FASTQs and the true TPM of every transcript.
+    """
+    rng = np.random.default_rng(seed)
+    seqs = []
+    for t in range(n_tx):
+        length = int(rng.integers(300, 1500))
+        seq = "".join(NT[rng.integers(0, 4, length)])
+        if t % 5 == 4:
+            # share a segment with the previous transcript
+            prev = seqs[-1]
+            cut = min(len(prev), length) // 2
+            seq = prev[:cut] + seq[cut:]
+        seqs.append(seq)
+    ids = [f"tx{t}" for t in range(n_tx)]
+    with open(workdir / "ref.fa", "w") as fh:
+        fh.write("".join(f">{i}\n{s}\n" for i, s in zip(ids, seqs)))
+    with open(workdir / "tx2gene.tsv", "w") as fh:
+        fh.write("".join(f"{i}\t{i}\n" for i in ids))
+
+    lengths = np.array([len(s) for s in seqs], dtype=float)
+    theta = rng.lognormal(0, 2, n_tx) * (rng.random(n_tx) > 0.2)
+    # fragments are drawn proportionally to abundance x (approximate) effective length
+    weight = theta * np.maximum(lengths - frag_mean + 1, 1)
+    tx = rng.choice(n_tx, size=n_pairs, p=weight / weight.sum())
+    frag = np.clip(rng.normal(frag_mean, frag_sd, n_pairs).astype(int), read_len, None)
+    qual = "I" * read_len
+
+    def mutate(read):
+        if error_rate <= 0:
+            return read
+        read = list(read)
+        for i in np.flatnonzero(rng.random(len(read)) < error_rate):
+            read[i] = NT[rng.integers(0, 4)]
+        return "".join(read)
+
+    with gzip.open(workdir / "r1.fq.gz", "wt", compresslevel=1) as f1, gzip.open(workdir / "r2.fq.gz", "wt", compresslevel=1) as f2:
+        for n, (t, f) in enumerate(zip(tx.tolist(), frag.tolist())):
+            seq = seqs[t]
+            f = min(f, len(seq))
+            start = int(rng.integers(0, len(seq) - f + 1))
+            fragment = seq[start:start + f]
+            if rng.random() < 0.5:
+                fragment = fragment.translate(COMPLEMENT)[::-1]
+            r1 = mutate(fragment[:read_len])
+            r2 = mutate(fragment[-read_len:].translate(COMPLEMENT)[::-1])
+            f1.write(f"@p{n}/1\n{r1}\n+\n{qual[:len(r1)]}\n")
+            f2.write(f"@p{n}/2\n{r2}\n+\n{qual[:len(r2)]}\n")
+
+    truth = theta / theta.sum() * 1e6
+    return pd.Series(truth, index=ids)
+
+
+def run_kmer(workdir: Path, threads, frag_mean, frag_sd):
+    out = workdir / "kmer.isoforms.results"
+    subprocess.run([
+        sys.executable, str(SCRIPTS / "kmer_quant_smorfs.py"),
+        "--fasta", str(workdir / "ref.fa"), "--tx2gene", str(workdir / "tx2gene.tsv"),
+        "--r1", str(workdir / "r1.fq.gz"), "--r2", str(workdir / "r2.fq.gz"),
+        "--out", str(out), "--threads", str(threads),
+        "--frag_mean", str(frag_mean), "--frag_sd", str(frag_sd),
+    ], check=True)
+    return out
+
+
+def run_rsem(workdir: Path, threads):
+    """The commands of rsem_prepare_smorf_reference, rsem_align_smorf_bowtie2 and rsem_quant_smorf."""
+    ref = workdir / "rsem" / "smorfs"
+    ref.parent.mkdir()
+    subprocess.run(["rsem-prepare-reference", "--transcript-to-gene-map", str(workdir / "tx2gene.tsv"),
+                    "--bowtie2", str(workdir / "ref.fa"), str(ref)], check=True, capture_output=True)
+    bam = workdir / "rsem" / "sample.bowtie2.bam"
+    subprocess.run(
+        f"bowtie2 --reorder -q --phred33 --sensitive --dpad 0 --gbar 99999999 --mp 1,1 --np 1 "
+        f"--score-min L,0,-0.1 -I 1 -X 1000 --no-mixed --no-discordant -p {threads} -k 200 "
+        f"-x {ref} -1 {workdir / 'r1.fq.gz'} -2 {workdir / 'r2.fq.gz'} 2> {workdir / 'rsem' / 'bowtie2.log'} "
+        f"| samtools view -b -o {bam} -",
+        shell=True, check=True,
+    )
+    subprocess.run(["rsem-calculate-expression", "--paired-end", "--alignments", "-p", str(threads),
+                    "--strandedness", "none", str(bam), str(ref), str(workdir / "rsem" / "sample")],
+                   check=True, capture_output=True)
+    return workdir / "rsem" / "sample.isoforms.results"
+
+
+def concordance(tpm: pd.Series, other: pd.Series) -> tuple:
+    """(Pearson r of log1p TPM, Spearman rho, mean absolute log2 fold change over expressed transcripts)."""
+    a, b = tpm.reindex(other.index, fill_value=0.0), other
+    pearson = np.corrcoef(np.log1p(a), np.log1p(b))[0, 1]
+    spearman = a.rank().corr(b.rank())
+    expressed = (a > 1) | (b > 1)
+    mal2fc = np.mean(np.abs(np.log2((a[expressed] + 1) / (b[expressed] + 1))))
+    return pearson, spearman, mal2fc
+
+
+def read_tpm(path) -> pd.Series:
+    df = pd.read_csv(path, sep="\t")
+    return df.set_index("transcript_id")["TPM"].astype(float)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark k-mer pseudo-alignment quantification against the truth and RSEM.")
+    ap.add_argument("--transcripts", type=int, default=2000)
+    ap.add_argument("--pairs", type=int, default=500_000)
+    ap.add_argument("--read_len", type=int, default=75)
+    ap.add_argument("--frag_mean", type=float, default=250.0)
+    ap.add_argument("--frag_sd", type=float, default=30.0)
+    ap.add_argument("--error_rate", type=float, default=0.005)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--keep", default=None, help="Keep the simulated data and outputs in this folder")
+    args = ap.parse_args()
+
+    workdir = Path(args.keep) if args.keep else Path(tempfile.mkdtemp())
+    workdir.mkdir(parents=True, exist_ok=True)
+    try:
+        print(f"Simulating {args.pairs} read pairs from {args.transcripts} transcripts in {workdir}...")
+        truth = simulate(workdir, args.transcripts, args.pairs, args.read_len, args.frag_mean, args.frag_sd, args.error_rate)
+        truth.rename("TPM").to_csv(workdir / "truth.tsv", sep="\t", index_label="transcript_id")
+
+        results = {}
+        t0 = time.perf_counter()
+        results["k-mer EM"] = (read_tpm(run_kmer(workdir, args.threads, args.frag_mean, args.frag_sd)), time.perf_counter() - t0)
+
+        tools = ("rsem-prepare-reference", "bowtie2", "rsem-calculate-expression", "samtools")
+        if all(shutil.which(tool) for tool in tools):
+            t0 = time.perf_counter()
+            results["bowtie2 + RSEM"] = (read_tpm(run_rsem(workdir, args.threads)), time.perf_counter() - t0)
+        else:
+            print("RSEM/bowtie2/samtools not on PATH: skipping the RSEM path")
+
+        print(f"{'method':16} {'seconds':>9} {'r(log TPM) vs truth':>20} {'rho vs truth':>13} {'|log2FC|':>9}")
+        for name, (tpm, seconds) in results.items():
+            pearson, spearman, mal2fc = concordance(tpm, truth)
+            print(f"{name:16} {seconds:9.1f} {pearson:20.4f} {spearman:13.4f} {mal2fc:9.3f}")
+        if len(results) == 2:
+            pearson, spearman, mal2fc = concordance(results["k-mer EM"][0], results["bowtie2 + RSEM"][0])
+            print(f"k-mer EM vs RSEM: r(log TPM) {pearson:.4f}, rho {spearman:.4f}, |log2FC| {mal2fc:.3f}")
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
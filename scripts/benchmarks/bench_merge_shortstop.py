@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Benchmark: merge_shortstop_output.read_table + clean_orf_ids vs the previous sniffing
+# python-engine read and per-row regex cleaning, on a ShortStop-like sams.csv/unknown_sequences.csv.
+# I run it with this command (or pass --sample_dir to use a real ShortStop sample folder):
+# python scripts/benchmarks/bench_merge_shortstop.py --rows 2000000
+
+import argparse
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from merge_shortstop_output import clean_orf_ids, read_table  # noqa: E402
+
+AA = "ACDEFGHIKLMNPQRSTVWY"
+NT = "ACGT"
+
+
+def write_synthetic_sample(sample_dir: Path, n_rows, seed=17):
+    """ShortStop predictions/ and sequences/ CSVs with quoted orf_ids, as ShortStop writes them."""
+    rng = random.Random(seed)
+    out = sample_dir / "shortstop" / "shortstop_output"
+    (out / "predictions").mkdir(parents=True, exist_ok=True)
+    (out / "sequences").mkdir(parents=True, exist_ok=True)
+    with open(out / "predictions" / "sams.csv", "w") as pred, open(out / "sequences" / "unknown_sequences.csv", "w") as seq:
+        pred.write("orf_id,sam_probability,classification\n")
+        seq.write("orf_id,aa_seq,length,type,cds_chr,cds_starts,cds_ends,cds_strand,cds_seq\n")
+        for i in range(n_rows):
+            orf_id = f'"""cds.STRG.{i}.1.p{rng.randint(1, 4)}"""'
+            length = rng.randint(10, 150)
+            start = rng.randint(1, 200_000_000)
+            if rng.random() < 0.3:
+                pred.write(f"{orf_id},{rng.random():.6f},SAM_secreted\n")
+            seq.write(
+                f"{orf_id},M{''.join(rng.choices(AA, k=length - 1))},{length},uORF,chr{rng.randint(1, 22)},"
+                f"{start},{start + 3 * length},{rng.choice('+-')},{''.join(rng.choices(NT, k=3 * length))}\n"
+            )
+
+
+def legacy_clean_orf_id(x):
+    if pd.isna(x):
+        return x
+    s = str(x).strip()
+    s = re.sub(r'^\"+', '', s)
+    s = re.sub(r'\"+$', '', s)
+    s = s.strip('"').strip("'")
+    return s
+
+
+def legacy(path):
+    df = pd.read_csv(path, sep=None, engine="python")
+    df["orf_id_clean"] = df["orf_id"].map(legacy_clean_orf_id)
+    return df
+
+
+def fast(path):
+    df = read_table(path)
+    df["orf_id_clean"] = clean_orf_ids(df["orf_id"])
+    return df
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark loading ShortStop outputs (rows/second).")
+    ap.add_argument("--sample_dir", default=None, help="ShortStop sample folder. Default: generate a synthetic one.")
+    ap.add_argument("--rows", type=int, default=2_000_000, help="Rows of the synthetic unknown_sequences.csv")
+    args = ap.parse_args()
+
+    tmp = None
+    sample_dir = args.sample_dir
+    if sample_dir is None:
+        tmp = tempfile.mkdtemp()
+        sample_dir = tmp
+        print(f"Writing synthetic ShortStop outputs with {args.rows} sequences to {tmp}...")
+        write_synthetic_sample(Path(tmp), args.rows)
+
+    out = Path(sample_dir) / "shortstop" / "shortstop_output"
+    try:
+        print(f"{'file':24} {'implementation':34} {'rows':>10} {'seconds':>9} {'rows/s':>12}")
+        for path in (out / "predictions" / "sams.csv", out / "sequences" / "unknown_sequences.csv"):
+            results = []
+            for name, fn in (("python engine + regex (previous)", legacy), ("sniffed header + C engine", fast)):
+                t0 = time.perf_counter()
+                df = fn(path)
+                elapsed = time.perf_counter() - t0
+                results.append(df)
+                print(f"{path.name:24} {name:34} {len(df):10} {elapsed:9.2f} {len(df) / elapsed:12,.0f}")
+            pd.testing.assert_frame_equal(results[0], results[1])
+        print("Identical tables: yes")
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
+import heapq
+import os
 import re
+import sqlite3
 import subprocess
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
+from gtf_stream import file_checksum
+from proteome_index import ProteomeIndex
+from table_io import LOCUS_SCHEMA, read_table, write_table
 
 AA_RE = re.compile(r"^[A-Za-z\*]+$")
 
@@ -23,10 +31,192 @@ def run(cmd, **kwargs):
         )
     return p
 
+def db_checksum(db_prefix: str) -> str:
+    """Content checksum of the files of a BLAST database (<prefix>.p*)."""
+    prefix = Path(db_prefix)
+    files = sorted(p for p in prefix.parent.glob(prefix.name + ".*") if p.is_file())
+    if not files:
+        raise SystemExit(f"No BLAST database files found for prefix {db_prefix} (needed to key --cache)")
+    digest = hashlib.blake2b(digest_size=16)
+    for path in files:
+        digest.update(path.name.encode())
+        file_checksum(path, digest)
+    return digest.hexdigest()
+
+class BlastHitCache:
+    """
+    Persistent best human hit per cleaned peptide (SQLite). Keys hash the peptide together
+    with the BLAST database checksum and the search parameters, so a rebuilt database or
+    another evalue/seg/max_targets never reuses old results. Peptides without any hit are
+    cached as well (NULL columns).
+    """
+    def __init__(self, path, db_prefix, evalue, seg, max_targets):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Both BLASTP rules may use the same cache; wait for each other's writes
+        self.con = sqlite3.connect(path, timeout=600)
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS hits (key TEXT PRIMARY KEY, pident REAL, qcov REAL, hit_id, hit_title TEXT)"
+        )
+        self.search = f"{db_checksum(db_prefix)}\t{evalue!r}\t{seg}\t{max_targets}"
+
+    def key(self, seq: str) -> str:
+        return hashlib.blake2b(f"{self.search}\t{seq}".encode(), digest_size=16).hexdigest()
+
+    def get(self, keys) -> dict:
+        """key -> (pident, qcov, hit_id, hit_title), or None for peptides cached without hits."""
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            for key, *hit in self.con.execute(
+                f"SELECT key, pident, qcov, hit_id, hit_title FROM hits WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ):
+                found[key] = None if hit[2] is None else tuple(hit)
+        return found
+
+    def put(self, hits: dict) -> None:
+        with self.con:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?, ?)",
+                ((key, *(hit if hit is not None else (None,) * 4)) for key, hit in hits.items()),
+            )
+
+    def close(self):
+        self.con.close()
+
+def shard_records(records, n_shards: int) -> list:
+    """
+    Splits (qid, seq) records into up to n_shards shards with balanced total length
+    (longest queries first, each to the lightest shard). Deterministic for a given input.
+    """
+    shards = [[] for _ in range(n_shards)]
+    loads = [(0, i) for i in range(n_shards)]
+    for qid, seq in sorted(records, key=lambda r: -len(r[1])):
+        load, i = heapq.heappop(loads)
+        shards[i].append((qid, seq))
+        heapq.heappush(loads, (load + len(seq), i))
+    return [shard for shard in shards if shard]
+
+def run_blastp_shards(records, blastp_exe, args, tmp_dir: Path) -> list:
+    """
+    Runs blastp on args.shards shards of the queries, args.threads threads in total,
+    and returns the per-shard outfmt 6 TSVs.
+
+    A shard's TSV is named after the digest of its queries and only appears once blastp
+    finished it, so a restarted job skips the shards that are already done.
+    """
+    shards = shard_records(records, max(1, args.shards))
+    workers = min(len(shards), max(1, args.threads))
+    threads_per_shard = max(1, args.threads // workers)
+
+    # Include qlen so we can compute query coverage; stitle gives protein description line
+    outfmt = "6 qseqid sseqid pident length qlen evalue bitscore stitle"
+
+    tsvs = []
+    pending = []
+    for i, shard in enumerate(shards):
+        fasta = "".join(f">{qid}\n{seq}\n" for qid, seq in shard)
+        digest = hashlib.blake2b(fasta.encode(), digest_size=8).hexdigest()
+        query_fa = tmp_dir / f"shard{i:03d}.{digest}.fa"
+        blast_tsv = tmp_dir / f"shard{i:03d}.{digest}.tsv"
+        tsvs.append(blast_tsv)
+        if blast_tsv.exists():
+            continue
+        with open(query_fa, "w") as fh:
+            fh.write(fasta)
+        pending.append((query_fa, blast_tsv))
+
+    # Shards of previous runs over other queries
+    current = {p.name for p in tsvs} | {p.with_suffix(".fa").name for p in tsvs}
+    for stale in tmp_dir.glob("shard*"):
+        if stale.name not in current:
+            stale.unlink()
+
+    print(f"BLASTP: {len(shards)} shard(s), {len(shards) - len(pending)} already done, "
+          f"{workers} worker(s) x {threads_per_shard} thread(s)")
+
+    def blast_shard(job):
+        query_fa, blast_tsv = job
+        part = blast_tsv.with_suffix(".part")
+        run([
+            blastp_exe,
+            "-query", str(query_fa),
+            "-db", args.db,
+            "-evalue", str(args.evalue),
+            "-max_target_seqs", str(args.max_targets),
+            "-num_threads", str(threads_per_shard),
+            "-seg", args.seg,
+            "-outfmt", outfmt,
+            "-out", str(part),
+        ])
+        os.replace(part, blast_tsv)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(blast_shard, pending))
+    return tsvs
+
+BLAST_COLS = ["qseqid","sseqid","pident","aln_len","qlen","evalue","bitscore","stitle"]
+
+def parse_top_hits(tsvs, top_k: int = 1) -> dict:
+    """
+    Streams outfmt 6 TSVs (BLAST_COLS) and keeps the top_k hits of each query, ranked by
+    bitscore, then pident, then aln_len (all descending); on full ties the hit seen first
+    wins. Memory grows with the number of queries times top_k, not with the hits.
+    Returns qid -> [(pident, qcov, hit_id, hit_title, evalue, bitscore, aln_len), ...], best first.
+    """
+    top_k = max(1, top_k)
+    heaps = {}  # qid -> min-heap of (bitscore, pident, aln_len, -line number, hit)
+    n = 0
+    for tsv in tsvs:
+        with open(tsv, "r") as fh:
+            for line in fh:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 7:
+                    continue
+                n += 1
+                qid, sseqid, pident, aln_len, qlen, evalue, bitscore = fields[:7]
+                pident, aln_len, bitscore = float(pident), int(aln_len), float(bitscore)
+                entry = (bitscore, pident, aln_len, -n)
+                heap = heaps.setdefault(qid, [])
+                if len(heap) == top_k:
+                    if entry <= heap[0][:4]:
+                        continue
+                    heapq.heappop(heap)
+                title = fields[7] if len(fields) > 7 and fields[7] else None
+                qcov = (aln_len / int(qlen)) * 100.0
+                heapq.heappush(heap, (*entry, (pident, qcov, sseqid, title, float(evalue), bitscore, aln_len)))
+    return {qid: [entry[-1] for entry in sorted(heap, reverse=True)] for qid, heap in heaps.items()}
+
+def blast_best_hits(records, blastp_exe, args, tmp_dir: Path, top_k: int = 1):
+    """
+    BLASTs (qid, seq) records against args.db.
+    Returns qid -> (pident, qcov, hit_id, hit_title) of the best hit, for queries with hits,
+    and qid -> the top_k hits of parse_top_hits.
+    """
+    tsvs = run_blastp_shards(records, blastp_exe, args, tmp_dir)
+    top = parse_top_hits(tsvs, top_k)
+    return {qid: hits[0][:4] for qid, hits in top.items()}, top
+
+def write_top_hits(top_by_seq: dict, loci_by_seq: dict, out_path: Path) -> None:
+    """One row per locus and ranked hit (rank 1 = the human_best_* hit)."""
+    cols = ["pident","qcov","hit_id","hit_title","evalue","bitscore","aln_len"]
+    rows = [
+        (locus, rank, *hit)
+        for seq, hits in top_by_seq.items()
+        for rank, hit in enumerate(hits, start=1)
+        for locus in loci_by_seq[seq]
+    ]
+    top = pd.DataFrame.from_records(rows, columns=["locus", "rank", *cols])
+    write_table(top, out_path, schema={
+        "locus": "string", "rank": "int64", "pident": "float64", "qcov": "float64", "hit_id": "string",
+        "hit_title": "string", "evalue": "float64", "bitscore": "float64", "aln_len": "int64",
+    })
+
 def main():
     ap = argparse.ArgumentParser(description="BLASTP aa_seq vs human proteome and append best hit to CSV.")
-    ap.add_argument("--in_csv", required=True, help="Input locus summary CSV (must contain locus and aa_seq).")
-    ap.add_argument("--out_csv", required=True, help="Output CSV with appended BLASTP best-hit columns.")
+    ap.add_argument("--in_csv", required=True, help="Input locus summary, .csv or .parquet (must contain locus and aa_seq).")
+    ap.add_argument("--out_csv", required=True, help="Output CSV (or .parquet) with appended BLASTP best-hit columns.")
     ap.add_argument("--db", required=True, help="BLAST database prefix (as used with -db).")
     ap.add_argument(
         "--blastp",
@@ -34,9 +224,26 @@ def main():
         help="blastp executable (default: resolve 'blastp' from PATH). You may also pass a full path.",
     )
     ap.add_argument("--evalue", type=float, default=1e-3, help="E-value cutoff.")
-    ap.add_argument("--threads", type=int, default=4, help="blastp threads.")
+    ap.add_argument("--threads", type=int, default=4, help="blastp threads (in total, over all shards).")
+    ap.add_argument("--shards", type=int, default=1,
+                    help="Split the queries into this many balanced shards, BLASTed concurrently. Finished shards "
+                         "are kept in <out_csv stem>.blast_tmp/ and skipped when the job is restarted (default: 1)")
     ap.add_argument("--max_targets", type=int, default=25, help="How many target hits to keep per query.")
     ap.add_argument("--seg", default="no", choices=["yes", "no"], help="Low complexity filtering (default no for short peptides).")
+    ap.add_argument("--cache", default=None,
+                    help="Optional: SQLite cache of best hits per peptide, reused across runs. Only peptides "
+                         "not in the cache for this database and these search parameters are BLASTed.")
+    ap.add_argument("--proteome_fa", default=None,
+                    help="Optional: FASTA the BLAST database was built from. Peptides found verbatim in one of its "
+                         "proteins get that protein as best hit (pident 100, qcov 100) without running BLAST.")
+    ap.add_argument("--proteome_index_dir", default=None,
+                    help="Where the --proteome_fa index is stored and reused, keyed by the FASTA checksum "
+                         "(default: <out_csv dir>/proteome_index)")
+    ap.add_argument("--top_hits_out", default=None,
+                    help="Optional: also write the --top_k best hits of every BLASTed peptide here, one row per "
+                         "locus and hit (.csv or .parquet). Peptides taken from --cache or --proteome_fa are not BLASTed "
+                         "and have no rows.")
+    ap.add_argument("--top_k", type=int, default=5, help="Hits per peptide in --top_hits_out (default: 5).")
     args = ap.parse_args()
 
     # Resolve blastp to an absolute path to avoid PATH issues such as ENOTDIR
@@ -55,19 +262,18 @@ def main():
     out_csv = Path(args.out_csv)
     out_csv.parent.mkdir(parents=True, exist_ok=True)
 
-    # low_memory=False avoids pandas DtypeWarning for large mixed-type CSVs
-    df = pd.read_csv(in_csv, low_memory=False)
+    # low_memory=False avoids pandas DtypeWarning for large mixed-type CSVs (Parquet inputs are typed)
+    df = read_table(in_csv, low_memory=False)
     if "locus" not in df.columns or "aa_seq" not in df.columns:
         raise ValueError("Input CSV must contain columns: locus, aa_seq")
 
-    # Build query FASTA
+    # Build queries
     tmp_dir = out_csv.parent / (out_csv.stem + ".blast_tmp")
     tmp_dir.mkdir(parents=True, exist_ok=True)
-    query_fa = tmp_dir / "queries.fa"
-    blast_tsv = tmp_dir / "blast.tsv"
 
-    qmap = {}  # qid -> locus
-    records = []
+    # Loci differing only in coordinates or transcript model often carry the same peptide:
+    # BLAST each distinct cleaned peptide once and fan its best hit out to all of them
+    loci_by_seq = {}  # cleaned peptide -> loci
 
     for _, row in df[["locus", "aa_seq"]].iterrows():
         locus = str(row["locus"])
@@ -79,64 +285,71 @@ def main():
             continue
         if not AA_RE.match(seq):
             continue
-
-        # qseqid must not contain spaces for robust parsing
-        qid = locus.replace(" ", "_")
-        qmap[qid] = locus
-        records.append((qid, seq))
-
-    with open(query_fa, "w") as fh:
-        for qid, seq in records:
-            fh.write(f">{qid}\n{seq}\n")
+        loci_by_seq.setdefault(seq, []).append(locus)
 
     # If no sequences, just write NA columns and exit
-    if not records:
+    if not loci_by_seq:
         df["human_best_pident"] = pd.NA
         df["human_best_qcov"] = pd.NA
         df["human_best_hit_id"] = pd.NA
         df["human_best_hit_title"] = pd.NA
-        df.to_csv(out_csv, index=False)
+        write_table(df, out_csv, schema=LOCUS_SCHEMA)
+        if args.top_hits_out:
+            write_top_hits({}, {}, Path(args.top_hits_out))
         return
 
-    # BLASTP
-    # Include qlen so we can compute query coverage; stitle gives protein description line
-    outfmt = "6 qseqid sseqid pident length qlen evalue bitscore stitle"
-    cmd = [
-        blastp_exe,
-        "-query", str(query_fa),
-        "-db", args.db,
-        "-evalue", str(args.evalue),
-        "-max_target_seqs", str(args.max_targets),
-        "-num_threads", str(args.threads),
-        "-seg", args.seg,
-        "-outfmt", outfmt,
-        "-out", str(blast_tsv),
-    ]
-    run(cmd)
+    n_loci = sum(len(loci) for loci in loci_by_seq.values())
+    print(f"BLASTP queries: {len(loci_by_seq)} distinct peptides for {n_loci} loci")
 
-    # Parse BLAST output
-    if blast_tsv.stat().st_size == 0:
-        best = pd.DataFrame(columns=["locus","human_best_pident","human_best_qcov","human_best_hit_id","human_best_hit_title"])
-    else:
-        cols = ["qseqid","sseqid","pident","aln_len","qlen","evalue","bitscore","stitle"]
-        b = pd.read_csv(blast_tsv, sep="\t", header=None, names=cols)
+    # qseqid must not contain spaces for robust parsing
+    records = [(f"pep{i}", seq) for i, seq in enumerate(loci_by_seq)]
 
-        # Choose best hit per query by bitscore (then pident, then aln_len)
-        b = b.sort_values(["qseqid","bitscore","pident","aln_len"], ascending=[True, False, False, False])
-        b = b.drop_duplicates("qseqid", keep="first").copy()
+    # Peptides contained in a human protein: that protein is a full-length identical hit,
+    # the best BLAST could report, so only the remaining peptides go to the cache/BLAST
+    exact_hits = {}
+    if args.proteome_fa:
+        index_dir = args.proteome_index_dir or out_csv.parent / "proteome_index"
+        index = ProteomeIndex.cached(args.proteome_fa, index_dir)
+        for qid, seq in records:
+            found = index.find(seq)
+            if found is not None:
+                exact_hits[qid] = (100.0, 100.0, *found)
+        records = [(qid, seq) for qid, seq in records if qid not in exact_hits]
+        print(f"Exact proteome matches: {len(exact_hits)} peptides, {len(records)} left for BLASTP")
 
-        b["human_best_qcov"] = (b["aln_len"] / b["qlen"]) * 100.0
-        b["locus"] = b["qseqid"].map(qmap)
+    top_k = args.top_k if args.top_hits_out else 1
+    top = {}
+    if not records:
+        hits = {}
+    elif args.cache:
+        cache = BlastHitCache(args.cache, args.db, args.evalue, args.seg, args.max_targets)
+        keys = {qid: cache.key(seq) for qid, seq in records}
+        cached = cache.get(keys.values())
+        misses = [(qid, seq) for qid, seq in records if keys[qid] not in cached]
+        print(f"BLASTP cache: {len(records) - len(misses)} hits, {len(misses)} misses")
 
-        best = b[["locus"]].copy()
-        best["human_best_pident"] = b["pident"]
-        best["human_best_qcov"] = b["human_best_qcov"]
-        best["human_best_hit_id"] = b["sseqid"]
-        best["human_best_hit_title"] = b["stitle"]
+        new_hits, top = blast_best_hits(misses, blastp_exe, args, tmp_dir, top_k) if misses else ({}, {})
+        cache.put({keys[qid]: new_hits.get(qid) for qid, _ in misses})
+        cached.update((keys[qid], new_hits.get(qid)) for qid, _ in misses)
+        cache.close()
+        hits = {qid: cached[keys[qid]] for qid, _ in records if cached[keys[qid]] is not None}
+    else:
+        hits, top = blast_best_hits(records, blastp_exe, args, tmp_dir, top_k)
+
+    hits.update(exact_hits)
+    seq_of = {f"pep{i}": seq for i, seq in enumerate(loci_by_seq)}
+    best = pd.DataFrame.from_records(
+        [(locus, *hit) for qid, hit in hits.items() for locus in loci_by_seq[seq_of[qid]]],
+        columns=["locus","human_best_pident","human_best_qcov","human_best_hit_id","human_best_hit_title"],
+    )
 
     # Merge back
     df2 = df.merge(best, on="locus", how="left")
-    df2.to_csv(out_csv, index=False)
+    write_table(df2, out_csv, schema=LOCUS_SCHEMA)
+
+    if args.top_hits_out:
+        write_top_hits({seq_of[qid]: hits for qid, hits in top.items()}, loci_by_seq, Path(args.top_hits_out))
+        print(f"[OK] Wrote: {args.top_hits_out}")
 
 if __name__ == "__main__":
     main()
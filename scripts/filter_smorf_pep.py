@@ -1,7 +1,73 @@
 #!/usr/bin/env python3
 
 import argparse
-from Bio import SeqIO
+from gtf_stream import gff3_attr, open_text
+
+
+def scan_fasta(path: str, min_len: int, max_len: int):
+    """
+    Yield (record_id, sequence) for the FASTA records whose length is within
+    [min_len, max_len], without building record objects. Sequence lines of a
+    record are dropped as soon as it grows past max_len; record_id is the first
+    word of the header, as in Bio.SeqIO.
+    """
+    record_id = None
+    chunks = []
+    length = 0
+    with open_text(path) as fh:
+        for line in fh:
+            if line[0] == ">":
+                if record_id is not None and min_len <= length <= max_len:
+                    yield record_id, "".join(chunks)
+                title = line[1:].split(None, 1)
+                record_id = title[0] if title else ""
+                chunks = []
+                length = 0
+                continue
+            if record_id is None:
+                continue
+            seq = line.rstrip()
+            if " " in seq:
+                seq = seq.replace(" ", "")
+            length += len(seq)
+            if length <= max_len:
+                chunks.append(seq)
+            elif chunks:
+                chunks = []
+    if record_id is not None and min_len <= length <= max_len:
+        yield record_id, "".join(chunks)
+
+
+def orf_row_ids(attrs: str):
+    """
+    ORF IDs a TransDecoder GFF3 row belongs to: Parent for exon/CDS/UTR rows, ID for
+    the mRNA row and the part after '~~' for the gene row (ID=GENE.<transcript>~~<orf>).
+    """
+    parent = gff3_attr(attrs, "Parent")
+    if parent:
+        yield from parent.split(",")
+    row_id = gff3_attr(attrs, "ID")
+    if row_id:
+        yield row_id
+        if "~~" in row_id:
+            yield row_id.split("~~", 1)[1]
+
+
+def filter_gff3(gff3_path: str, orf_ids: set, out_path: str) -> int:
+    """Write the GFF3 rows of the retained ORFs (exact ID lookup, one pass)."""
+    n_rows = 0
+    with open_text(gff3_path) as fin, open(out_path, "w") as fout:
+        for line in fin:
+            if line.startswith("#"):
+                continue
+            cols = line.split("\t", 8)
+            if len(cols) < 9:
+                continue
+            if any(orf_id in orf_ids for orf_id in orf_row_ids(cols[8])):
+                fout.write(line)
+                n_rows += 1
+    return n_rows
+
 
 def main():
     parser = argparse.ArgumentParser(description="Filter TransDecoder peptide FASTA for small ORFs")
@@ -10,20 +76,26 @@ def main():
     parser.add_argument("--max_len", type=int, default=150, help="Maximum AA length")
     parser.add_argument("--out_fasta", default="smorfs.fa", help="Output FASTA for smORFs")
     parser.add_argument("--out_ids", default="smorf_ids.txt", help="Output file listing retained smORF IDs")
+    parser.add_argument("--gff3", default=None, help="Optional: TransDecoder GFF3 to filter down to the retained smORFs")
+    parser.add_argument("--out_gff3", default="smorfs.gff3", help="Output GFF3 for smORFs (with --gff3)")
 
     args = parser.parse_args()
 
-    kept = []
-    with open(args.out_fasta, "w") as fasta_out, open(args.out_ids, "w") as id_out:
-        for record in SeqIO.parse(args.pep_file, "fasta"):
-            length = len(record.seq)
+    n_kept = 0
+    kept_ids = set() if args.gff3 else None  # only needed to select GFF3 rows
+    with open(args.out_fasta, "w", buffering=1 << 20) as fasta_out, open(args.out_ids, "w", buffering=1 << 20) as id_out:
+        for record_id, seq in scan_fasta(args.pep_file, args.min_len, args.max_len):
+            n_kept += 1
+            fasta_out.write(f">{record_id}\n{seq}\n")
+            id_out.write(record_id + "\n")
+            if kept_ids is not None:
+                kept_ids.add(record_id)
 
-            if args.min_len <= length <= args.max_len:
-                kept.append(record.id)
-                fasta_out.write(f">{record.id}\n{record.seq}\n")
-                id_out.write(record.id + "\n")
+    print(f"Kept {n_kept} smORFs (AA length between {args.min_len} and {args.max_len})")
 
-    print(f"Kept {len(kept)} smORFs (AA length between {args.min_len} and {args.max_len})")
+    if args.gff3:
+        n_rows = filter_gff3(args.gff3, kept_ids, args.out_gff3)
+        print(f"Kept {n_rows} GFF3 rows for those smORFs")
 
 if __name__ == "__main__":
     main()
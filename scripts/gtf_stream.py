@@ -0,0 +1,130 @@
+# Shared streaming reader for the GTF/GFF3 files handled by the pipeline scripts
+# (StringTie GTFs, TransDecoder GFF3s, smORF GTFs and Ensembl/GENCODE references).
+#
+#   from gtf_stream import iter_records
+#   for rec in iter_records("sample.gtf", features={"exon"}, keys=("transcript_id",)):
+#       tx_id, = rec.values
+#
+# Lines are split lazily: the feature column is checked before the rest of the line
+# is split, and only the requested attribute keys are extracted from column 9.
+# file_checksum is the content checksum that keys the scripts' on-disk caches.
+
+import gzip
+import hashlib
+from typing import Iterable, Iterator, NamedTuple, Optional, TextIO
+
+
+class GTFRecord(NamedTuple):
+    seqid: str
+    source: str
+    feature: str
+    start: int
+    end: int
+    score: str
+    strand: str
+    frame: str
+    attributes: str  # raw column 9, for keys that were not requested
+    values: tuple    # requested attribute values, in the order of `keys` (None if absent)
+
+
+def open_text(path) -> TextIO:
+    """Open a plain or gzip-compressed text file (detected from its magic bytes)."""
+    with open(path, "rb") as fh:
+        magic = fh.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+
+def file_checksum(path, digest=None, chunk_size=1 << 20) -> str:
+    """
+    blake2b (16 bytes) hex checksum of a file's content, read in chunks. With `digest`, the
+    file is fed into that hash object instead (to checksum several files together).
+    """
+    if digest is None:
+        digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def gtf_attr(attr_str: str, key: str) -> Optional[str]:
+    """
+    Value of `key` in a GTF attribute column (key "value"; ...), or None.
+    Returns the first occurrence, without building a dict of the whole column.
+    """
+    needle = key + " "
+    i = attr_str.find(needle)
+    while i != -1:
+        if i == 0 or attr_str[i - 1] in " ;\t":
+            j = i + len(needle)
+            k = attr_str.find(";", j)
+            return (attr_str[j:k] if k != -1 else attr_str[j:]).strip().strip('"')
+        i = attr_str.find(needle, i + 1)
+    return None
+
+
+def gff3_attr(attr_str: str, key: str) -> Optional[str]:
+    """Value of `key` in a GFF3 attribute column (key=value;...), or None."""
+    needle = key + "="
+    i = attr_str.find(needle)
+    while i != -1:
+        if i == 0 or attr_str[i - 1] in " ;\t":
+            j = i + len(needle)
+            k = attr_str.find(";", j)
+            return (attr_str[j:k] if k != -1 else attr_str[j:]).strip()
+        i = attr_str.find(needle, i + 1)
+    return None
+
+
+def parse_gtf_attrs(attr_str: str) -> dict:
+    """Full attribute dict of a GTF column 9 (last occurrence of a key wins)."""
+    attrs = {}
+    for part in attr_str.strip().split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        if " " not in part:
+            continue
+        key, val = part.split(" ", 1)
+        attrs[key] = val.strip().strip('"')
+    return attrs
+
+
+def iter_records(
+    path,
+    features: Optional[Iterable[str]] = None,
+    keys: Iterable[str] = (),
+    fmt: str = "gtf",
+) -> Iterator[GTFRecord]:
+    """
+    Stream the feature lines of a GTF ("gtf") or GFF3 ("gff3") file, plain or gzipped.
+
+    features: only yield these feature types (column 3); other lines are skipped
+              before the rest of the line is split.
+    keys:     attribute keys extracted into GTFRecord.values.
+    """
+    wanted = set(features) if features is not None else None
+    keys = tuple(keys)
+    get_attr = gff3_attr if fmt == "gff3" else gtf_attr
+    make = tuple.__new__  # skips NamedTuple.__new__ argument handling
+
+    with open_text(path) as fh:
+        for line in fh:
+            if line[0] == "#":
+                continue
+            head = line.split("\t", 3)
+            if len(head) < 4:
+                continue
+            feature = head[2]
+            if wanted is not None and feature not in wanted:
+                continue
+            rest = head[3].rstrip("\n").split("\t", 5)
+            if len(rest) < 6:
+                continue
+            attrs = rest[5]
+            yield make(GTFRecord, (
+                head[0], head[1], feature, int(rest[0]), int(rest[1]), rest[2], rest[3], rest[4], attrs,
+                tuple([get_attr(attrs, k) for k in keys]),
+            ))
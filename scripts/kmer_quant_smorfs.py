@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# Lightweight smORF quantification: k-mer pseudo-alignment of read pairs to the smORF CDS
+# reference and an EM over equivalence classes, written as an RSEM-style isoforms.results.
+# I run it with this command, but change the paths as needed:
+# python kmer_quant_smorfs.py \
+#   --fasta results/results_rsem_smorf/reference/smorfs.cds.fa \
+#   --r1 S1_R1.fastq.gz --r2 S1_R2.fastq.gz \
+#   --out results/results_rsem_smorf/S1/S1.isoforms.results --threads 8
+#
+# A pair is assigned to the transcripts that contain every reference k-mer sampled from both
+# mates (either strand). Pairs with the same transcript set form an equivalence class; the EM
+# splits each class over its transcripts by abundance / effective length, as RSEM does for
+# multi-mapping fragments, but without alignments, qualities or fragment positions.
+
+import argparse
+import multiprocessing
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import prefilter_smorf_reads as reads
+
+# k-mer (both orientations) -> equivalence class id; class id -> transcript indices.
+# Set in the parent before the worker processes are forked.
+KMER_CLASS = {}
+CLASSES = []
+
+
+def revcomp(seq: str) -> str:
+    return seq.translate(reads.COMPLEMENT)[::-1]
+
+
+def read_reference(fasta) -> tuple:
+    """(transcript ids, upper-case sequences) of a FASTA; ids are the first header word."""
+    ids, seqs, chunks = [], [], None
+    with open(fasta, "r") as fh:
+        for line in fh:
+            if line.startswith(">"):
+                if chunks is not None:
+                    seqs.append("".join(chunks).upper())
+                ids.append(line[1:].split()[0])
+                chunks = []
+            else:
+                chunks.append(line.strip())
+    if chunks is not None:
+        seqs.append("".join(chunks).upper())
+    return ids, seqs
+
+
+def build_index(seqs: list, k: int) -> tuple:
+    """k-mer -> class id (for both orientations of every k-mer) and the transcript tuple of each class."""
+    tx_of = {}
+    for t, seq in enumerate(seqs):
+        for i in range(len(seq) - k + 1):
+            kmer = seq[i:i + k]
+            if "N" in kmer:
+                continue
+            key = min(kmer, revcomp(kmer))
+            txs = tx_of.get(key)
+            if txs is None:
+                tx_of[key] = [t]
+            elif txs[-1] != t:
+                txs.append(t)
+
+    class_id = {}
+    kmer_class = {}
+    for key, txs in tx_of.items():
+        cid = class_id.setdefault(tuple(txs), len(class_id))
+        kmer_class[key] = cid
+        kmer_class[revcomp(key)] = cid
+    return kmer_class, list(class_id)
+
+
+def pseudoalign(seqs, k: int, step: int):
+    """Transcript tuple compatible with every sampled reference k-mer of the mates, or None."""
+    current = None
+    last_cid = -1
+    for seq in seqs:
+        last = len(seq) - k
+        if last < 0:
+            continue
+        positions = list(range(0, last + 1, step))
+        if last % step:
+            positions.append(last)
+        for i in positions:
+            cid = KMER_CLASS.get(seq[i:i + k])
+            if cid is None or cid == last_cid:
+                continue
+            last_cid = cid
+            txs = CLASSES[cid]
+            if current is None:
+                current = txs
+            else:
+                current = tuple(sorted(set(current).intersection(txs)))
+                if not current:
+                    return None
+    return current
+
+
+def count_chunk(job):
+    """(Counter of transcript tuples, pairs in chunk) of one chunk of read pairs."""
+    (text1, text2), k, step = job
+    lines1, lines2 = text1.split("\n"), text2.split("\n")
+    counts = Counter()
+    n = len(lines1) // 4
+    for j in range(1, 4 * n, 4):
+        txs = pseudoalign((lines1[j], lines2[j]), k, step)
+        if txs is not None:
+            counts[txs] += 1
+    return counts, n
+
+
+def effective_lengths(lengths: np.ndarray, frag_mean: float, frag_sd: float) -> np.ndarray:
+    """
+    RSEM-style effective lengths: sum over fragment lengths l <= length of P(l) * (length - l + 1),
+    with a normal fragment length distribution truncated to 1..max(length).
+    """
+    max_len = int(lengths.max()) if len(lengths) else 1
+    l = np.arange(1, max_len + 1, dtype=float)
+    p = np.exp(-0.5 * ((l - frag_mean) / frag_sd) ** 2)
+    p /= p.sum()
+    cum_p = np.concatenate(([0.0], np.cumsum(p)))
+    cum_lp = np.concatenate(([0.0], np.cumsum(l * p)))
+    idx = lengths.astype(int)
+    return (lengths + 1) * cum_p[idx] - cum_lp[idx]
+
+
+def run_em(class_txs: list, class_counts: np.ndarray, eff_len: np.ndarray,
+           max_iter: int = 10000, tol: float = 1e-4) -> np.ndarray:
+    """
+    Expected fragment counts per transcript. Each class's count is split over its transcripts
+    proportionally to abundance / effective length; transcripts with zero effective length
+    get nothing. Stops when no transcript with more than 0.01 fragments changes by more than tol.
+    """
+    n_tx = len(eff_len)
+    usable = eff_len > 0
+    entries = [(c, t) for c, txs in enumerate(class_txs) for t in txs if usable[t]]
+    if not entries:
+        return np.zeros(n_tx)
+    entry_class = np.array([c for c, _ in entries])
+    entry_tx = np.array([t for _, t in entries])
+    n_classes = len(class_txs)
+
+    counts = np.zeros(n_tx)
+    counts[usable] = class_counts.sum() / usable.sum()
+    inv_len = np.zeros(n_tx)
+    inv_len[usable] = 1.0 / eff_len[usable]
+    for _ in range(max_iter):
+        weight = (counts * inv_len)[entry_tx]
+        denom = np.bincount(entry_class, weights=weight, minlength=n_classes)
+        share = np.where(denom[entry_class] > 0, weight / np.where(denom > 0, denom, 1)[entry_class], 0.0)
+        new = np.bincount(entry_tx, weights=class_counts[entry_class] * share, minlength=n_tx)
+        moving = new > 0.01
+        done = not np.any(np.abs(new[moving] - counts[moving]) > tol * new[moving])
+        counts = new
+        if done:
+            break
+    return counts
+
+
+def isoforms_table(ids, lengths, eff_len, counts, tx2gene: dict) -> pd.DataFrame:
+    """RSEM isoforms.results columns and number formats."""
+    rate = np.where(eff_len > 0, counts / np.where(eff_len > 0, eff_len, 1), 0.0)
+    tpm = rate / rate.sum() * 1e6 if rate.sum() > 0 else np.zeros(len(ids))
+    total = counts.sum()
+    fpkm = np.where(eff_len > 0, counts * 1e9 / np.where(eff_len > 0, eff_len, 1) / max(total, 1), 0.0)
+    genes = [tx2gene.get(t, t) for t in ids]
+    gene_tpm = pd.Series(tpm).groupby(genes).transform("sum").to_numpy()
+    iso_pct = np.where(gene_tpm > 0, 100 * tpm / np.where(gene_tpm > 0, gene_tpm, 1), 0.0)
+    return pd.DataFrame({
+        "transcript_id": ids,
+        "gene_id": genes,
+        "length": lengths.astype(int),
+        "effective_length": [f"{v:.2f}" for v in np.maximum(eff_len, 0)],
+        "expected_count": [f"{v:.2f}" for v in counts],
+        "TPM": [f"{v:.2f}" for v in tpm],
+        "FPKM": [f"{v:.2f}" for v in fpkm],
+        "IsoPct": [f"{v:.2f}" for v in iso_pct],
+    })
+
+
+def main():
+    global KMER_CLASS, CLASSES
+    ap = argparse.ArgumentParser(description="k-mer pseudo-alignment + EM quantification of the smORF CDS reference.")
+    ap.add_argument("--fasta", required=True, help="smORF CDS reference FASTA (smorfs.cds.fa)")
+    ap.add_argument("--r1", required=True, help="R1 FASTQ (.gz or plain)")
+    ap.add_argument("--r2", required=True, help="R2 FASTQ (.gz or plain)")
+    ap.add_argument("--out", required=True, help="Output <sample>.isoforms.results (RSEM columns)")
+    ap.add_argument("--tx2gene", default=None, help="Optional: transcript_id -> gene_id TSV (default: genes are transcripts)")
+    ap.add_argument("-k", type=int, default=25, help="k-mer length (default: 25)")
+    ap.add_argument("--step", type=int, default=4, help="Sample every step-th read k-mer (default: 4)")
+    ap.add_argument("--frag_mean", type=float, default=200.0, help="Mean fragment length (default: 200)")
+    ap.add_argument("--frag_sd", type=float, default=80.0, help="Fragment length standard deviation (default: 80)")
+    ap.add_argument("--threads", type=int, default=1, help="Worker processes pseudo-aligning chunks of reads (default: 1)")
+    ap.add_argument("--chunk_pairs", type=int, default=50_000, help="Read pairs per chunk (default: 50000)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    ids, seqs = read_reference(args.fasta)
+    KMER_CLASS, CLASSES = build_index(seqs, args.k)
+    print(f"Index: {len(ids)} transcripts, {len(KMER_CLASS) // 2} k-mers (k={args.k}), {len(CLASSES)} classes")
+
+    fh1, fh2 = reads.open_fastq(args.r1), reads.open_fastq(args.r2)
+    jobs = ((chunk, args.k, args.step) for chunk in reads.read_chunks(fh1, fh2, args.chunk_pairs))
+    counts = Counter()
+    n_in = 0
+    if args.threads > 1:
+        # fork: the workers inherit the index instead of receiving a pickled copy
+        with multiprocessing.get_context("fork").Pool(args.threads) as pool:
+            for chunk_counts, n in pool.imap(count_chunk, jobs):
+                counts.update(chunk_counts)
+                n_in += n
+    else:
+        for chunk_counts, n in map(count_chunk, jobs):
+            counts.update(chunk_counts)
+            n_in += n
+    # Exits if pigz failed on a corrupt/truncated FASTQ: must run before any TPMs are written
+    for fh in (fh1, fh2):
+        fh.close()
+    n_assigned = sum(counts.values())
+    print(f"Pseudo-aligned {n_assigned}/{n_in} read pairs into {len(counts)} equivalence classes")
+
+    lengths = np.array([len(s) for s in seqs], dtype=float)
+    eff_len = effective_lengths(lengths, args.frag_mean, args.frag_sd)
+    class_txs = list(counts)
+    expected = run_em(class_txs, np.array([counts[c] for c in class_txs], dtype=float), eff_len)
+
+    tx2gene = {}
+    if args.tx2gene:
+        tx2gene = dict(pd.read_csv(args.tx2gene, sep="\t", header=None, dtype=str).values.tolist())
+    isoforms_table(ids, lengths, eff_len, expected, tx2gene).to_csv(args.out, sep="\t", index=False)
+    print(f"[OK] Wrote: {args.out} ({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# Persistent cohort locus store (SQLite) behind aggregate_smorfs_by_locus.py --store.
+#
+#   store = LocusStore("cohort.loci.sqlite")
+#   store.sync(sorted(Path("merged_per_sample").glob("*.merged.csv")))
+#   agg = store.summary()   # same table as aggregate_loci() on the whole cohort
+#
+# Every sample file is folded in once, keyed by sample name and content checksum, as a
+# per-locus reduction (first non-null locus/sequence fields, row count, max probability,
+# smorf_type counts). The locus aggregates are kept in their own table and only the
+# loci touched by an added or removed sample are recomputed, so a new biopsy costs the
+# loci of that biopsy instead of a re-read of the cohort.
+
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from aggregate_smorfs_by_locus import (
+    LOCUS_COLS, code_pairs, join_groups, join_most_common, read_merged_table, sample_of,
+)
+from gtf_stream import file_checksum
+
+STORE_VERSION = 2
+SEQ_COLS = ["cds_seq", "aa_seq"]
+# Optional merged-table columns; the summary only has the matching output columns
+# if at least one sample in the store had them (as when concatenating the tables)
+FLAG_COLS = {"sam_probability": "has_prob", "cds_seq": "has_cds_seq", "aa_seq": "has_aa_seq", "smorf_type": "has_smorf_type"}
+LOCI_COLS = ["locus"] + LOCUS_COLS + ["n_patients", "patients", "n_rows", "max_prob", "cds_seq", "aa_seq",
+                                      "smorf_type", "smorf_types"]
+
+# Columns without a declared type keep the Python type they were written with,
+# so integer and float coordinates come back as they were read from the CSVs.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS samples (
+    sample_id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    file_name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    n_rows INTEGER NOT NULL,
+    has_prob INTEGER NOT NULL,
+    has_cds_seq INTEGER NOT NULL,
+    has_aa_seq INTEGER NOT NULL,
+    has_smorf_type INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sample_loci (
+    locus TEXT NOT NULL,
+    sample_id INTEGER NOT NULL,
+    cds_chr, cds_starts, cds_ends, cds_strand,
+    n_rows INTEGER NOT NULL,
+    max_prob REAL,
+    cds_seq, aa_seq,
+    PRIMARY KEY (locus, sample_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sample_loci_sample ON sample_loci (sample_id);
+CREATE TABLE IF NOT EXISTS sample_types (
+    locus TEXT NOT NULL,
+    sample_id INTEGER NOT NULL,
+    smorf_type TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (locus, sample_id, smorf_type)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sample_types_sample ON sample_types (sample_id);
+CREATE TABLE IF NOT EXISTS loci (
+    locus TEXT PRIMARY KEY,
+    cds_chr, cds_starts, cds_ends, cds_strand,
+    n_patients INTEGER NOT NULL,
+    patients TEXT NOT NULL,
+    n_rows INTEGER NOT NULL,
+    max_prob REAL,
+    cds_seq, aa_seq,
+    smorf_type TEXT,
+    smorf_types TEXT
+);
+"""
+
+
+def sql_rows(df: pd.DataFrame):
+    """Rows of df as tuples of Python values, with None for nulls."""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+class LocusStore:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.path)
+        self.con.executescript(SCHEMA)
+        row = self.con.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None:
+            with self.con:
+                self.con.execute("INSERT INTO meta VALUES ('version', ?)", (str(STORE_VERSION),))
+        elif int(row[0]) == 1:
+            # v1 had no file size/mtime: they are filled in (after one checksum) by the next sync
+            with self.con:
+                self.con.execute("ALTER TABLE samples ADD COLUMN size INTEGER")
+                self.con.execute("ALTER TABLE samples ADD COLUMN mtime_ns INTEGER")
+                self.con.execute("UPDATE meta SET value = ? WHERE key = 'version'", (str(STORE_VERSION),))
+        elif int(row[0]) != STORE_VERSION:
+            raise ValueError(f"{self.path}: locus store version {row[0]} (expected {STORE_VERSION})")
+        self.con.execute("CREATE TEMP TABLE IF NOT EXISTS affected (locus TEXT PRIMARY KEY)")
+
+    def close(self):
+        self.con.close()
+
+    def samples(self) -> dict:
+        """name -> checksum of the samples folded into the store."""
+        return dict(self.con.execute("SELECT name, checksum FROM samples"))
+
+    def sync(self, files):
+        """
+        Makes the store hold exactly the samples of `files`: samples whose file is gone
+        or has a new checksum are removed, new or changed files are added. Only files
+        whose size or mtime differ from the stored ones are checksummed.
+        Returns (added, removed) sample names.
+        """
+        files = {sample_of(Path(f)): Path(f) for f in files}
+        stored = {name: (checksum, size, mtime_ns) for name, checksum, size, mtime_ns
+                  in self.con.execute("SELECT name, checksum, size, mtime_ns FROM samples")}
+        stats = {name: f.stat() for name, f in files.items()}
+        checksums = {}
+        touched = []
+        for name, f in files.items():
+            st = stats[name]
+            old = stored.get(name)
+            if old is not None and old[1:] == (st.st_size, st.st_mtime_ns):
+                checksums[name] = old[0]
+            else:
+                checksums[name] = file_checksum(f)
+                if old is not None and old[0] == checksums[name]:
+                    touched.append(name)
+
+        removed = sorted(name for name, (checksum, _, _) in stored.items() if checksums.get(name) != checksum)
+        added = sorted(name for name, checksum in checksums.items() if stored.get(name, (None,))[0] != checksum)
+
+        with self.con:
+            for name in removed:
+                self.__remove(name)
+            for name in added:
+                self.__add(files[name], checksums[name])
+            # Same content, new mtime (or a v1 store): remember the stat so the next sync skips the checksum
+            self.con.executemany(
+                "UPDATE samples SET size = ?, mtime_ns = ? WHERE name = ?",
+                [(stats[name].st_size, stats[name].st_mtime_ns, name) for name in touched],
+            )
+            self.__refresh()
+        return added, removed
+
+    def add_sample(self, path):
+        """Adds (or replaces) the sample of a merged table."""
+        path = Path(path)
+        with self.con:
+            if sample_of(path) in self.samples():
+                self.__remove(sample_of(path))
+            self.__add(path, file_checksum(path))
+            self.__refresh()
+
+    def remove_sample(self, name):
+        with self.con:
+            self.__remove(name)
+            self.__refresh()
+
+    def __add(self, path, checksum):
+        sub = read_merged_table(path)
+        sub = sub[sub["locus"].notna()]
+        by_locus = sub.groupby("locus", sort=True)
+
+        red = pd.DataFrame(index=by_locus.size().index)
+        first_cols = LOCUS_COLS + [c for c in SEQ_COLS if c in sub.columns]
+        red[first_cols] = by_locus[first_cols].first()
+        for col in SEQ_COLS:
+            if col not in red.columns:
+                red[col] = None
+        red["n_rows"] = by_locus.size()
+        red["max_prob"] = by_locus["sam_probability"].max() if "sam_probability" in sub.columns else np.nan
+        red = red.reset_index()
+
+        st = path.stat()
+        cur = self.con.execute(
+            "INSERT INTO samples (name, file_name, checksum, size, mtime_ns, n_rows, "
+            "has_prob, has_cds_seq, has_aa_seq, has_smorf_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (sample_of(path), path.name, checksum, st.st_size, st.st_mtime_ns, len(sub),
+             *[int(c in sub.columns) for c in FLAG_COLS]),
+        )
+        sample_id = cur.lastrowid
+        red.insert(1, "sample_id", sample_id)
+        self.con.executemany(
+            "INSERT INTO sample_loci (locus, sample_id, cds_chr, cds_starts, cds_ends, cds_strand, "
+            "n_rows, max_prob, cds_seq, aa_seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            sql_rows(red[["locus", "sample_id"] + LOCUS_COLS + ["n_rows", "max_prob"] + SEQ_COLS]),
+        )
+
+        if "smorf_type" in sub.columns:
+            types = sub["smorf_type"]
+            keep = types.notna()
+            types = types[keep].astype(str)
+            nonempty = types != ""
+            counts = types[nonempty].groupby(sub["locus"][keep][nonempty]).value_counts()
+            self.con.executemany(
+                "INSERT INTO sample_types (locus, sample_id, smorf_type, n) VALUES (?, ?, ?, ?)",
+                ((locus, sample_id, smorf_type, int(n)) for (locus, smorf_type), n in counts.items()),
+            )
+
+        self.con.execute("INSERT OR IGNORE INTO affected SELECT locus FROM sample_loci WHERE sample_id = ?", (sample_id,))
+        print(f"[store] added {sample_of(path)} ({len(red)} loci)")
+
+    def __remove(self, name):
+        row = self.con.execute("SELECT sample_id FROM samples WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return
+        sample_id = row[0]
+        self.con.execute("INSERT OR IGNORE INTO affected SELECT locus FROM sample_loci WHERE sample_id = ?", (sample_id,))
+        self.con.execute("DELETE FROM sample_types WHERE sample_id = ?", (sample_id,))
+        self.con.execute("DELETE FROM sample_loci WHERE sample_id = ?", (sample_id,))
+        self.con.execute("DELETE FROM samples WHERE sample_id = ?", (sample_id,))
+        print(f"[store] removed {name}")
+
+    def __refresh(self):
+        """
+        Recomputes the loci rows of the affected loci from their per-sample reductions.
+        Samples are combined in file name order, which is the order in which
+        aggregate_smorfs_by_locus.py concatenates the merged tables.
+        """
+        con = self.con
+        con.execute("DELETE FROM loci WHERE locus IN (SELECT locus FROM affected)")
+
+        cols = ["locus", "name"] + LOCUS_COLS + ["n_rows", "max_prob"] + SEQ_COLS
+        rows = pd.DataFrame.from_records(con.execute(
+            "SELECT sl.locus, s.name, sl.cds_chr, sl.cds_starts, sl.cds_ends, sl.cds_strand, "
+            "sl.n_rows, sl.max_prob, sl.cds_seq, sl.aa_seq "
+            "FROM affected a JOIN sample_loci sl ON sl.locus = a.locus JOIN samples s ON s.sample_id = sl.sample_id "
+            "ORDER BY sl.locus, s.file_name"
+        ).fetchall(), columns=cols)
+
+        if len(rows):
+            locus_codes, loci = pd.factorize(rows["locus"], sort=True)
+            n_loci = len(loci)
+            by_locus = rows.groupby(locus_codes, sort=True)
+            firsts = by_locus[LOCUS_COLS + SEQ_COLS].first().reset_index(drop=True)
+
+            name_codes, names = pd.factorize(rows["name"], sort=True)
+            names = list(names)
+            patient_locus, patient_name, _ = code_pairs(locus_codes, name_codes, len(names))
+
+            agg = pd.DataFrame({"locus": loci})
+            for col in LOCUS_COLS:
+                agg[col] = firsts[col]
+            agg["n_patients"] = np.bincount(patient_locus, minlength=n_loci)
+            agg["patients"] = join_groups(patient_locus, [names[i] for i in patient_name.tolist()], n_loci)
+            agg["n_rows"] = np.bincount(locus_codes, weights=rows["n_rows"], minlength=n_loci).astype(np.int64)
+            agg["max_prob"] = pd.to_numeric(rows["max_prob"]).groupby(locus_codes).max().reset_index(drop=True)
+            for col in SEQ_COLS:
+                agg[col] = firsts[col]
+
+            types = pd.DataFrame.from_records(con.execute(
+                "SELECT st.locus, st.smorf_type, st.n "
+                "FROM affected a JOIN sample_types st ON st.locus = a.locus"
+            ).fetchall(), columns=["locus", "smorf_type", "n"])
+            type_codes, type_names = pd.factorize(types["smorf_type"], sort=True)
+            type_names = list(type_names)
+            groups, values, counts = code_pairs(
+                loci.get_indexer(types["locus"]), type_codes, len(type_names), weights=types["n"].to_numpy()
+            )
+            agg["smorf_type"] = join_most_common(groups, values, counts, type_names, n_loci)
+            agg["smorf_types"] = join_groups(groups, [type_names[v] for v in values.tolist()], n_loci)
+
+            con.executemany(
+                f"INSERT INTO loci ({', '.join(LOCI_COLS)}) VALUES ({', '.join('?' * len(LOCI_COLS))})",
+                sql_rows(agg[LOCI_COLS]),
+            )
+
+        con.execute("DELETE FROM affected")
+
+    def summary(self) -> pd.DataFrame:
+        """
+        The locus table of the samples in the store, as returned by aggregate_loci()
+        for the concatenation of their merged tables. Reads the maintained loci rows
+        only; nothing is recomputed here.
+        """
+        n_samples, *flags = self.con.execute(
+            "SELECT COUNT(*), " + ", ".join(f"COALESCE(MAX({flag}), 0)" for flag in FLAG_COLS.values()) + " FROM samples"
+        ).fetchone()
+        if n_samples == 0:
+            raise ValueError(f"{self.path}: the locus store holds no samples")
+        has = dict(zip(FLAG_COLS, flags))
+
+        agg = pd.DataFrame.from_records(
+            self.con.execute(f"SELECT {', '.join(LOCI_COLS)} FROM loci ORDER BY locus").fetchall(),
+            columns=LOCI_COLS,
+        )
+        if not has["sam_probability"]:
+            agg["max_prob"] = agg["n_rows"]
+        if not has["cds_seq"]:
+            agg["cds_seq"] = agg["n_rows"]
+        if not has["aa_seq"]:
+            agg = agg.drop(columns=["aa_seq"])
+        if not has["smorf_type"]:
+            agg = agg.drop(columns=["smorf_type", "smorf_types"])
+        return agg
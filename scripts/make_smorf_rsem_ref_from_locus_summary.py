@@ -1,32 +1,83 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import pandas as pd
+from table_io import iter_table_chunks, table_columns
+
+LOCUS_MAP_HEADER = "locus\ttranscript_id\n"
+
+def sequence_id(seq: str) -> str:
+    """Reference transcript id of a CDS when identical CDS are collapsed (content digest)."""
+    return "cds_" + hashlib.blake2b(seq.encode(), digest_size=12).hexdigest()
+
+def clean_chunk(chunk: pd.DataFrame) -> tuple:
+    """(loci, cleaned CDS sequences) of one chunk of loci, without missing/placeholder sequences."""
+    # Loci without a cds_seq are left out (before the chunked rewrite they became a ">locus\nNAN" record)
+    chunk = chunk[chunk["cds_seq"].notna()]
+    loci = chunk["locus"].map(str)
+    seqs = chunk["cds_seq"].map(str).str.replace(" ", "").str.replace("\n", "").str.upper()
+    keep = ~seqs.isin(["", "nan", "NA"]) # safeguards
+    return loci[keep].tolist(), seqs[keep].tolist()
+
+def write_chunk(loci: list, seqs: list, f_fa, f_map) -> int:
+    """One reference transcript per locus; returns how many were written."""
+    # transcript_id must be first token on the header line
+    f_fa.write("".join(f">{locus}\n{seq}\n" for locus, seq in zip(loci, seqs)))
+    # transcript_id \t gene_id
+    f_map.write("".join(f"{locus}\t{locus}\n" for locus in loci))
+    return len(loci)
+
+def write_collapsed_chunk(loci: list, seqs: list, seen: set, f_fa, f_map, f_loci) -> int:
+    """
+    One reference transcript per distinct CDS (named by sequence_id), written the first time the
+    sequence is seen; every locus goes to the locus map. Returns how many transcripts were written.
+    """
+    ids = [sequence_id(seq) for seq in seqs]
+    new = []
+    for tx_id, seq in zip(ids, seqs):
+        if tx_id not in seen:
+            seen.add(tx_id)
+            new.append((tx_id, seq))
+    f_fa.write("".join(f">{tx_id}\n{seq}\n" for tx_id, seq in new))
+    f_map.write("".join(f"{tx_id}\t{tx_id}\n" for tx_id, _ in new))
+    f_loci.write("".join(f"{locus}\t{tx_id}\n" for locus, tx_id in zip(loci, ids)))
+    return len(new)
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--loci_csv", required=True) # the merged .csv file from the previous step
+    ap.add_argument("--loci_csv", required=True) # the locus summary (.csv or .parquet) from the previous step
     ap.add_argument("--fasta", required=True)
     ap.add_argument("--tx2gene", required=True)
+    ap.add_argument("--locus_map", default=None,
+                    help="Optional: collapse loci with identical CDS into one reference transcript (cds_<digest>) "
+                         "and write the locus -> transcript_id table here, for add_rsem_tpms_to_locus_summary.py. "
+                         "Default: one transcript per locus, named after the locus.")
+    ap.add_argument("--chunksize", type=int, default=100_000,
+                    help="Loci read and written at a time; bounds memory use (default: 100000)")
     args = ap.parse_args()
 
-    df = pd.read_csv(args.loci_csv) # load the file
-
-    required = {"locus", "cds_seq"} # these are the columns we need
-    missing = required - set(df.columns)
+    required = {"locus", "cds_seq"}
+    missing = required - set(table_columns(args.loci_csv))
     if missing:
         raise SystemExit(f"Missing required columns in {args.loci_csv}: {sorted(missing)}")
 
-    # Write FASTA
+    # Only the columns we need, chunk by chunk
+    n_loci = n_tx = 0
+    chunks = iter_table_chunks(args.loci_csv, ["locus", "cds_seq"], args.chunksize, dtype=str)
     with open(args.fasta, "w") as f_fa, open(args.tx2gene, "w") as f_map:
-        for _, row in df.iterrows():
-            locus = str(row["locus"])
-            seq = str(row["cds_seq"]).replace(" ", "").replace("\n", "").upper()
-            if seq in ("", "nan", "NA"): # safeguards
-                continue
-            # transcript_id must be first token on the header line
-            f_fa.write(f">{locus}\n{seq}\n")
-            # transcript_id \t gene_id
-            f_map.write(f"{locus}\t{locus}\n")
+        if args.locus_map:
+            seen = set()  # digests only: memory grows with the distinct sequences, not their length
+            with open(args.locus_map, "w") as f_loci:
+                f_loci.write(LOCUS_MAP_HEADER)
+                for chunk in chunks:
+                    loci, seqs = clean_chunk(chunk)
+                    n_tx += write_collapsed_chunk(loci, seqs, seen, f_fa, f_map, f_loci)
+                    n_loci += len(loci)
+        else:
+            for chunk in chunks:
+                n_tx += write_chunk(*clean_chunk(chunk), f_fa, f_map)
+                n_loci = n_tx
+    print(f"Wrote {n_tx} smORF transcripts for {n_loci} loci to {args.fasta}")
 
 if __name__ == "__main__":
     main()
@@ -2,85 +2,94 @@
 # I run it with this command, but change the directories as needed:
 # python merge_shortstop_output.py \
 #   --root /storage/scratch01/users/sbarber/Workdir/results_shortstop \
-#   --outdir /storage/scratch01/users/sbarber/Workdir/merged_per_sample
+#   --outdir /storage/scratch01/users/sbarber/Workdir/merged_per_sample \
+#   --jobs 32
+# Samples whose merged table is newer than their inputs and was written with the same
+# --min_prob/--format are skipped (see merge_manifest.json in --outdir; --force re-merges all).
 
 import argparse
+import csv
+import fcntl
+import json
 import os
-import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
 import pandas as pd
+from add_smorf_type_to_gtf import read_sidecar, sidecar_path
+from gtf_stream import iter_records
+from table_io import FORMATS, MERGED_SCHEMA, write_table
 
 
-def clean_orf_id(x: str) -> str:
+def clean_orf_ids(ids: pd.Series) -> pd.Series:
     # Normalize orf_id like: '"""cds.STRG..."""' -> 'cds.STRG...'
-    if pd.isna(x):
-        return x
-    s = str(x).strip()
-    # remove surrounding quotes repeatedly
-    # e.g. """cds.X""" -> cds.X
-    s = re.sub(r'^\"+', '', s)
-    s = re.sub(r'\"+$', '', s)
-    # also remove single quotes if present
-    s = s.strip('"').strip("'")
-    return s
+    # Strip whitespace, then surrounding double quotes (repeated), then single quotes.
+    # Missing ids stay missing.
+    present = ids.notna()
+    cleaned = ids[present].astype(str).str.strip().str.strip('"').str.strip("'")
+    return cleaned.reindex(ids.index).where(present, ids)
+
+
+def sniff_delimiter(path: Path) -> str:
+    """
+    Delimiter of a CSV/TSV, sniffed from its header line (as pd.read_csv(sep=None) does).
+    Defaults to comma for single-column headers.
+    """
+    with open(path, "r", newline="") as fh:
+        header = fh.readline()
+    try:
+        return csv.Sniffer().sniff(header).delimiter
+    except csv.Error:
+        return ","
 
 
 def read_table(path: Path) -> pd.DataFrame:
     """
-    Read CSV/TSV with delimiter auto-detection. It is ususally comma, but just in case
+    Read CSV/TSV with delimiter auto-detection. It is ususally comma, but just in case.
+    Only the header is sniffed; the table itself is parsed by the C engine.
     """
-    return pd.read_csv(path, sep=None, engine="python")
-
-def parse_gtf_attrs(attr_str: str) -> dict:
-    attrs = {}
-    for part in attr_str.strip().split(";"):
-        part = part.strip()
-        if not part:
-            continue
-        if " " not in part:
-            continue
-        key, val = part.split(" ", 1)
-        attrs[key] = val.strip().strip('"')
-    return attrs
+    return pd.read_csv(path, sep=sniff_delimiter(path), float_precision="round_trip")
 
 def load_smorf_types(gtf_path: Path) -> dict:
+    """
+    gene_id -> smorf_type of the annotated GTF. Read from the index add_smorf_type_to_gtf.py
+    writes next to it; the GTF itself is only parsed if the index is missing or older.
+    """
+    sidecar = sidecar_path(gtf_path)
+    if sidecar.exists() and (not gtf_path.exists() or sidecar.stat().st_mtime >= gtf_path.stat().st_mtime):
+        return read_sidecar(sidecar)
+
     types = {}
     if not gtf_path.exists():
         return types
-    with open(gtf_path, "r") as fh:
-        for line in fh:
-            if not line or line.startswith("#"):
-                continue
-            parts = line.rstrip("\n").split("\t")
-            if len(parts) < 9:
-                continue
-            attrs = parse_gtf_attrs(parts[8])
-            gene_id = attrs.get("gene_id")
-            smorf_type = attrs.get("smorf_type")
-            if gene_id and smorf_type:
-                types.setdefault(gene_id, smorf_type)
+    for rec in iter_records(gtf_path, keys=("gene_id", "smorf_type")):
+        gene_id, smorf_type = rec.values
+        if gene_id and smorf_type:
+            types.setdefault(gene_id, smorf_type)
     return types
 
-def merge_one_sample(sample_dir: Path, out_dir: Path, min_prob: float | None) -> Path:
+def sample_inputs(sample_dir: Path) -> tuple:
     """
-    sample_dir should contain:
+    ShortStop inputs of a sample folder: predictions, sequences and the (optional) annotated GTF:
       sample_dir/shortstop/shortstop_output/predictions/sams.csv
       sample_dir/shortstop/shortstop_output/sequences/unknown_sequences.csv
+      sample_dir/shortstop/<sample>.smorfs_shortstop.gtf
     """
-    pred_path = (
-        sample_dir
-        / "shortstop"
-        / "shortstop_output"
-        / "predictions"
-        / "sams.csv"
-    )
-    seq_path = (
-        sample_dir
-        / "shortstop"
-        / "shortstop_output"
-        / "sequences"
-        / "unknown_sequences.csv"
-    )
+    shortstop = sample_dir / "shortstop"
+    pred_path = shortstop / "shortstop_output" / "predictions" / "sams.csv"
+    seq_path = shortstop / "shortstop_output" / "sequences" / "unknown_sequences.csv"
+    gtf_path = shortstop / f"{sample_dir.name}.smorfs_shortstop.gtf"
+    return pred_path, seq_path, gtf_path
+
+def merged_path(sample_dir: Path, out_dir: Path, fmt: str = "csv") -> Path:
+    return out_dir / f"{sample_dir.name}.merged{FORMATS[fmt]}"
+
+def merge_one_sample(sample_dir: Path, out_dir: Path, min_prob: float | None, fmt: str = "csv") -> Path:
+    """
+    sample_dir should contain the files of sample_inputs().
+    """
+    pred_path, seq_path, gtf_path = sample_inputs(sample_dir)
 
     if not pred_path.exists():
         raise FileNotFoundError(f"Missing predictions file: {pred_path}")
@@ -93,8 +102,8 @@ def merge_one_sample(sample_dir: Path, out_dir: Path, min_prob: float | None) ->
     if "orf_id" not in pred.columns or "orf_id" not in seq.columns:
         raise ValueError(f"orf_id missing in one of the inputs for sample {sample_dir.name}")
 
-    pred["orf_id_clean"] = pred["orf_id"].map(clean_orf_id)
-    seq["orf_id_clean"]  = seq["orf_id"].map(clean_orf_id)
+    pred["orf_id_clean"] = clean_orf_ids(pred["orf_id"])
+    seq["orf_id_clean"]  = clean_orf_ids(seq["orf_id"])
 
     if min_prob is not None and "probability" in pred.columns:
         pred = pred[pred["probability"] >= min_prob].copy()
@@ -115,7 +124,6 @@ def merge_one_sample(sample_dir: Path, out_dir: Path, min_prob: float | None) ->
     merged.drop(columns=["orf_id_clean"], inplace=True)
 
     # Add smORF type from annotated GTF, if present
-    gtf_path = sample_dir / "shortstop" / f"{sample_dir.name}.smorfs_shortstop.gtf"
     smorf_types = load_smorf_types(gtf_path)
     if smorf_types:
         merged["smorf_type"] = merged["orf_id"].map(smorf_types).fillna("NA")
@@ -123,11 +131,66 @@ def merge_one_sample(sample_dir: Path, out_dir: Path, min_prob: float | None) ->
         merged["smorf_type"] = "NA"
 
     out_dir.mkdir(parents=True, exist_ok=True)
-    out_path = out_dir / f"{sample_dir.name}.merged.csv"
-    merged.to_csv(out_path, index=False)
+    out_path = merged_path(sample_dir, out_dir, fmt)
+    write_table(merged, out_path, schema=MERGED_SCHEMA)
     return out_path
 
 
+def merge_settings(min_prob: float | None, fmt: str) -> dict:
+    """Settings a merged table depends on besides its inputs (recorded in the manifest)."""
+    return {"min_prob": min_prob, "format": fmt}
+
+def is_up_to_date(sample_dir: Path, out_dir: Path, settings: dict, previous: dict | None) -> bool:
+    """
+    True if the merged table exists, is newer than every input of the sample and the
+    manifest says it was written with the same settings.
+    """
+    out_path = merged_path(sample_dir, out_dir, settings["format"])
+    if previous is None or previous.get("status") not in ("ok", "skipped"):
+        return False
+    if previous.get("settings") != settings or not out_path.exists():
+        return False
+    inputs = [p for p in sample_inputs(sample_dir) if p.exists()]
+    if len(inputs) < 2:
+        return False
+    return out_path.stat().st_mtime >= max(p.stat().st_mtime for p in inputs)
+
+def merge_job(sample_dir: Path, out_dir: Path, min_prob: float | None, fmt: str) -> dict:
+    """merge_one_sample() as a manifest entry; runs in the worker processes."""
+    t0 = time.perf_counter()
+    try:
+        out_path = merge_one_sample(sample_dir, out_dir, min_prob, fmt)
+        entry = {"status": "ok", "output": str(out_path)}
+    except Exception as e:
+        entry = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+    entry["seconds"] = round(time.perf_counter() - t0, 3)
+    return entry
+
+def update_manifest(path: Path, entries: dict, run_info: dict) -> None:
+    """
+    Merges this run's per-sample entries into the JSON manifest. Concurrent runs (e.g. one
+    Snakemake job per sample) serialize on <manifest>.lock, and the file is replaced atomically.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = load_manifest(path)
+        manifest["samples"].update(entries)
+        manifest["last_run"] = run_info
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as fh:
+            json.dump(manifest, fh, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+def load_manifest(path: Path) -> dict:
+    if path.exists():
+        with open(path) as fh:
+            manifest = json.load(fh)
+        manifest.setdefault("samples", {})
+        return manifest
+    return {"samples": {}}
+
+
 def main():
     ap = argparse.ArgumentParser(
         description="Merge ShortStop sam_secreted predictions with unknown_sequences by orf_id for each sample."
@@ -140,6 +203,16 @@ def main():
                     help="Optional: keep only predictions with probability >= min_prob")
     ap.add_argument("--samples", nargs="*", default=None,
                     help="Optional: specific sample folder names to process (default: auto-discover)")
+    ap.add_argument("--format", choices=sorted(FORMATS), default="csv",
+                    help="Format of the merged tables: <sample>.merged.csv or <sample>.merged.parquet (default: csv)")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Samples merged concurrently, in separate processes (default: 1)")
+    ap.add_argument("--force", action="store_true",
+                    help="Merge every sample, even those whose merged table is up to date")
+    ap.add_argument("--manifest", default=None,
+                    help="JSON manifest of merged/skipped/failed samples with timings and settings "
+                         "(default: <outdir>/merge_manifest.json). Samples are only skipped as up to date "
+                         "when it records them as merged with the same --min_prob/--format.")
     args = ap.parse_args()
 
     root = Path(args.root)
@@ -151,17 +224,48 @@ def main():
         # auto-discover: folders directly under root
         samples = [p for p in root.iterdir() if p.is_dir()]
 
-    ok = 0
+    settings = merge_settings(args.min_prob, args.format)
+    manifest_path = Path(args.manifest) if args.manifest else outdir / "merge_manifest.json"
+    previous = load_manifest(manifest_path)["samples"]
+    started = datetime.now().isoformat(timespec="seconds")
+    t0 = time.perf_counter()
+
+    entries = {}
+    todo = []
     for sdir in sorted(samples):
-        try:
-            out_path = merge_one_sample(sdir, outdir, args.min_prob)
-            print(f"[OK] {sdir.name} -> {out_path}")
-            ok += 1
-        except Exception as e:
-            print(f"[FAIL] {sdir.name}: {e}")
+        if not args.force and is_up_to_date(sdir, outdir, settings, previous.get(sdir.name)):
+            entries[sdir.name] = {**previous[sdir.name], "status": "skipped", "seconds": 0.0}
+            print(f"[SKIP] {sdir.name}: up to date")
+        else:
+            todo.append(sdir)
+
+    def record(sdir, entry):
+        entries[sdir.name] = {**entry, "settings": settings}
+        if entry["status"] == "ok":
+            print(f"[OK] {sdir.name} -> {entry['output']} ({entry['seconds']:.1f}s)")
+        else:
+            print(f"[FAIL] {sdir.name}: {entry['error']}")
+
+    if args.jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(todo))) as pool:
+            futures = {pool.submit(merge_job, sdir, outdir, args.min_prob, args.format): sdir for sdir in todo}
+            for future in as_completed(futures):
+                record(futures[future], future.result())
+    else:
+        for sdir in todo:
+            record(sdir, merge_job(sdir, outdir, args.min_prob, args.format))
 
-    print(f"Done. Successful: {ok}/{len(samples)}")
+    counts = {status: sum(e["status"] == status for e in entries.values()) for status in ("ok", "skipped", "failed")}
+    update_manifest(manifest_path, entries, {
+        "started": started,
+        "seconds": round(time.perf_counter() - t0, 3),
+        "jobs": args.jobs,
+        "settings": settings,
+        **counts,
+    })
 
+    print(f"Done. Successful: {counts['ok'] + counts['skipped']}/{len(samples)} "
+          f"({counts['skipped']} up to date, {counts['failed']} failed). Manifest: {manifest_path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# k-mer pre-screen of paired FASTQs against the smORF CDS reference, before bowtie2.
+# I run it with this command, but change the paths as needed:
+# python prefilter_smorf_reads.py \
+#   --fasta results/results_rsem_smorf/reference/smorfs.cds.fa \
+#   --r1 S1_R1.fastq.gz --r2 S1_R2.fastq.gz \
+#   --out_r1 S1.prefilter_R1.fq --out_r2 S1.prefilter_R2.fq --stats S1.prefilter.json --threads 8
+#
+# A pair is kept when its mates share at least --min_hits k-mers with the reference (either
+# strand). Read k-mers are sampled every --step bases (plus the last one), so any exact match
+# of k + step - 1 bases is found. Pairs that bowtie2 could align to a smORF CDS nearly always
+# share such a stretch; everything else (usually >99% of the reads) never reaches bowtie2.
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import shutil
+import subprocess
+import time
+from itertools import islice
+
+COMPLEMENT = str.maketrans("ACGTN", "TGCAN")
+
+# Set in the parent before the worker processes are forked
+KMERS = set()
+
+
+def read_fasta_seqs(path):
+    seq = []
+    with open(path, "r") as fh:
+        for line in fh:
+            if line.startswith(">"):
+                if seq:
+                    yield "".join(seq).upper()
+                seq = []
+            else:
+                seq.append(line.strip())
+    if seq:
+        yield "".join(seq).upper()
+
+
+def reference_kmers(fasta, k: int) -> set:
+    """Every k-mer of the reference sequences and of their reverse complements (without N)."""
+    kmers = set()
+    for seq in read_fasta_seqs(fasta):
+        for strand in (seq, seq.translate(COMPLEMENT)[::-1]):
+            for i in range(len(strand) - k + 1):
+                kmer = strand[i:i + k]
+                if "N" not in kmer:
+                    kmers.add(kmer)
+    return kmers
+
+
+class PigzFastq:
+    """
+    Lines of a gzipped FASTQ decompressed by a `pigz -dc` subprocess. close() waits for pigz and
+    fails on a non-zero exit (corrupt or truncated file), as gzip.open would while reading.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.proc = subprocess.Popen(["pigz", "-dc", path], stdout=subprocess.PIPE, text=True, bufsize=1 << 20)
+
+    def __iter__(self):
+        return iter(self.proc.stdout)
+
+    def close(self):
+        self.proc.stdout.close()
+        returncode = self.proc.wait()
+        if returncode != 0:
+            raise SystemExit(f"pigz failed to decompress {self.path} (exit code {returncode})")
+
+
+def open_fastq(path):
+    """
+    Text handle of a plain or gzipped FASTQ; gzip is decompressed by pigz when available.
+    Close it once the reads are used up: for pigz, that is where a decompression error surfaces.
+    """
+    with open(path, "rb") as fh:
+        gzipped = fh.read(2) == b"\x1f\x8b"
+    if not gzipped:
+        return open(path, "r")
+    if shutil.which("pigz"):
+        return PigzFastq(path)
+    return gzip.open(path, "rt")
+
+
+def read_chunks(fh1, fh2, chunk_pairs: int):
+    """Text of the next chunk_pairs reads of both mates, in step (one string per mate, cheap to send to workers)."""
+    while True:
+        lines1 = list(islice(fh1, 4 * chunk_pairs))
+        lines2 = list(islice(fh2, 4 * chunk_pairs))
+        if len(lines1) != len(lines2):
+            # ValueError, not SystemExit: this may run in a Pool's task thread, which swallows SystemExit
+            raise ValueError("R1 and R2 FASTQs have different numbers of reads")
+        if not lines1:
+            return
+        yield "".join(lines1), "".join(lines2)
+
+
+def sampled_hits(seq: str, k: int, step: int, needed: int) -> int:
+    """Reference k-mers among the k-mers of seq at every step-th position (stops at `needed`)."""
+    last = len(seq) - k
+    if last < 0:
+        return 0
+    hits = 0
+    positions = range(0, last + 1, step)
+    for i in positions:
+        if seq[i:i + k] in KMERS:
+            hits += 1
+            if hits >= needed:
+                return hits
+    if last % step and seq[last:] in KMERS:
+        hits += 1
+    return hits
+
+
+def filter_chunk(job):
+    """(kept R1 text, kept R2 text, pairs in chunk, pairs kept) of one chunk."""
+    (text1, text2), k, step, min_hits = job
+    lines1, lines2 = text1.split("\n"), text2.split("\n")
+    kept1, kept2 = [], []
+    n = len(lines1) // 4
+    for j in range(0, 4 * n, 4):
+        hits = sampled_hits(lines1[j + 1], k, step, min_hits)
+        if hits < min_hits:
+            hits += sampled_hits(lines2[j + 1], k, step, min_hits - hits)
+        if hits >= min_hits:
+            kept1.append("\n".join(lines1[j:j + 4]))
+            kept2.append("\n".join(lines2[j:j + 4]))
+    return "".join(r + "\n" for r in kept1), "".join(r + "\n" for r in kept2), n, len(kept1)
+
+
+def main():
+    global KMERS
+    ap = argparse.ArgumentParser(description="Keep only read pairs sharing k-mers with the smORF CDS reference.")
+    ap.add_argument("--fasta", required=True, help="smORF CDS reference FASTA (smorfs.cds.fa)")
+    ap.add_argument("--r1", required=True, help="R1 FASTQ (.gz or plain)")
+    ap.add_argument("--r2", required=True, help="R2 FASTQ (.gz or plain)")
+    ap.add_argument("--out_r1", required=True, help="Kept R1 reads (plain FASTQ)")
+    ap.add_argument("--out_r2", required=True, help="Kept R2 reads (plain FASTQ)")
+    ap.add_argument("--stats", default=None, help="Optional: JSON with pairs read/kept, retention and timing")
+    ap.add_argument("-k", type=int, default=19, help="k-mer length (default: 19)")
+    ap.add_argument("--step", type=int, default=4,
+                    help="Check every step-th read k-mer: exact matches of k + step - 1 bases are always found (default: 4)")
+    ap.add_argument("--min_hits", type=int, default=1, help="Reference k-mers a pair must share (default: 1)")
+    ap.add_argument("--threads", type=int, default=1, help="Worker processes filtering chunks of reads (default: 1)")
+    ap.add_argument("--chunk_pairs", type=int, default=50_000, help="Read pairs per chunk (default: 50000)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    KMERS = reference_kmers(args.fasta, args.k)
+    print(f"Reference k-mers (k={args.k}, both strands): {len(KMERS)}")
+
+    fh1, fh2 = open_fastq(args.r1), open_fastq(args.r2)
+    jobs = ((chunk, args.k, args.step, args.min_hits) for chunk in read_chunks(fh1, fh2, args.chunk_pairs))
+    n_in = n_kept = 0
+    with open(args.out_r1, "w") as out1, open(args.out_r2, "w") as out2:
+        if args.threads > 1:
+            # fork: the workers inherit KMERS instead of receiving a pickled copy
+            with multiprocessing.get_context("fork").Pool(args.threads) as pool:
+                results = pool.imap(filter_chunk, jobs)
+                for kept1, kept2, n, kept in results:
+                    out1.write(kept1)
+                    out2.write(kept2)
+                    n_in += n
+                    n_kept += kept
+        else:
+            for kept1, kept2, n, kept in map(filter_chunk, jobs):
+                out1.write(kept1)
+                out2.write(kept2)
+                n_in += n
+                n_kept += kept
+    fh1.close()
+    fh2.close()
+
+    seconds = time.perf_counter() - t0
+    retention = n_kept / n_in if n_in else 0.0
+    print(f"Kept {n_kept}/{n_in} read pairs ({100 * retention:.3f}%) in {seconds:.1f}s")
+    if args.stats:
+        with open(args.stats, "w") as fh:
+            json.dump({
+                "pairs_in": n_in, "pairs_kept": n_kept, "retention": retention, "seconds": round(seconds, 3),
+                "k": args.k, "step": args.step, "min_hits": args.min_hits, "reference_kmers": len(KMERS),
+            }, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
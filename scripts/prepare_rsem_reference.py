@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Content-addressed rsem-prepare-reference for the smORF transcriptome.
+#
+# The reference (RSEM files + bowtie2 index) is built in <cache_dir>/<digest>/smorfs.*, where
+# the digest covers the sorted FASTA records and tx2gene lines. A FASTA/tx2gene pair with the
+# same content (e.g. after a metadata-only change of all_loci) reuses the existing build, so
+# the BAMs aligned against it stay valid. The digest is written to --digest_out.
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+# Bump when the rsem-prepare-reference command below changes
+BUILD_TAG = "rsem-prepare-reference --bowtie2 v1"
+PREFIX_NAME = "smorfs"
+
+
+def read_fasta_records(path) -> list:
+    """(header line without '>', sequence) records."""
+    records, header, chunks = [], None, []
+    with open(path, "r") as fh:
+        for line in fh:
+            line = line.rstrip("\n")
+            if line.startswith(">"):
+                if header is not None:
+                    records.append((header, "".join(chunks)))
+                header, chunks = line[1:], []
+            elif line:
+                chunks.append(line)
+    if header is not None:
+        records.append((header, "".join(chunks)))
+    return records
+
+
+def read_lines(path) -> list:
+    with open(path, "r") as fh:
+        return [line.rstrip("\n") for line in fh if line.strip()]
+
+
+def reference_digest(records: list, tx2gene: list) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{BUILD_TAG}\n".encode())
+    for header, seq in records:
+        digest.update(f">{header}\n{seq}\n".encode())
+    digest.update(b"#tx2gene\n")
+    for line in tx2gene:
+        digest.update(f"{line}\n".encode())
+    return digest.hexdigest()
+
+
+def build_reference(records: list, tx2gene: list, build_dir: Path) -> None:
+    build_dir.mkdir(parents=True)
+    fasta = build_dir / f"{PREFIX_NAME}.cds.fa"
+    tx2gene_path = build_dir / f"{PREFIX_NAME}.tx2gene.tsv"
+    with open(fasta, "w") as fh:
+        fh.write("".join(f">{header}\n{seq}\n" for header, seq in records))
+    with open(tx2gene_path, "w") as fh:
+        fh.write("".join(f"{line}\n" for line in tx2gene))
+
+    p = subprocess.run(
+        [
+            "rsem-prepare-reference",
+            "--transcript-to-gene-map", str(tx2gene_path),
+            "--bowtie2",
+            str(fasta), str(build_dir / PREFIX_NAME),
+        ],
+        text=True, capture_output=True,
+    )
+    if p.returncode != 0:
+        raise SystemExit(f"rsem-prepare-reference failed:\n{p.stdout}\n{p.stderr}")
+    (build_dir / f"{PREFIX_NAME}.done").touch()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build (or reuse) the smORF RSEM/bowtie2 reference, keyed by its content.")
+    ap.add_argument("--fasta", required=True, help="smORF CDS FASTA (make_smorf_rsem_ref_from_locus_summary.py)")
+    ap.add_argument("--tx2gene", required=True, help="transcript_id -> gene_id map of the FASTA")
+    ap.add_argument("--cache_dir", required=True, help="Reference builds are kept in <cache_dir>/<digest>/")
+    ap.add_argument("--digest_out", required=True, help="File the digest of the reference is written to")
+    args = ap.parse_args()
+
+    # Sorted, so the digest and the build do not depend on the order of the loci
+    records = sorted(read_fasta_records(args.fasta))
+    tx2gene = sorted(read_lines(args.tx2gene))
+    if not records:
+        raise SystemExit(f"No sequences in {args.fasta}")
+    digest = reference_digest(records, tx2gene)
+
+    cache_dir = Path(args.cache_dir)
+    ref_dir = cache_dir / digest
+    if (ref_dir / f"{PREFIX_NAME}.done").exists():
+        print(f"Reusing RSEM reference {ref_dir} ({len(records)} transcripts)")
+    else:
+        # Built aside and renamed into place, so an interrupted build is never reused
+        build_dir = cache_dir / f"{digest}.tmp{os.getpid()}"
+        if build_dir.exists():
+            shutil.rmtree(build_dir)
+        print(f"Building RSEM reference {ref_dir} ({len(records)} transcripts)...")
+        build_reference(records, tx2gene, build_dir)
+        if ref_dir.exists():
+            shutil.rmtree(ref_dir)  # leftover without .done
+        os.replace(build_dir, ref_dir)
+
+    with open(args.digest_out, "w") as fh:
+        fh.write(digest + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# Exact/substring lookup of peptides in a protein FASTA (the human proteome), used by
+# blastp_append_human_homology.py to resolve peptides before BLAST.
+#
+#   index = ProteomeIndex.cached("human_proteome.faa", "results/blastdb/proteome_index")
+#   hit = index.find("MKTAYIAKQR")   # (protein_id, title) of the first protein containing it, or None
+#
+# The proteins are concatenated into one buffer and every 5-mer of standard residues is
+# indexed (positions sorted by k-mer code). A query is seeded with its rarest 5-mer and the
+# few candidate positions are compared directly, so lookups do not scan the proteome.
+# The index is stored as a single .npz named after the checksum of the FASTA.
+
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from gtf_stream import file_checksum
+
+K = 5
+ALPHABET = b"ACDEFGHIKLMNPQRSTVWY"
+INDEX_VERSION = 1
+
+# residue -> 1..20; anything else (X, U, separators...) -> 0 and is never used as a seed
+ENCODE = np.zeros(256, dtype=np.int32)
+for _i, _aa in enumerate(ALPHABET):
+    ENCODE[_aa] = _i + 1
+
+
+def read_fasta(path):
+    """(header without '>', upper-case sequence) records."""
+    header, chunks = None, []
+    with open(path, "r") as fh:
+        for line in fh:
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(chunks).upper()
+                header, chunks = line[1:].strip(), []
+            else:
+                chunks.append(line.strip())
+    if header is not None:
+        yield header, "".join(chunks).upper()
+
+
+def kmer_codes(encoded: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Base-21 code of every K-mer of an encoded sequence, and whether it is all standard residues."""
+    n = len(encoded) - K + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=bool)
+    codes = np.zeros(n, dtype=np.int32)
+    valid = np.ones(n, dtype=bool)
+    for j in range(K):
+        window = encoded[j:j + n]
+        codes = codes * 21 + window
+        valid &= window > 0
+    return codes, valid
+
+
+class ProteomeIndex:
+    def __init__(self, buffer: bytes, starts: np.ndarray, headers: list, positions: np.ndarray, bounds: np.ndarray):
+        self.buffer = buffer        # proteins joined by "\n"
+        self.starts = starts        # offset of each protein in buffer
+        self.headers = headers      # FASTA header of each protein
+        self.positions = positions  # K-mer positions, grouped by K-mer code, ascending inside each group
+        self.bounds = bounds        # positions of code c are positions[bounds[c]:bounds[c + 1]]
+
+    @classmethod
+    def cached(cls, fasta_path, index_dir):
+        """Index of fasta_path from index_dir, built and stored first if the FASTA changed."""
+        index_path = Path(index_dir) / f"{file_checksum(fasta_path)}.v{INDEX_VERSION}.npz"
+        if index_path.exists():
+            index = cls.load(index_path)
+            print(f"Proteome index '{index_path}' loaded.")
+            return index
+
+        print(f"Indexing proteome '{fasta_path}'...")
+        index = cls.from_fasta(fasta_path)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        index.save(index_path)
+        print(f"Proteome index '{index_path}' created successfully.")
+        return index
+
+    @classmethod
+    def from_fasta(cls, fasta_path):
+        headers, seqs = [], []
+        for header, seq in read_fasta(fasta_path):
+            headers.append(header)
+            seqs.append(seq)
+
+        buffer = "\n".join(seqs).encode("ascii", errors="replace")
+        starts = np.zeros(len(seqs), dtype=np.int64)
+        if seqs:
+            starts[1:] = np.cumsum([len(s) + 1 for s in seqs[:-1]])
+
+        codes, valid = kmer_codes(ENCODE[np.frombuffer(buffer, dtype=np.uint8)])
+        positions = np.flatnonzero(valid)
+        codes = codes[valid]
+        # Stable: positions stay ascending (FASTA order) inside each K-mer
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=21 ** K)
+        bounds = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return cls(buffer, starts, headers, positions[order].astype(np.uint32), bounds)
+
+    @classmethod
+    def load(cls, index_path):
+        with np.load(index_path) as data:
+            return cls(
+                data["buffer"].tobytes(),
+                data["starts"],
+                data["headers"].tobytes().decode("utf-8").split("\n"),
+                data["positions"],
+                data["bounds"],
+            )
+
+    def save(self, index_path):
+        """Written next to its final path and renamed, so concurrent jobs never load a partial index."""
+        tmp_path = f"{index_path}.tmp{os.getpid()}.npz"
+        np.savez(
+            tmp_path,
+            buffer=np.frombuffer(self.buffer, dtype=np.uint8),
+            starts=self.starts,
+            headers=np.frombuffer("\n".join(self.headers).encode("utf-8"), dtype=np.uint8),
+            positions=self.positions,
+            bounds=self.bounds,
+        )
+        os.replace(tmp_path, index_path)
+
+    def find(self, peptide: str) -> Optional[Tuple[str, str]]:
+        """
+        (protein id, FASTA title) of the first protein, in FASTA order, that contains the
+        peptide exactly; None if there is none. The id is the first word of the header.
+        """
+        query = peptide.encode("ascii", errors="replace")
+        codes, valid = kmer_codes(ENCODE[np.frombuffer(query, dtype=np.uint8)])
+        if not valid.any():
+            return None
+
+        # Seed with the rarest K-mer of the peptide
+        offsets = np.flatnonzero(valid)
+        counts = self.bounds[codes[offsets] + 1] - self.bounds[codes[offsets]]
+        best = int(np.argmin(counts))
+        if counts[best] == 0:
+            return None
+        offset, code = int(offsets[best]), int(codes[offsets[best]])
+
+        buffer, n = self.buffer, len(query)
+        for pos in self.positions[self.bounds[code]:self.bounds[code + 1]].tolist():
+            start = pos - offset
+            if start >= 0 and buffer[start:start + n] == query:
+                header = self.headers[int(np.searchsorted(self.starts, start, side="right")) - 1]
+                return header.split(None, 1)[0], header
+        return None
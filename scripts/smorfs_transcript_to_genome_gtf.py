@@ -1,180 +1,185 @@
 #!/usr/bin/env python3
 
 import argparse # to handle command-line arguments
-from collections import defaultdict, namedtuple
-
-Exon = namedtuple("Exon", ["chrom", "start", "end", "strand"]) # object to store exon information
-
-def parse_transcript_spans(gtf_path):
-    spans = {}
-    with open(gtf_path) as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            cols = line.rstrip("\n").split("\t")
-            if len(cols) < 9:
-                continue
-            chrom, source, feature, start, end, score, strand, frame, attrs = cols
-            if feature != "transcript":
-                continue
-
-            transcript_id = None
-            for field in attrs.split(";"):
-                field = field.strip()
-                if field.startswith("transcript_id"):
-                    parts = field.split()
-                    if len(parts) > 1:
-                        transcript_id = parts[1].strip('"')
-                    break
-            if transcript_id is None:
-                continue
-
-            spans[transcript_id] = (chrom, int(start), int(end), strand)
-    return spans
-
-def parse_transcript_exons(gtf_path): # parse GTF to get exons foe each transcript
-    exons_by_tx = defaultdict(list) # 
-
-    with open(gtf_path) as f:
-        for line in f:
-            if line.startswith("#"): # skip comments
-                continue
-            cols = line.rstrip("\n").split("\t") # split line into columns
-            if len(cols) < 9:
-                continue
-            chrom, source, feature, start, end, score, strand, frame, attrs = cols # unpack columns
-            if feature != "exon": # only process exon features
-                continue
-
-            transcript_id = None # initialize transcript_id
-            for field in attrs.split(";"): # parse attributes to find transcript_id
-                field = field.strip()
-                if field.startswith("transcript_id"): # i
-                    parts = field.split()
-                    if len(parts) > 1:
-                        transcript_id = parts[1].strip('"')
-                    break
-
+import sys
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from gtf_stream import iter_records
+
+
+class TranscriptModels:
+    """
+    StringTie transcript models built in a single pass over the GTF, stored in flat arrays.
+
+    Exons of transcript i live in [exon_offsets[i], exon_offsets[i + 1]) of the exon
+    arrays, in transcript orientation (5' -> 3'). exon_tx_starts holds the 1-based
+    transcript coordinate where each exon begins (cumulative exon lengths), so ORF
+    coordinates are placed on their exons with a binary search.
+    """
+
+    def __init__(self, gtf_path):
+        self.tx_index = {}       # transcript_id -> i
+        self.exon_chrom = []     # chrom/strand of the transcript's first exon (None if no exons)
+        self.exon_strand = []
+        self.span_chrom = []     # transcript line span (None if no transcript line)
+        self.span_start = array("I")
+        self.span_end = array("I")
+
+        exon_tx = array("I")
+        exon_start = array("I")
+        exon_end = array("I")
+
+        for rec in iter_records(gtf_path, features={"transcript", "exon"}, keys=("transcript_id",)):
+            transcript_id, = rec.values
             if transcript_id is None: # if no transcript_id found, skip
                 continue
 
-            exons_by_tx[transcript_id].append( # add exon to the list for this transcript
-                Exon(chrom=chrom, start=int(start), end=int(end), strand=strand)
-            )
-
-    tx_to_exons = {} # final mapping of transcript_id to (strand, sorted exons)
-    for tx_id, exons in exons_by_tx.items():
-        if not exons:
-            continue
-        strand = exons[0].strand # assume all exons have the same strand
-        exons_sorted = sorted(exons, key=lambda e: e.start) 
-        tx_to_exons[tx_id] = (strand, exons_sorted) # store strand and sorted exons
-
-    return tx_to_exons
-
-
-def map_orf_to_genome(tx_exons, strand, orf_start_tx, orf_end_tx): # map ORF coordinates from transcrip to genome
-    segments = []
-
-    if strand == "+":
-        ordered_exons = tx_exons
-    else:
-        ordered_exons = list(reversed(tx_exons))
-
-    tx_pos = 1
-    for exon in ordered_exons:
-        exon_len = exon.end - exon.start + 1
-        exon_tx_start = tx_pos
-        exon_tx_end = tx_pos + exon_len - 1
-
-        ov_start = max(orf_start_tx, exon_tx_start)
-        ov_end = min(orf_end_tx, exon_tx_end)
-
-        if ov_start <= ov_end:
-            offset_start = ov_start - exon_tx_start
-            offset_end = ov_end - exon_tx_start
-
-            if strand == "+":
-                g_start = exon.start + offset_start
-                g_end = exon.start + offset_end
+            i = self.tx_index.get(transcript_id)
+            if i is None:
+                i = self.tx_index[transcript_id] = len(self.exon_chrom)
+                self.exon_chrom.append(None)
+                self.exon_strand.append(None)
+                self.span_chrom.append(None)
+                self.span_start.append(0)
+                self.span_end.append(0)
+
+            if rec.feature == "transcript":
+                self.span_chrom[i] = sys.intern(rec.seqid)
+                self.span_start[i] = rec.start
+                self.span_end[i] = rec.end
             else:
-                g_end = exon.end - offset_start
-                g_start = exon.end - offset_end
-                if g_start > g_end:
-                    g_start, g_end = g_end, g_start
-
-            segments.append((exon.chrom, g_start, g_end, exon.strand))
-
-        tx_pos += exon_len
-        if tx_pos > orf_end_tx:
-            break
-
-    return segments
+                if self.exon_chrom[i] is None: # assume all exons have the same chrom/strand
+                    self.exon_chrom[i] = sys.intern(rec.seqid)
+                    self.exon_strand[i] = rec.strand
+                exon_tx.append(i)
+                exon_start.append(rec.start)
+                exon_end.append(rec.end)
+
+        # group exons by transcript, sorted by genomic start (stable, so ties keep file order)
+        order = sorted(range(len(exon_tx)), key=lambda k: (exon_tx[k] << 32) | exon_start[k])
+
+        n_tx = len(self.exon_chrom)
+        self.exon_offsets = array("I", [0]) * (n_tx + 1)
+        for k in order:
+            self.exon_offsets[exon_tx[k] + 1] += 1
+        for i in range(n_tx):
+            self.exon_offsets[i + 1] += self.exon_offsets[i]
+
+        self.exon_starts = array("I", (exon_start[k] for k in order))
+        self.exon_ends = array("I", (exon_end[k] for k in order))
+        del exon_tx, exon_start, exon_end, order
+
+        # transcript orientation and cumulative exon lengths
+        self.exon_tx_starts = array("I", [0]) * len(self.exon_starts)
+        for i in range(n_tx):
+            lo, hi = self.exon_offsets[i], self.exon_offsets[i + 1]
+            if self.exon_strand[i] != "+":
+                self.exon_starts[lo:hi] = self.exon_starts[lo:hi][::-1]
+                self.exon_ends[lo:hi] = self.exon_ends[lo:hi][::-1]
+            tx_pos = 1
+            for k in range(lo, hi):
+                self.exon_tx_starts[k] = tx_pos
+                tx_pos += self.exon_ends[k] - self.exon_starts[k] + 1
+
+    def __contains__(self, tx_id):
+        i = self.tx_index.get(tx_id)
+        return i is not None and self.exon_chrom[i] is not None
+
+    def span(self, tx_id):
+        """(chrom, start, end) of the transcript line, or None."""
+        i = self.tx_index.get(tx_id)
+        if i is None or self.span_chrom[i] is None:
+            return None
+        return self.span_chrom[i], self.span_start[i], self.span_end[i]
+
+    def exons(self, tx_id):
+        """(chrom, start, end, strand) of every exon, sorted by genomic start."""
+        i = self.tx_index[tx_id]
+        lo, hi = self.exon_offsets[i], self.exon_offsets[i + 1]
+        chrom, strand = self.exon_chrom[i], self.exon_strand[i]
+        ks = range(lo, hi) if strand == "+" else range(hi - 1, lo - 1, -1)
+        return [(chrom, self.exon_starts[k], self.exon_ends[k], strand) for k in ks]
+
+    def strand(self, tx_id):
+        return self.exon_strand[self.tx_index[tx_id]]
+
+    def map_orf_to_genome(self, tx_id, orf_start_tx, orf_end_tx): # map ORF coordinates from transcript to genome
+        i = self.tx_index[tx_id]
+        lo, hi = self.exon_offsets[i], self.exon_offsets[i + 1]
+        chrom, strand = self.exon_chrom[i], self.exon_strand[i]
+        tx_starts, starts, ends = self.exon_tx_starts, self.exon_starts, self.exon_ends
+
+        # first exon that can contain the ORF start
+        first = max(lo, bisect_right(tx_starts, orf_start_tx, lo, hi) - 1)
+
+        segments = []
+        for k in range(first, hi):
+            exon_tx_start = tx_starts[k]
+            if exon_tx_start > orf_end_tx:
+                break
+            exon_tx_end = exon_tx_start + ends[k] - starts[k]
+
+            ov_start = max(orf_start_tx, exon_tx_start)
+            ov_end = min(orf_end_tx, exon_tx_end)
+
+            if ov_start <= ov_end:
+                offset_start = ov_start - exon_tx_start
+                offset_end = ov_end - exon_tx_start
+
+                if strand == "+":
+                    g_start = starts[k] + offset_start
+                    g_end = starts[k] + offset_end
+                else:
+                    g_end = ends[k] - offset_start
+                    g_start = ends[k] - offset_end
+                    if g_start > g_end:
+                        g_start, g_end = g_end, g_start
+
+                segments.append((chrom, g_start, g_end, strand))
+
+        return segments
 
 def build_smorfs_genomic_gtf(merged_gtf, smorfs_gff3, out_gtf):
-    tx_to_exons = parse_transcript_exons(merged_gtf)
-    tx_to_span = parse_transcript_spans(merged_gtf)
+    models = TranscriptModels(merged_gtf)
 
     # Store ORF -> CDS segments first
     orf_segments = defaultdict(list)
     orf_meta = {}  # (chrom, strand, tx_id)
 
-    with open(smorfs_gff3) as fin:
-        for line in fin:
-            if line.startswith("#"):
-                continue
-            cols = line.rstrip("\n").split("\t")
-            if len(cols) < 9:
-                continue
-
-            seqid, source, feature, start, end, score, strand, frame, attrs = cols
-            if feature != "CDS":
-                continue
-
-            tx_id = seqid
-
-            parent = None
-            for field in attrs.split(";"):
-                field = field.strip()
-                if field.startswith("Parent="):
-                    parent = field.split("=", 1)[1]
-                    break
-
-            if tx_id not in tx_to_exons and parent:
-                base = parent
-                # TransDecoder / your pipeline sometimes prefixes ORFs with "cds."
-                if base.startswith("cds."):
-                    base = base[len("cds.") :]
-                # your pipeline sometimes appends ".p<number>"
-                base = base.split(".p")[0]
-                if base in tx_to_exons:
-                    tx_id = base
-
-            if tx_id not in tx_to_exons:
-                continue
+    for rec in iter_records(smorfs_gff3, features={"CDS"}, keys=("Parent", "ID"), fmt="gff3"):
+        tx_id = rec.seqid
+        parent, orf_id = rec.values
+
+        if tx_id not in models and parent:
+            base = parent
+            # TransDecoder / your pipeline sometimes prefixes ORFs with "cds."
+            if base.startswith("cds."):
+                base = base[len("cds.") :]
+            # your pipeline sometimes appends ".p<number>"
+            base = base.split(".p")[0]
+            if base in models:
+                tx_id = base
+
+        if tx_id not in models:
+            continue
 
-            orf_start_tx = int(start)
-            orf_end_tx = int(end)
-            strand_tx, exons = tx_to_exons[tx_id]
+        orf_start_tx = rec.start
+        orf_end_tx = rec.end
+        strand_tx = models.strand(tx_id)
 
-            segments = map_orf_to_genome(exons, strand_tx, orf_start_tx, orf_end_tx)
-            if not segments:
-                continue
+        segments = models.map_orf_to_genome(tx_id, orf_start_tx, orf_end_tx)
+        if not segments:
+            continue
 
-            orf_id = None
-            for field in attrs.split(";"):
-                field = field.strip()
-                if field.startswith("ID="):
-                    orf_id = field.split("=", 1)[1]
-                    break
-            if orf_id is None:
-                orf_id = f"{tx_id}_orf_{orf_start_tx}_{orf_end_tx}"
+        if orf_id is None:
+            orf_id = f"{tx_id}_orf_{orf_start_tx}_{orf_end_tx}"
 
-            for seg in segments:
-                orf_segments[orf_id].append(seg)
+        for seg in segments:
+            orf_segments[orf_id].append(seg)
 
-            # save meta for transcript line
-            orf_meta[orf_id] = (strand_tx, tx_id)
+        # save meta for transcript line
+        orf_meta[orf_id] = (strand_tx, tx_id)
 
     # Write transcript + CDS
     with open(out_gtf, "w") as fout:
@@ -182,8 +187,9 @@ def build_smorfs_genomic_gtf(merged_gtf, smorfs_gff3, out_gtf):
             strand, tx_id = orf_meta[orf_id]
 
             # transcript span: take from StringTie transcript model (gives UTR/flanks)
-            if tx_id in tx_to_span:
-                tx_chrom, tx_start, tx_end, _ = tx_to_span[tx_id]
+            span = models.span(tx_id)
+            if span is not None:
+                tx_chrom, tx_start, tx_end = span
             else:
             # fallback (should be rare): use CDS span
                 tx_chrom = segments[0][0]
@@ -205,18 +211,17 @@ def build_smorfs_genomic_gtf(merged_gtf, smorfs_gff3, out_gtf):
             ]) + "\n")
 
             # write exon lines for the full transcript model (StringTie exons)
-            if tx_id in tx_to_exons:
-                strand_tx, exons = tx_to_exons[tx_id]
-                for exon in exons:
+            if tx_id in models:
+                for exon_chrom, exon_start, exon_end, exon_strand in models.exons(tx_id):
                     exon_attrs = f'gene_id "{orf_id}"; transcript_id "{orf_id}";'
                     fout.write("\t".join([
-                        exon.chrom,
+                        exon_chrom,
                         "smORFmapper",
                         "exon",
-                        str(exon.start),
-                        str(exon.end),
+                        str(exon_start),
+                        str(exon_end),
                         ".",
-                        exon.strand,
+                        exon_strand,
                         ".",
                         exon_attrs
                         ]) + "\n")
@@ -0,0 +1,152 @@
+# Reading/writing the tables handed between the cohort steps (merged_per_sample,
+# locus summaries, TPM tables), as CSV or Parquet. The format follows the file suffix:
+#
+#   from table_io import read_table, write_table
+#   df = read_table("cohort.all_loci.parquet", columns=["locus", "cds_seq"])
+#   write_table(df, "cohort.all_loci.with_tpms.parquet", schema=LOCUS_SCHEMA)
+#
+# Parquet needs pyarrow, which is only imported when a .parquet path is used.
+
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import pandas as pd
+
+PARQUET_SUFFIX = ".parquet"
+FORMATS = {"csv": ".csv", "parquet": PARQUET_SUFFIX}
+
+# Explicit column types of the tables written as Parquet. Columns that are not listed
+# (e.g. the ShortStop feature columns of the merged tables) keep the type pandas inferred.
+MERGED_SCHEMA = {
+    "orf_id": "string",
+    "sam_probability": "float64",
+    "classification": "string",
+    "aa_seq": "string",
+    "length": "int64",
+    "type": "string",
+    "cds_chr": "string",
+    "cds_starts": "int64",
+    "cds_ends": "int64",
+    "cds_strand": "string",
+    "cds_seq": "string",
+    "smorf_type": "string",
+}
+
+LOCUS_SCHEMA = {
+    "locus": "string",
+    "cds_chr": "string",
+    "cds_starts": "int64",
+    "cds_ends": "int64",
+    "cds_strand": "string",
+    "n_patients": "int64",
+    "patients": "string",
+    "n_rows": "int64",
+    "max_prob": "float64",
+    "cds_seq": "string",
+    "aa_seq": "string",
+    "smorf_type": "string",
+    "smorf_types": "string",
+    "tpms": "string",
+    "human_best_pident": "float64",
+    "human_best_qcov": "float64",
+    "human_best_hit_id": "string",
+    "human_best_hit_title": "string",
+}
+
+
+# Strings pd.read_csv reads as null by default. String columns are written to Parquet
+# with these as nulls, so both formats give the same values downstream (e.g. the "NA"
+# smorf_type of merge_shortstop_output.py).
+CSV_NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+
+def is_parquet(path) -> bool:
+    return Path(path).suffix == PARQUET_SUFFIX
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet tables need pyarrow (conda install -c conda-forge pyarrow)")
+    return pyarrow
+
+
+def table_columns(path) -> list:
+    """Column names of a CSV or Parquet table, without reading its rows."""
+    if is_parquet(path):
+        return _pyarrow().parquet.read_schema(path).names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def read_table(path, columns: Optional[Iterable[str]] = None, **csv_kwargs) -> pd.DataFrame:
+    """
+    Reads a CSV or Parquet table.
+    columns: only read these columns; names missing from the table are ignored.
+    csv_kwargs are passed to pd.read_csv for CSV tables.
+    """
+    if columns is not None:
+        wanted = list(columns)
+        present = set(table_columns(path))
+        columns = [c for c in wanted if c in present]
+    if is_parquet(path):
+        _pyarrow()
+        return pd.read_parquet(path, columns=columns)
+    if columns is not None:
+        csv_kwargs["usecols"] = columns
+    return pd.read_csv(path, **csv_kwargs)
+
+
+def iter_table_chunks(path, columns: Iterable[str], chunksize: int, **csv_kwargs) -> Iterator[pd.DataFrame]:
+    """
+    Reads `columns` of a CSV or Parquet table in DataFrames of at most `chunksize` rows
+    (Parquet: record batches), so memory does not grow with the table.
+    Names missing from the table are ignored, as in read_table.
+    """
+    present = set(table_columns(path))
+    columns = [c for c in columns if c in present]
+    if is_parquet(path):
+        parquet_file = _pyarrow().parquet.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+        return
+    with pd.read_csv(path, usecols=columns, chunksize=chunksize, **csv_kwargs) as reader:
+        yield from reader
+
+
+def _arrow_table(df: pd.DataFrame, schema: dict):
+    pa = _pyarrow()
+    fields = []
+    arrays = []
+    for col in df.columns:
+        values = df[col]
+        kind = schema.get(col)
+        if kind == "string":
+            values = values.astype(object).where(values.notna(), None).map(
+                lambda v: None if v is None or str(v) in CSV_NA_VALUES else str(v)
+            )
+            arrays.append(pa.array(values, type=pa.string()))
+        elif kind == "int64":
+            # Non-numeric values become nulls, as pd.to_numeric(errors="coerce") does downstream
+            values = pd.to_numeric(values, errors="coerce")
+            arrays.append(pa.array(pd.array(values, dtype="Int64"), type=pa.int64()))
+        elif kind == "float64":
+            arrays.append(pa.array(pd.to_numeric(values), type=pa.float64(), from_pandas=True))
+        else:
+            arrays.append(pa.array(values, from_pandas=True))
+        fields.append(pa.field(col, arrays[-1].type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def write_table(df: pd.DataFrame, path, schema: Optional[dict] = None) -> None:
+    """
+    Writes a table as Parquet (with the column types of `schema`) or CSV, by suffix.
+    """
+    if is_parquet(path):
+        _pyarrow().parquet.write_table(_arrow_table(df, schema or {}), path)
+    else:
+        df.to_csv(path, index=False)